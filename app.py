@@ -1,34 +1,57 @@
-from flask import Flask, request, session, render_template, jsonify
-from openai import AzureOpenAI
+from flask import Flask, g, request, session, render_template, jsonify
+from openai import RateLimitError
 import base64
 from PIL import Image as PILImage
 from io import BytesIO
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from uuid import uuid4
 import re
 import html
 from typing import Tuple, Optional
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import fcntl
 import os
+import hashlib
 from dotenv import load_dotenv
 import random
 import datetime
 from werkzeug.utils import secure_filename
 import mimetypes
-from azure.storage.blob import BlobServiceClient, BlobClient
-from azure.identity import DefaultAzureCredential
-from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobClient
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 import urllib.parse
 import traceback
 from threading import Lock
+from sqlalchemy import and_, inspect, or_, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
-from config import FOOD_SYSTEM_PROMPT, PROTECTIVE_SYSTEM_PROMPT
+from sqlalchemy.orm import deferred, load_only, undefer_group
+from config import FOOD_SYSTEM_PROMPT, PROTECTIVE_SYSTEM_PROMPT, gunicorn_threads, gunicorn_workers
 from copy import deepcopy
 import logging
 from jwt import PyJWTError
 import jwt
 from services.email_service import EmailService
+from services.answer_cache import AnswerCache, IndexVersionTracker
+from services.request_control import Deadline, InflightRegistry, RequestCancelled
+from services.completion import estimate_tokens, stream_chat_completion
+from services.token_scheduler import AdmissionRejected, TokenRateScheduler, retry_after_seconds
+from services.deployment_pool import DeploymentPool, DeploymentUnavailable
+from services.query_router import QueryRouter, Route
+from services.fast_path import FastPathEngine
+from services.degradation import DegradationController
+from services.db_migrations import Migration, MigrationRunner
+from services.janitor import Janitor
+from services.sqlite_profile import SQLiteProfile
+from services.write_behind import WriteBehindQueue
+from services.json_codec import CompressedJSON, json_codec
+from services.shard_router import ShardRouter
+from services.azure_clients import azure_clients
+from services.telemetry import HourlyBlobNames, TelemetrySpool, TelemetryWriter, hourly_partition
+import atexit
 import time
 
 # Configure logging
@@ -57,6 +80,10 @@ class Config:
         if value is None and required:
             raise ValueError(f"Required environment variable '{key}' is not set")
             
+        if value is not None and var_type == bool and isinstance(value, str):
+            # bool('False') is True, so parse the common spellings explicitly
+            return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
         if value is not None and var_type != str:
             try:
                 value = var_type(value)
@@ -80,10 +107,15 @@ class Config:
         cls.IS_LOCAL_DEV = cls.get_env('IS_LOCAL_DEV', default=False, var_type=bool)
         
         # Azure OpenAI Configuration
-        cls.AZURE_OPENAI_ENDPOINT = cls.get_env('AZURE_OPENAI_ENDPOINT', required=True)
-        cls.AZURE_OPENAI_KEY = cls.get_env('AZURE_OPENAI_KEY', required=True)
+        # AZURE_OPENAI_DEPLOYMENTS (JSON list) replaces the single endpoint/deployment pair
+        cls.AZURE_OPENAI_DEPLOYMENTS = cls.get_env('AZURE_OPENAI_DEPLOYMENTS')
+        single_deployment = not cls.AZURE_OPENAI_DEPLOYMENTS
+        cls.AZURE_OPENAI_ENDPOINT = cls.get_env('AZURE_OPENAI_ENDPOINT', required=single_deployment)
+        cls.AZURE_OPENAI_KEY = cls.get_env('AZURE_OPENAI_KEY', required=single_deployment)
         cls.AZURE_OPENAI_API_VERSION = cls.get_env('AZURE_OPENAI_API_VERSION', '2024-02-15-preview')
-        cls.AZURE_OPENAI_DEPLOYMENT = cls.get_env('AZURE_OPENAI_DEPLOYMENT', required=True)
+        cls.AZURE_OPENAI_DEPLOYMENT = cls.get_env('AZURE_OPENAI_DEPLOYMENT', required=single_deployment)
+        cls.AZURE_OPENAI_ROUTING = cls.get_env('AZURE_OPENAI_ROUTING', 'least_latency')
+        cls.AZURE_OPENAI_FAILOVER_COOLDOWN_SECONDS = cls.get_env('AZURE_OPENAI_FAILOVER_COOLDOWN_SECONDS', 30, var_type=int)
         cls.AZURE_OPENAI_MESSAGE_HISTORY_LIMIT = cls.get_env('AZURE_OPENAI_MESSAGE_HISTORY_LIMIT', 10, var_type=int)
         cls.AZURE_OPENAI_TEMPERATURE = cls.get_env('AZURE_OPENAI_TEMPERATURE', 0.7, var_type=float)
         
@@ -134,12 +166,101 @@ class Config:
         
         # Chat Control Configuration
         cls.EMPTY_CHAT_TIMEOUT = cls.get_env('EMPTY_CHAT_TIMEOUT', 3600, var_type=int)
+        cls.CONVERSATION_PAGE_SIZE = cls.get_env('CONVERSATION_PAGE_SIZE', 30, var_type=int)
+        cls.EMPTY_CHAT_CLEANUP_INTERVAL_SECONDS = cls.get_env('EMPTY_CHAT_CLEANUP_INTERVAL_SECONDS', 300, var_type=int)
+        cls.EMPTY_CHAT_CLEANUP_BATCH_SIZE = cls.get_env('EMPTY_CHAT_CLEANUP_BATCH_SIZE', 500, var_type=int)
         cls.SALES_DATA_REFRESH_INTERVAL = cls.get_env('SALES_DATA_REFRESH_INTERVAL_SECONDS', 3600, var_type=int)
+        cls.SALES_SNAPSHOT_CACHE_SIZE = cls.get_env('SALES_SNAPSHOT_CACHE_SIZE', 100, var_type=int)
+        cls.SALES_SNAPSHOT_CLEANUP_INTERVAL_SECONDS = cls.get_env('SALES_SNAPSHOT_CLEANUP_INTERVAL_SECONDS', 3600, var_type=int)
+
+        # Archival of idle sessions to chat_archive.db (0 days disables)
+        cls.SESSION_ARCHIVE_AFTER_DAYS = cls.get_env('SESSION_ARCHIVE_AFTER_DAYS', 90, var_type=int)
+        cls.SESSION_ARCHIVE_INTERVAL_SECONDS = cls.get_env('SESSION_ARCHIVE_INTERVAL_SECONDS', 3600, var_type=int)
+        cls.SESSION_ARCHIVE_BATCH_SIZE = cls.get_env('SESSION_ARCHIVE_BATCH_SIZE', 50, var_type=int)
+
+        # Chat data split across this many SQLite files by user (run scripts/reshard_sessions.py after changing it)
+        cls.SESSION_SHARD_COUNT = cls.get_env('SESSION_SHARD_COUNT', 1, var_type=int)
+
+        # SQLite Storage Configuration (applied to every pooled connection)
+        cls.SQLITE_JOURNAL_MODE = cls.get_env('SQLITE_JOURNAL_MODE', 'WAL')
+        cls.SQLITE_SYNCHRONOUS = cls.get_env('SQLITE_SYNCHRONOUS', 'NORMAL')
+        cls.SQLITE_MMAP_SIZE = cls.get_env('SQLITE_MMAP_SIZE', 268435456, var_type=int)
+        cls.SQLITE_BUSY_TIMEOUT_MS = cls.get_env('SQLITE_BUSY_TIMEOUT_MS', 5000, var_type=int)
+        cls.SQLITE_CACHE_SIZE_KB = cls.get_env('SQLITE_CACHE_SIZE_KB', 20000, var_type=int)
+        cls.SQLITE_POOL_SIZE = cls.get_env('SQLITE_POOL_SIZE', 10, var_type=int)
+        cls.SQLITE_POOL_MAX_OVERFLOW = cls.get_env('SQLITE_POOL_MAX_OVERFLOW', 20, var_type=int)
+
+        # Compression of large JSON columns (sales snapshots, message payloads)
+        cls.JSON_COMPRESSION_CODEC = cls.get_env('JSON_COMPRESSION_CODEC', 'zlib')
+        cls.JSON_COMPRESSION_MIN_BYTES = cls.get_env('JSON_COMPRESSION_MIN_BYTES', 1024, var_type=int)
+        cls.JSON_COMPRESSION_LEVEL = cls.get_env('JSON_COMPRESSION_LEVEL', 6, var_type=int)
+
+        # Write-behind commits of chat turns (after the response is sent)
+        cls.WRITE_BEHIND_ENABLED = cls.get_env('WRITE_BEHIND_ENABLED', default=False, var_type=bool)
+        cls.WRITE_BEHIND_MAX_QUEUE = cls.get_env('WRITE_BEHIND_MAX_QUEUE', 1000, var_type=int)
+        cls.WRITE_BEHIND_BATCH_SIZE = cls.get_env('WRITE_BEHIND_BATCH_SIZE', 50, var_type=int)
+
+        # Chat and feedback telemetry, appended to blob storage in batches by a background thread
+        cls.TELEMETRY_ASYNC_ENABLED = cls.get_env('TELEMETRY_ASYNC_ENABLED', default=True, var_type=bool)
+        cls.TELEMETRY_FLUSH_INTERVAL_SECONDS = cls.get_env('TELEMETRY_FLUSH_INTERVAL_SECONDS', 5, var_type=float)
+        cls.TELEMETRY_MAX_QUEUE = cls.get_env('TELEMETRY_MAX_QUEUE', 10000, var_type=int)
+        cls.TELEMETRY_MAX_BATCH_RECORDS = cls.get_env('TELEMETRY_MAX_BATCH_RECORDS', 1000, var_type=int)
+        # Local disk spool for records that can't be sent yet (empty dir: telemetry_spool next to the database)
+        cls.TELEMETRY_SPOOL_ENABLED = cls.get_env('TELEMETRY_SPOOL_ENABLED', default=True, var_type=bool)
+        cls.TELEMETRY_SPOOL_DIR = cls.get_env('TELEMETRY_SPOOL_DIR', '')
+        cls.TELEMETRY_SPOOL_MAX_MB = cls.get_env('TELEMETRY_SPOOL_MAX_MB', 256, var_type=int)
+        cls.TELEMETRY_SPOOL_SEGMENT_KB = cls.get_env('TELEMETRY_SPOOL_SEGMENT_KB', 1024, var_type=int)
+        cls.TELEMETRY_SPOOL_RETRY_SECONDS = cls.get_env('TELEMETRY_SPOOL_RETRY_SECONDS', 30, var_type=int)
+
+        # Answer Cache Configuration (product-knowledge answers on the RAG route)
+        cls.ANSWER_CACHE_ENABLED = cls.get_env('ANSWER_CACHE_ENABLED', default=True, var_type=bool)
+        cls.ANSWER_CACHE_MAX_SIZE = cls.get_env('ANSWER_CACHE_MAX_SIZE', 1000, var_type=int)
+        cls.ANSWER_CACHE_TTL_SECONDS = cls.get_env('ANSWER_CACHE_TTL_SECONDS', 86400, var_type=int)
+        cls.ANSWER_CACHE_INDEX_VERSION = cls.get_env('ANSWER_CACHE_INDEX_VERSION', '1')
+        cls.ANSWER_CACHE_INDEX_POLL_SECONDS = cls.get_env('ANSWER_CACHE_INDEX_POLL_SECONDS', 300, var_type=int)
+        cls.AZURE_AI_SEARCH_INDEXER_NAME = cls.get_env('AZURE_AI_SEARCH_INDEXER_NAME')
+
+        # Request Deadline Configuration
+        cls.MESSAGE_DEADLINE_SECONDS = cls.get_env('MESSAGE_DEADLINE_SECONDS', 180, var_type=int)
+        # A turn's claim on its session expires after this, in case its worker died mid-turn
+        cls.TURN_CLAIM_TIMEOUT_SECONDS = cls.get_env('TURN_CLAIM_TIMEOUT_SECONDS', 240, var_type=int)
+        cls.SEARCH_DEADLINE_SECONDS = cls.get_env('SEARCH_DEADLINE_SECONDS', 45, var_type=int)
+        cls.AZURE_OPENAI_STREAM_USAGE = cls.get_env('AZURE_OPENAI_STREAM_USAGE', default=False, var_type=bool)
+
+        # Azure OpenAI Admission Control (token-per-minute budgets)
+        cls.AZURE_OPENAI_TPM_LIMIT = cls.get_env('AZURE_OPENAI_TPM_LIMIT', 0, var_type=int)
+        cls.AZURE_OPENAI_USER_TPM_LIMIT = cls.get_env('AZURE_OPENAI_USER_TPM_LIMIT', 30000, var_type=int)
+        cls.AZURE_OPENAI_MAX_QUEUE = cls.get_env('AZURE_OPENAI_MAX_QUEUE', 200, var_type=int)
+        cls.AZURE_OPENAI_RATE_LIMIT_RETRIES = cls.get_env('AZURE_OPENAI_RATE_LIMIT_RETRIES', 2, var_type=int)
+        cls.AZURE_OPENAI_RETRY_AFTER_DEFAULT = cls.get_env('AZURE_OPENAI_RETRY_AFTER_DEFAULT', 10, var_type=int)
+
+        # Query Routing Configuration (per-turn choice of sales context and retrieval)
+        cls.QUERY_ROUTER_ENABLED = cls.get_env('QUERY_ROUTER_ENABLED', default=True, var_type=bool)
+        cls.QUERY_ROUTE_ORDER_MAX_TOKENS = cls.get_env('QUERY_ROUTE_ORDER_MAX_TOKENS', 1500, var_type=int)
+        cls.QUERY_ROUTE_PRODUCT_MAX_TOKENS = cls.get_env('QUERY_ROUTE_PRODUCT_MAX_TOKENS', 2000, var_type=int)
+        cls.QUERY_ROUTE_PRODUCT_TOP_N = cls.get_env('QUERY_ROUTE_PRODUCT_TOP_N', cls.AZURE_AI_SEARCH_TOP_N_DOCS, var_type=int)
+        cls.QUERY_ROUTE_MIXED_MAX_TOKENS = cls.get_env('QUERY_ROUTE_MIXED_MAX_TOKENS', cls.AZURE_OPENAI_MAX_COMPLETION_TOKENS, var_type=int)
+        cls.QUERY_ROUTE_MIXED_TOP_N = cls.get_env('QUERY_ROUTE_MIXED_TOP_N', cls.AZURE_AI_SEARCH_TOP_N_DOCS, var_type=int)
+
+        # Fast Path Configuration (order-status lookups answered without the LLM)
+        cls.FAST_PATH_ENABLED = cls.get_env('FAST_PATH_ENABLED', default=True, var_type=bool)
+        cls.FAST_PATH_MAX_ROWS = cls.get_env('FAST_PATH_MAX_ROWS', 10, var_type=int)
+
+        # Degradation Configuration (cheaper turns while Azure OpenAI/Search are slow)
+        cls.DEGRADATION_ENABLED = cls.get_env('DEGRADATION_ENABLED', default=True, var_type=bool)
+        cls.DEGRADATION_WINDOW_SECONDS = cls.get_env('DEGRADATION_WINDOW_SECONDS', 120, var_type=int)
+        cls.DEGRADATION_MIN_SAMPLES = cls.get_env('DEGRADATION_MIN_SAMPLES', 10, var_type=int)
+        cls.DEGRADATION_RECOVERY_SECONDS = cls.get_env('DEGRADATION_RECOVERY_SECONDS', 60, var_type=int)
+        cls.DEGRADATION_P95_SECONDS = [float(v) for v in cls.get_env('DEGRADATION_P95_SECONDS', '20,30,45,60').split(',')]
+        cls.DEGRADATION_ERROR_RATES = [float(v) for v in cls.get_env('DEGRADATION_ERROR_RATES', '0.1,0.2,0.3,0.5').split(',')]
+        cls.DEGRADED_HISTORY_MESSAGES = cls.get_env('DEGRADED_HISTORY_MESSAGES', 4, var_type=int)
+        cls.DEGRADED_MAX_ORDERS = cls.get_env('DEGRADED_MAX_ORDERS', 25, var_type=int)
+        cls.DEGRADED_MAX_TOKENS = cls.get_env('DEGRADED_MAX_TOKENS', 800, var_type=int)
         
     @classmethod
     def log_config(cls):
         """Log the current configuration (excluding sensitive values)."""
-        sensitive_keys = {'AZURE_OPENAI_KEY', 'AZURE_AI_SEARCH_KEY', 'FLASK_SECRET_KEY', 
+        sensitive_keys = {'AZURE_OPENAI_KEY', 'AZURE_OPENAI_DEPLOYMENTS', 'AZURE_AI_SEARCH_KEY', 'FLASK_SECRET_KEY', 
                          'APPLICATIONINSIGHTS_CONNECTION_STRING'}
         
         logger.info("Current configuration:")
@@ -162,10 +283,32 @@ app = Flask(__name__)
 db_dir = os.path.join(os.environ.get('HOME', ''), 'site', 'wwwroot')
 if not os.path.exists(db_dir):
     os.makedirs(db_dir, exist_ok=True)
-db_path = os.path.join(db_dir, 'chat_sessions.db')
+# Shard 0 is chat_sessions.db; further shards are chat_sessions_shard<N>.db binds
+shard_router = ShardRouter(db_dir, 'chat_sessions', Config.SESSION_SHARD_COUNT)
+db_path = shard_router.path(0)
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+# Cold tier: sessions idle for SESSION_ARCHIVE_AFTER_DAYS (see archive_inactive_sessions)
+archive_db_path = os.path.join(db_dir, 'chat_archive.db')
+app.config['SQLALCHEMY_BINDS'] = {'archive': f'sqlite:///{archive_db_path}', **shard_router.binds()}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+sqlite_profile = SQLiteProfile(
+    journal_mode=Config.SQLITE_JOURNAL_MODE,
+    synchronous=Config.SQLITE_SYNCHRONOUS,
+    mmap_size=Config.SQLITE_MMAP_SIZE,
+    busy_timeout_ms=Config.SQLITE_BUSY_TIMEOUT_MS,
+    cache_size_kb=Config.SQLITE_CACHE_SIZE_KB,
+    pool_size=Config.SQLITE_POOL_SIZE,
+    max_overflow=Config.SQLITE_POOL_MAX_OVERFLOW
+)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_profile.engine_options()
+
+json_codec.configure(
+    codec=Config.JSON_COMPRESSION_CODEC,
+    min_bytes=Config.JSON_COMPRESSION_MIN_BYTES,
+    level=Config.JSON_COMPRESSION_LEVEL
+)
+
 # Use secret key from config
 app.secret_key = Config.FLASK_SECRET_KEY
 
@@ -175,6 +318,7 @@ TEMPERATURE = Config.AZURE_OPENAI_TEMPERATURE
 
 # Add chat control configurations
 EMPTY_CHAT_TIMEOUT = Config.EMPTY_CHAT_TIMEOUT
+CONVERSATION_PAGE_SIZE = Config.CONVERSATION_PAGE_SIZE
 
 # Add these configurations at the top with other constants
 MAX_TOKENS = {
@@ -184,24 +328,276 @@ MAX_TOKENS = {
     'WARNING_THRESHOLD': 0.9  # Warn at 90% usage
 }
 
+# Prompt tokens added per document retrieved by the azure_search data source
+RETRIEVED_DOC_TOKEN_ESTIMATE = 400
+
+# Per-turn routing: order questions skip retrieval, product questions get a
+# minimal sales summary instead of every order, mixed questions get both
+query_router = QueryRouter({
+    QueryRouter.ORDER: Route(QueryRouter.ORDER, include_orders=True, use_retrieval=False,
+                             max_tokens=Config.QUERY_ROUTE_ORDER_MAX_TOKENS),
+    QueryRouter.PRODUCT: Route(QueryRouter.PRODUCT, include_orders=False, use_retrieval=True,
+                               max_tokens=Config.QUERY_ROUTE_PRODUCT_MAX_TOKENS, top_n=Config.QUERY_ROUTE_PRODUCT_TOP_N),
+    QueryRouter.MIXED: Route(QueryRouter.MIXED, include_orders=True, use_retrieval=True,
+                             max_tokens=Config.QUERY_ROUTE_MIXED_MAX_TOKENS, top_n=Config.QUERY_ROUTE_MIXED_TOP_N),
+    QueryRouter.FOOD: Route(QueryRouter.FOOD, include_orders=True, use_retrieval=False,
+                            max_tokens=MAX_TOKENS['COMPLETION'])
+}, enabled=Config.QUERY_ROUTER_ENABLED)
+
+# Deterministic answers for plain order/PO/delivery status lookups
+fast_path = FastPathEngine(enabled=Config.FAST_PATH_ENABLED, max_rows=Config.FAST_PATH_MAX_ROWS)
+
+# Steps turns down to cheaper modes while completions are slow or failing
+degradation = DegradationController(
+    p95_thresholds=Config.DEGRADATION_P95_SECONDS,
+    error_rate_thresholds=Config.DEGRADATION_ERROR_RATES,
+    window_seconds=Config.DEGRADATION_WINDOW_SECONDS,
+    min_samples=Config.DEGRADATION_MIN_SAMPLES,
+    recovery_seconds=Config.DEGRADATION_RECOVERY_SECONDS,
+    enabled=Config.DEGRADATION_ENABLED
+)
+
+class ShardedSession(FlaskSQLAlchemySession):
+    """Sends what would go to the default database to the shard selected by shard_router."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        key = shard_router.bind_key(shard_router.current())
+        if key is not None and bind is None and engine is self._db.engines[None]:
+            return self._db.engines[key]
+        return engine
+
 # Create the db instance without the app
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': ShardedSession})
+
+def shard_engine(shard: Optional[int] = None):
+    """The engine of a shard; by default the one selected for the current request or task."""
+    return db.engines[shard_router.bind_key(shard_router.current() if shard is None else shard)]
 
 # Add this new model class
 class ChatSession(db.Model):
     __tablename__ = 'chat_session'  # Explicitly set the table name
     id = db.Column(db.String(36), primary_key=True)
-    messages = db.Column(db.JSON)  # Stores the full message history including system prompts
-    chat_history = db.Column(db.JSON)  # Stores user-visible chat history with citations
-    citations = db.Column(db.JSON)  # Store citations for each message
+    # Legacy whole-conversation JSON arrays; turns now live in chat_message
+    # (copied over and cleared by migrate_legacy_chat_history). Deferred: only
+    # the migration reads them, so loading a session never parses them.
+    messages = deferred(db.Column(CompressedJSON), group='legacy_history')
+    chat_history = deferred(db.Column(CompressedJSON), group='legacy_history')
+    citations = deferred(db.Column(CompressedJSON), group='legacy_history')
     product_category = db.Column(db.String(50))  # Instapak, Autobag, Shrink Solutions, or Sales Strategy
     confidence_level = db.Column(db.Integer)  # 1-10 confidence rating
     focus_area = db.Column(db.String(100))  # Specific aspect of product/sales being discussed
     detected_language = db.Column(db.String(50))  # Language detection for multilingual support
-    created_at = db.Column(db.String(50), default=lambda: datetime.datetime.utcnow().isoformat())
-    last_activity = db.Column(db.String(50), default=lambda: datetime.datetime.utcnow().isoformat())  # Track last activity time
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    last_activity = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Track last activity time
     user_id = db.Column(db.String(50))  # Add this field to store user ID
-    sales_metadata = db.Column(db.JSON)  # Store sales rep metadata
+    # Sales rep metadata, shared with other sessions through a content-addressed snapshot.
+    # sales_metadata is the legacy per-session copy (moved out by migrate_sales_snapshots);
+    # it only holds data on unsaved drafts. Read through session_sales_metadata().
+    sales_snapshot_id = db.Column(db.String(64), db.ForeignKey('sales_snapshot.id'))
+    sales_metadata = deferred(db.Column(CompressedJSON), group='sales_metadata')  # Loaded on access
+    message_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # chat_message rows
+    # Bumped by every committed turn; a turn commits only if it's still the version it read (compare-and-swap)
+    version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    # Both lead with user_id, so they also serve plain per-user lookups
+    __table_args__ = (
+        db.Index('ix_chat_session_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_chat_session_user_id_last_activity_id', 'user_id', 'last_activity', 'id'),
+        # Empty-chat check in /new_chat and the empty-chat janitor
+        db.Index('ix_chat_session_user_id_message_count_created_at', 'user_id', 'message_count', 'created_at'),
+        db.Index('ix_chat_session_message_count_created_at', 'message_count', 'created_at'),
+        # Orphaned-snapshot check in the sales snapshot janitor
+        db.Index('ix_chat_session_sales_snapshot_id', 'sales_snapshot_id'),
+        # Idle-session scan in the archive janitor
+        db.Index('ix_chat_session_last_activity', 'last_activity'),
+    )
+
+class SalesSnapshot(db.Model):
+    """One distinct sales metadata blob, keyed by the SHA-256 of its canonical JSON; data is never updated."""
+    __tablename__ = 'sales_snapshot'
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(CompressedJSON, nullable=False)
+    size_bytes = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # Bumped (at most every SALES_SNAPSHOT_TOUCH_SECONDS) whenever a session is pointed at it; the janitor's cutoff
+    last_used_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class ChatMessage(db.Model):
+    """One entry of a conversation. A turn appends two rows instead of rewriting the session's history."""
+    __tablename__ = 'chat_message'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)  # Also the order within a session
+    session_id = db.Column(db.String(36), db.ForeignKey('chat_session.id'), nullable=False)
+    role = db.Column(db.String(20), nullable=False)  # user or assistant
+    content = db.Column(db.Text)  # User-visible text
+    # Content sent to the model when it differs from the text (image parts, base64).
+    # Deferred: only the prompt needs it; see load_chat_messages(with_payload=True)
+    payload = deferred(db.Column(CompressedJSON), group='model_payload')
+    citations = db.Column(CompressedJSON)
+    message_metadata = db.Column(CompressedJSON)  # key_takeaways and actions for assistant entries
+    in_context = db.Column(db.Boolean, default=True, nullable=False)  # False for failed turns kept out of the prompt
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_chat_message_session_id_id', 'session_id', 'id'),
+    )
+
+    @classmethod
+    def from_history_entry(cls, session_id: str, entry: dict, in_context: bool = True, payload=None) -> 'ChatMessage':
+        return cls(
+            session_id=session_id,
+            role=entry.get('role', 'user'),
+            content=entry.get('content', ''),
+            payload=payload,
+            citations=entry.get('citations'),
+            message_metadata=entry.get('metadata'),
+            in_context=in_context
+        )
+
+    def to_history_entry(self) -> dict:
+        """The chat_history entry shape the templates and chat.js render."""
+        entry = {"role": self.role, "content": self.content}
+        if self.citations is not None:
+            entry["citations"] = self.citations
+        if self.message_metadata is not None:
+            entry["metadata"] = self.message_metadata
+        return entry
+
+    def to_model_message(self) -> dict:
+        return {"role": self.role, "content": self.payload or self.content}
+
+class TurnClaim(db.Model):
+    """The turn in progress for a chat session, shared by all workers; see claim_turn."""
+    __tablename__ = 'turn_claim'
+    session_id = db.Column(db.String(36), primary_key=True)  # No foreign key: drafts have no row yet
+    token = db.Column(db.String(36), nullable=False)
+    claimed_at = db.Column(db.DateTime, nullable=False)
+
+class ArchivedSession(db.Model):
+    """
+    An idle chat session moved to the archive database (chat_archive.db).
+
+    `data` holds the session's columns, its messages and its sales metadata
+    as one compressed record; the other columns are what the sidebar lists.
+    restore_archived_session moves it back when the chat is opened.
+    """
+    __bind_key__ = 'archive'
+    __tablename__ = 'archived_session'
+    id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.String(50))
+    focus_area = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime)
+    last_activity = db.Column(db.DateTime)
+    message_count = db.Column(db.Integer)
+    archived_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    data = db.Column(CompressedJSON, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_archived_session_user_id_last_activity_id', 'user_id', 'last_activity', 'id'),
+    )
+
+# Columns copied into an archive record; everything else is derived on restore
+ARCHIVED_SESSION_COLUMNS = ('user_id', 'product_category', 'confidence_level', 'focus_area', 'detected_language',
+                            'created_at', 'last_activity')
+ARCHIVED_MESSAGE_COLUMNS = ('role', 'content', 'payload', 'citations', 'message_metadata', 'in_context', 'created_at')
+ARCHIVED_DATETIME_COLUMNS = ('created_at', 'last_activity')
+
+
+# Columns loaded by routes that read a session's scalars but not its JSON.
+# Anything else still loads on first access, one extra query per object.
+SESSION_OWNER_COLUMNS = (ChatSession.user_id, ChatSession.sales_snapshot_id)
+SESSION_SUMMARY_COLUMNS = SESSION_OWNER_COLUMNS + (
+    ChatSession.product_category, ChatSession.focus_area, ChatSession.detected_language,
+    ChatSession.confidence_level
+)
+
+def get_chat_session(session_id: Optional[str], user_id: str,
+                     columns: Optional[tuple] = None) -> Optional['ChatSession']:
+    """
+    A chat session by id, or None. With `columns`, only those (and the primary
+    key) are selected; otherwise every column except the deferred JSON ones.
+    An instance already in the identity map is returned as it is. An archived
+    session is restored to the hot database first, only for its owner
+    `user_id`; callers still check the owner of a session that was never archived.
+    """
+    if not session_id:
+        return None
+    options = [load_only(*columns)] if columns else None
+    chat_session = db.session.get(ChatSession, session_id, options=options)
+    if chat_session is None and restore_archived_session(session_id, user_id):
+        chat_session = db.session.get(ChatSession, session_id, options=options)
+    return chat_session
+
+def load_chat_messages(session_id: str, limit: Optional[int] = None, with_payload: bool = False) -> list:
+    """
+    A session's messages in order, or only the most recent `limit`, via the
+    (session_id, id) index. The model payload is left unloaded unless
+    `with_payload`, which building a prompt needs and rendering history doesn't.
+    """
+    chat_writer.wait_for(session_id)  # Include this worker's turns still in the write-behind queue
+    query = ChatMessage.query.filter_by(session_id=session_id)
+    if with_payload:
+        query = query.options(undefer_group('model_payload'))
+    if limit is None:
+        return query.order_by(ChatMessage.id).all()
+    rows = query.order_by(ChatMessage.id.desc()).limit(limit).all()
+    rows.reverse()
+    return rows
+
+def get_chat_history_entries(session_id: str) -> list:
+    return [row.to_history_entry() for row in load_chat_messages(session_id)]
+
+def encode_conversation_cursor(last_activity: datetime.datetime, session_id: str) -> str:
+    raw = json.dumps([last_activity.isoformat(), session_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_conversation_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    """Raises ValueError for a cursor this app did not issue."""
+    try:
+        last_activity, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.datetime.fromisoformat(last_activity), str(session_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid conversation cursor: {e}")
+
+def list_conversations(user_id: str, current_session_id: Optional[str], limit: int = CONVERSATION_PAGE_SIZE,
+                       cursor: Optional[str] = None) -> Tuple[list, Optional[str]]:
+    """
+    One page of sidebar entries, most recently active first, and the cursor for the next page.
+
+    Keyset pagination on (last_activity, id) walks the (user_id, last_activity, id)
+    index from the cursor instead of counting past an OFFSET, and only the
+    columns the sidebar shows are loaded. The same page is read from the
+    archive database and merged, so archived chats stay listed in order.
+    """
+    after = decode_conversation_cursor(cursor) if cursor else None
+
+    def page(model) -> list:
+        query = db.session.query(model.id, model.focus_area, model.last_activity).filter(model.user_id == user_id)
+        if after:
+            query = query.filter(or_(
+                model.last_activity < after[0],
+                and_(model.last_activity == after[0], model.id < after[1])
+            ))
+        return query.order_by(model.last_activity.desc(), model.id.desc()).limit(limit + 1).all()
+
+    # A session is in one database at a time, except briefly while it's being moved
+    rows, seen = [], set()
+    for row in sorted(page(ChatSession) + page(ArchivedSession),
+                      key=lambda row: (row[2] or datetime.datetime.min, row[0]), reverse=True):
+        if row[0] not in seen:
+            seen.add(row[0])
+            rows.append(row)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_conversation_cursor(rows[-1][2], rows[-1][0])
+    return [{
+        'id': chat_id,
+        'title': focus_area or 'New Conversation',
+        'time': last_activity.isoformat() + 'Z' if last_activity else '',  # Stored as naive UTC
+        'active': chat_id == current_session_id
+    } for chat_id, focus_area, last_activity in rows], next_cursor
 
 class SalesDataCache:
     """Thread-safe cache for sales representative data with size limits and LRU eviction."""
@@ -271,31 +667,351 @@ sales_data_cache = SalesDataCache(
     max_size=1000,  # Adjust based on expected number of concurrent users
     refresh_interval=Config.SALES_DATA_REFRESH_INTERVAL
 )
+
+# Snapshots are immutable, so cached copies never go stale; the interval only bounds memory churn
+sales_snapshot_cache = SalesDataCache(max_size=Config.SALES_SNAPSHOT_CACHE_SIZE, refresh_interval=86400)
+
+# Snapshots this worker stored or marked as used within SALES_SNAPSHOT_TOUCH_SECONDS. The janitor
+# only deletes snapshots unused for a day, so one touched that recently is still in the database.
+SALES_SNAPSHOT_TOUCH_SECONDS = 3600
+SALES_SNAPSHOT_RETENTION = datetime.timedelta(days=1)
+sales_snapshot_touched = SalesDataCache(max_size=Config.SALES_SNAPSHOT_CACHE_SIZE,
+                                        refresh_interval=SALES_SNAPSHOT_TOUCH_SECONDS)
+
+def encode_sales_snapshot(metadata: dict) -> Tuple[str, str]:
+    """Canonical JSON for a metadata dict and its SHA-256, the snapshot id."""
+    encoded = json.dumps(metadata, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest(), encoded
+
+def sales_snapshot_cache_key(snapshot_id: str) -> str:
+    """Per shard: a cached snapshot means it is stored in that shard's database."""
+    return f"{shard_router.current()}:{snapshot_id}"
+
+def store_sales_snapshot(metadata: dict) -> str:
+    """
+    Store a metadata snapshot once and return its id, marking it as in use.
+
+    The upsert commits on its own connection: it is idempotent, and a session
+    row committed later (possibly by the write-behind thread) must always find
+    its snapshot. Reusing a snapshot bumps its last_used_at, at most once per
+    SALES_SNAPSHOT_TOUCH_SECONDS per worker, so the janitor (which removes
+    snapshots nothing refers to once they are unused for a day) can't delete
+    it before that session commits; one the janitor already removed is
+    stored again.
+    """
+    snapshot_id, encoded = encode_sales_snapshot(metadata)
+    cache_key = sales_snapshot_cache_key(snapshot_id)
+    if sales_snapshot_touched.get(cache_key) is not None:
+        return snapshot_id
+
+    now = datetime.datetime.utcnow()
+    last_used_at = db.session.query(SalesSnapshot.last_used_at).filter_by(id=snapshot_id).scalar()
+    if last_used_at is None or now - last_used_at > datetime.timedelta(seconds=SALES_SNAPSHOT_TOUCH_SECONDS):
+        with shard_engine().begin() as conn:
+            conn.execute(sqlite_insert(SalesSnapshot.__table__).values(
+                id=snapshot_id,
+                data=metadata,
+                size_bytes=len(encoded),
+                created_at=now,
+                last_used_at=now
+            ).on_conflict_do_update(index_elements=['id'], set_={'last_used_at': now}))
+        if last_used_at is None:
+            logger.info(f"Stored sales snapshot {snapshot_id[:12]} ({len(encoded)} bytes)")
+    sales_snapshot_touched.set(cache_key, metadata)
+    sales_snapshot_cache.set(cache_key, metadata)
+    return snapshot_id
+
+def load_sales_snapshot(snapshot_id: str) -> Optional[dict]:
+    data = sales_snapshot_cache.get(sales_snapshot_cache_key(snapshot_id))
+    if data is None:
+        snapshot = db.session.get(SalesSnapshot, snapshot_id)
+        if snapshot is None:
+            logger.warning(f"Sales snapshot {snapshot_id} not found")
+            return None
+        data = snapshot.data
+        sales_snapshot_cache.set(sales_snapshot_cache_key(snapshot_id), data)
+    return data
+
+def attach_sales_snapshot(chat_session, metadata: dict) -> None:
+    """Point a session at the snapshot for metadata, storing it if it's new."""
+    chat_session.sales_snapshot_id = store_sales_snapshot(metadata)
+    chat_session.sales_metadata = None
+
+def session_sales_metadata(chat_session) -> Optional[dict]:
+    """A session's sales metadata: its snapshot, or the in-memory copy of an unsaved draft."""
+    if chat_session.sales_snapshot_id:
+        return load_sales_snapshot(chat_session.sales_snapshot_id)
+    return chat_session.sales_metadata
 # Add these constants at the top with other configurations
 MAX_FILE_SIZE = 8 * 1024 * 1024  # 8MB
 ALLOWED_MIME_TYPES = {'image/jpeg', 'image/png'}
 
+# Shared Azure OpenAI deployments. Each deployment keeps one thread-safe client
+# with pooled connections, so threaded gunicorn workers share them instead of
+# building a new client (and TLS session) for every message.
+openai_pool = DeploymentPool.from_config(Config)
+
 # Initialize the email service after app creation
-email_service = EmailService(Config)
+email_service = EmailService(Config, deployment_pool=openai_pool)
+
+# Admission control for chat completions. The TPM quota (the sum of per-deployment
+# quotas when configured) is split evenly across gunicorn workers, since each
+# worker schedules on its own.
+completion_scheduler = TokenRateScheduler(
+    global_tpm=(openai_pool.total_tpm or Config.AZURE_OPENAI_TPM_LIMIT) // max(1, gunicorn_workers()),
+    per_user_tpm=Config.AZURE_OPENAI_USER_TPM_LIMIT,
+    max_queue=Config.AZURE_OPENAI_MAX_QUEUE
+)
+
+# Shared HTTP session for Azure AI Search, sized for the gunicorn thread pool
+search_http = requests.Session()
+search_http.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=gunicorn_threads()
+))
+
+# Answer cache for product-knowledge questions on the default/protective routes
+answer_cache = AnswerCache(
+    max_size=Config.ANSWER_CACHE_MAX_SIZE,
+    ttl=Config.ANSWER_CACHE_TTL_SECONDS
+)
+
+def fetch_search_indexer_status() -> Optional[dict]:
+    """Fetch the document indexer status so a reindex invalidates cached answers."""
+    url = f"{Config.AZURE_AI_SEARCH_ENDPOINT}/indexers/{Config.AZURE_AI_SEARCH_INDEXER_NAME}/status?api-version=2023-11-01"
+    response = search_http.get(url, headers={'api-key': Config.AZURE_AI_SEARCH_KEY}, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+# In-flight /message requests, so abandoned chats can be cancelled
+inflight_requests = InflightRegistry()
+
+answer_cache_index = IndexVersionTracker(
+    static_version=Config.ANSWER_CACHE_INDEX_VERSION,
+    fetch_status=fetch_search_indexer_status if Config.AZURE_AI_SEARCH_INDEXER_NAME else None,
+    poll_interval=Config.ANSWER_CACHE_INDEX_POLL_SECONDS,
+    on_change=lambda old_version, new_version: answer_cache.clear()
+)
 
 # Add this code block before running the app
 db.init_app(app)
 
+# Pragmas must be in place before init_db opens the first connection
+with app.app_context():
+    for engine in db.engines.values():
+        sqlite_profile.install(engine)
+
+@app.before_request
+def select_user_shard():
+    """Route this request's chat data queries to the signed-in user's shard."""
+    g.shard_token = shard_router.select(request.headers.get('X-MS-CLIENT-PRINCIPAL-ID', Config.DEBUG_USER_ID))
+
+@app.teardown_request
+def reset_user_shard(exc):
+    token = g.pop('shard_token', None)
+    if token is not None:
+        shard_router.reset(token)
+
+def pair_legacy_messages(entries: list, model_messages: list) -> list:
+    """
+    Match each legacy chat_history entry to the user/assistant message saved
+    for it in chat_session.messages, in order; None where the turn never
+    reached the model (failed turns were kept in chat_history only).
+    """
+    def text_of(content):
+        if isinstance(content, list):  # Image turns: a text part plus image_url parts
+            return next((part.get('text', '') for part in content
+                         if isinstance(part, dict) and part.get('type') == 'text'), '')
+        return content
+
+    pairs = []
+    position = 0
+    for entry in entries:
+        match = None
+        for index in range(position, len(model_messages)):
+            message = model_messages[index]
+            if message.get('role') == entry.get('role') and text_of(message.get('content')) == entry.get('content', ''):
+                match = message
+                position = index + 1
+                break
+        pairs.append(match)
+    return pairs
+
+def migrate_legacy_chat_history(conn):
+    """
+    Copy each session's chat_history JSON array into chat_message rows, then clear the legacy columns.
+
+    The model-side content of each entry comes from the matching message in
+    the legacy messages array: image attachments are kept as the row's
+    payload, and entries with no model message (failed turns) are copied out
+    of context, as they were left out of the prompt before.
+    """
+    ChatMessage.__table__.create(conn, checkfirst=True)
+    after_id = ''
+    sessions = copied = payloads = out_of_context = unmatched = 0
+    while True:
+        batch = conn.execute(text(
+            "SELECT id, chat_history, messages, last_activity FROM chat_session "
+            "WHERE id > :after_id ORDER BY id LIMIT 200"
+        ), {'after_id': after_id}).fetchall()
+        if not batch:
+            break
+        for session_id, chat_history, messages, last_activity in batch:
+            entries = [entry for entry in (json_codec.decode(chat_history) if chat_history else None) or []
+                       if isinstance(entry, dict)]
+            model_messages = [message for message in (json_codec.decode(messages) if messages else None) or []
+                              if isinstance(message, dict) and message.get('role') != 'system']
+            # Without a messages array there is nothing to match against; every entry stays in context
+            pairs = pair_legacy_messages(entries, model_messages) if model_messages else [None] * len(entries)
+            rows = []
+            for entry, message in zip(entries, pairs):
+                model_content = message.get('content') if message else None
+                rows.append({
+                    'session_id': session_id,
+                    'role': entry.get('role', 'user'),
+                    'content': entry.get('content', ''),
+                    'payload': model_content if isinstance(model_content, list) else None,
+                    'citations': entry.get('citations'),
+                    'message_metadata': entry.get('metadata'),
+                    'in_context': message is not None or not model_messages,
+                    'created_at': datetime.datetime.fromisoformat(last_activity) if last_activity else None
+                })
+            if rows:
+                conn.execute(ChatMessage.__table__.insert(), rows)
+                copied += len(rows)
+                payloads += sum(1 for row in rows if row['payload'] is not None)
+                out_of_context += sum(1 for row in rows if not row['in_context'])
+            unmatched += len(model_messages) - sum(1 for message in pairs if message is not None)
+            sessions += 1 if entries or model_messages else 0
+        after_id = batch[-1][0]
+    conn.execute(text("UPDATE chat_session SET messages = NULL, chat_history = NULL, citations = NULL"))
+    logger.info(f"Copied {copied} legacy chat history entries of {sessions} sessions into chat_message "
+                f"({payloads} with image attachments, {out_of_context} failed-turn entries out of context)")
+    if unmatched:
+        # Prompt-only messages whose visible entry had already been trimmed from chat_history
+        logger.warning(f"Dropped {unmatched} legacy model messages with no chat_history entry")
+
+def create_chat_session_indexes(conn, *names):
+    """Create the named ChatSession indexes if missing; by name, since later migrations add columns that index."""
+    for index in ChatSession.__table__.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+
+def migrate_datetime_columns(conn):
+    """Rewrite ISO-8601 timestamps in SQLAlchemy's DateTime format and add the (user_id, created_at) index."""
+    # SQLite stores DateTime as 'YYYY-MM-DD HH:MM:SS[.ffffff]'; the old isoformat() values used a 'T'
+    # separator, which neither parses back nor sorts correctly against the new values
+    for table, column in (('chat_session', 'created_at'), ('chat_session', 'last_activity'),
+                          ('chat_message', 'created_at')):
+        conn.execute(text(f"UPDATE {table} SET {column} = replace({column}, 'T', ' ') WHERE {column} LIKE '%T%'"))
+    create_chat_session_indexes(conn, 'ix_chat_session_user_id_created_at')
+
+def migrate_conversation_keyset_index(conn):
+    conn.execute(text("DROP INDEX IF EXISTS ix_chat_session_user_id_last_activity"))
+    create_chat_session_indexes(conn, 'ix_chat_session_user_id_last_activity_id')
+
+def migrate_message_count(conn):
+    """Add chat_session.message_count, backfilled from chat_message, with its indexes."""
+    columns = [column['name'] for column in inspect(conn).get_columns('chat_session')]
+    if 'message_count' not in columns:
+        conn.execute(text("ALTER TABLE chat_session ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text(
+        "UPDATE chat_session SET message_count = "
+        "(SELECT COUNT(*) FROM chat_message WHERE chat_message.session_id = chat_session.id)"
+    ))
+    create_chat_session_indexes(conn, 'ix_chat_session_user_id_message_count_created_at',
+                                'ix_chat_session_message_count_created_at')
+
+def migrate_sales_snapshots(conn):
+    """Move each session's sales_metadata copy into a shared sales_snapshot row and reference it by id."""
+    SalesSnapshot.__table__.create(conn, checkfirst=True)
+    columns = [column['name'] for column in inspect(conn).get_columns('chat_session')]
+    if 'sales_snapshot_id' not in columns:
+        conn.execute(text("ALTER TABLE chat_session ADD COLUMN sales_snapshot_id VARCHAR(64) REFERENCES sales_snapshot (id)"))
+    create_chat_session_indexes(conn, 'ix_chat_session_sales_snapshot_id')
+
+    after_id = ''
+    sessions = snapshots = 0
+    while True:
+        batch = conn.execute(text(
+            "SELECT id, sales_metadata FROM chat_session "
+            "WHERE id > :after_id AND sales_metadata IS NOT NULL ORDER BY id LIMIT 200"
+        ), {'after_id': after_id}).fetchall()
+        if not batch:
+            break
+        for session_id, sales_metadata in batch:
+            metadata = json_codec.decode(sales_metadata)
+            snapshot_id, encoded = encode_sales_snapshot(metadata)
+            result = conn.execute(sqlite_insert(SalesSnapshot.__table__).values(
+                id=snapshot_id, data=metadata, size_bytes=len(encoded), created_at=datetime.datetime.utcnow()
+            ).on_conflict_do_nothing(index_elements=['id']))
+            snapshots += result.rowcount
+            conn.execute(text(
+                "UPDATE chat_session SET sales_snapshot_id = :snapshot_id, sales_metadata = NULL WHERE id = :id"
+            ), {'snapshot_id': snapshot_id, 'id': session_id})
+            sessions += 1
+        after_id = batch[-1][0]
+    logger.info(f"Moved sales metadata of {sessions} sessions into {snapshots} distinct snapshots")
+
+def migrate_last_activity_index(conn):
+    create_chat_session_indexes(conn, 'ix_chat_session_last_activity')
+
+def migrate_sales_snapshot_last_used(conn):
+    """Add sales_snapshot.last_used_at, starting from created_at, for the snapshot janitor's cutoff."""
+    columns = [column['name'] for column in inspect(conn).get_columns('sales_snapshot')]
+    if 'last_used_at' not in columns:
+        conn.execute(text("ALTER TABLE sales_snapshot ADD COLUMN last_used_at DATETIME"))
+    conn.execute(text("UPDATE sales_snapshot SET last_used_at = created_at WHERE last_used_at IS NULL"))
+
+def migrate_turn_concurrency(conn):
+    """Add chat_session.version and the turn_claim table."""
+    columns = [column['name'] for column in inspect(conn).get_columns('chat_session')]
+    if 'version' not in columns:
+        conn.execute(text("ALTER TABLE chat_session ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+    TurnClaim.__table__.create(conn, checkfirst=True)
+
+MIGRATIONS = [
+    Migration('0001_chat_message', 'Move chat history JSON arrays into the chat_message table',
+              migrate_legacy_chat_history),
+    Migration('0002_datetime_columns', 'Typed DateTime columns and (user_id, time) indexes on chat_session',
+              migrate_datetime_columns),
+    Migration('0003_conversation_keyset_index', 'Add id to the (user_id, last_activity) index for keyset pagination',
+              migrate_conversation_keyset_index),
+    Migration('0004_message_count', 'Indexed message_count on chat_session for empty-chat checks',
+              migrate_message_count),
+    Migration('0005_sales_snapshot', 'Content-addressed sales_snapshot rows shared across sessions',
+              migrate_sales_snapshots),
+    Migration('0006_last_activity_index', 'Index on chat_session.last_activity for the session archive janitor',
+              migrate_last_activity_index),
+    Migration('0007_turn_concurrency', 'Session version for compare-and-swap turn commits, and per-session turn claims',
+              migrate_turn_concurrency),
+    Migration('0008_sales_snapshot_last_used', 'Track when each sales snapshot was last used, for the snapshot janitor',
+              migrate_sales_snapshot_last_used),
+]
+
 # Initialize database tables
 def init_db():
     try:
-        with app.app_context():
-            # Check if tables exist before creating
-            inspector = db.inspect(db.engine)
-            existing_tables = inspector.get_table_names()
-            
-            # Only create tables if they don't exist
-            if 'chat_session' not in existing_tables:
-                logger.info("Creating database tables...")
-                db.create_all()
-                logger.info("Tables created successfully")
-            else:
-                logger.info("Database tables already exist, skipping creation")
+        # Workers start together: hold a file lock so only one creates the tables at a time
+        with open(os.path.join(db_dir, '.init_db.lock'), 'w') as lock_file, app.app_context():
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Every shard holds the same tables and is migrated on its own
+            for shard in shard_router.shards():
+                engine = shard_engine(shard)
+                # Check if tables exist before creating
+                inspector = db.inspect(engine)
+                existing_tables = inspector.get_table_names()
+
+                # Only create tables if they don't exist
+                if 'chat_session' not in existing_tables:
+                    logger.info(f"Creating database tables in shard {shard}...")
+                    db.metadata.create_all(engine)
+                    logger.info("Tables created successfully")
+                else:
+                    logger.info(f"Database tables already exist in shard {shard}, skipping creation")
+
+                MigrationRunner(engine).run(MIGRATIONS)
+            db.create_all(bind_key='archive')  # Creates chat_archive.db on first start
                 
     except Exception as e:
         logger.error(f"Failed to initialize database: {str(e)}")
@@ -359,7 +1075,9 @@ def has_sales_rep_data(metadata):
     ])
 
 
-def get_system_prompt_with_sales_context(base_prompt: str, sales_context: dict) -> str:
+def get_system_prompt_with_sales_context(base_prompt: str, sales_context: dict, include_orders: bool = True,
+                                         max_orders: Optional[int] = None) -> str:
+    """Fill the prompt's sales context; without orders only the aggregate overview is included."""
     if not has_sales_rep_data(sales_context):
         return base_prompt
 
@@ -408,12 +1126,12 @@ def get_system_prompt_with_sales_context(base_prompt: str, sales_context: dict)
     context_sections.append(metrics_section)
  
     # Add recent orders detail JSON format
-    if sales_context.get('orders'):
+    if include_orders and sales_context.get('orders'):
         orders_section = "\nDetailed Order Information as of " + current_date + ":\n\n"
         # Create orders list in JSON format
         orders_json = {"orders": []}
         
-        for order in sales_context['orders']:
+        for order in sales_context['orders'][:max_orders]:
             customer_info = order.get('customer_info', {})
             delivery_info = order.get('delivery_info', {})
             product_info = order.get('product_info', {})
@@ -514,7 +1232,9 @@ def get_cached_sales_rep_data(email: str) -> Optional[dict]:
     logger.debug(f"Fetching fresh sales data for {email}")
     try:
         user_groups = get_user_groups_from_headers()
-        search_results = orchestrate_federated_search("*", user_groups, email)
+        search_results = orchestrate_federated_search(
+            "*", user_groups, email, deadline=Deadline(Config.SEARCH_DEADLINE_SECONDS)
+        )
         
         # Get sales data from first result
         if search_results and search_results[0].get('_index_name') in Config.SALES_GENERAL_INDEX:
@@ -532,22 +1252,13 @@ def get_cached_sales_rep_data(email: str) -> Optional[dict]:
     
     return None
 
-@app.route('/food')
-def food():
-     # Check for authentication
-    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
-    user_email = request.headers.get('X-MS-CLIENT-PRINCIPAL-NAME')
-    
-    # Add local development bypass using environment variables
-    if Config.IS_LOCAL_DEV:
-        user_id = user_id or Config.get_env('DEBUG_USER_ID', 'local-dev-user')
-        user_email = user_email or Config.get_env('DEBUG_USER_EMAIL', 'local-dev@example.com')
-    
-    if not user_id or not user_email:
-        logger.error("Missing authentication headers")
-        logger.debug(f"Headers: {dict(request.headers)}")
-        return "Authentication required", 401
-    
+def build_sales_metadata(user_email: str, prefer_cache: bool = False) -> dict:
+    """
+    Sales context for a chat session: defaults overlaid with the rep's federated search results.
+
+    The index pages always search (and refresh this worker's cache); the first
+    /message of a draft chat uses the cached copy when there is one.
+    """
     # Initialize metadata with defaults
     metadata = {
         'Email': user_email if user_email else "Not Available",
@@ -585,13 +1296,21 @@ def food():
         },
         'orders': []
     }
-    
+
+    if prefer_cache:
+        cached = sales_data_cache.get(user_email)
+        if cached is not None:
+            metadata.update(cached)
+            return metadata
+
     try:
         # Get user groups for federated search
         user_groups = get_user_groups_from_headers()
         
         # Perform federated search to get full context
-        search_results = orchestrate_federated_search("*", user_groups, user_email)
+        search_results = orchestrate_federated_search(
+            "*", user_groups, user_email, deadline=Deadline(Config.SEARCH_DEADLINE_SECONDS)
+        )
         
         if search_results:
             # Organize results by index
@@ -626,57 +1345,34 @@ def food():
         logger.error(f"Error retrieving sales rep data: {e}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         # Continue with default metadata
-    
-    # Filter chat sessions by user_id
-    all_chats = ChatSession.query.filter_by(user_id=user_id).order_by(ChatSession.created_at.desc()).all()
-    
-    # Get current session_id safely
-    current_session_id = session.get('session_id')
-    
-    conversations = [{
-        'id': chat.id,
-        'title': chat.focus_area or 'New Conversation',
-        'time': datetime.datetime.utcnow().fromisoformat(chat.created_at).strftime('%I:%M %p') if chat.created_at else '',
-        'active': chat.id == current_session_id
-    } for chat in all_chats]
 
-    # Create new session if none exists
-    if not current_session_id:
-        session['session_id'] = str(uuid4())
-        chat_session = initialize_chat_session(session['session_id'], user_id, metadata)
-        db.session.add(chat_session)
-        safe_commit()
-    else:
-        # Verify the session exists and belongs to this user
-        chat_session = db.session.get(ChatSession, current_session_id)
-        if not chat_session or chat_session.user_id != user_id:
-            # Invalid or unauthorized session, create new one
-            session['session_id'] = str(uuid4())
-            chat_session = initialize_chat_session(session['session_id'], user_id, metadata)
-            db.session.add(chat_session)
-            safe_commit()
-        else:
-            # Update existing session's metadata with new data
-            chat_session.sales_metadata = metadata
-            safe_commit()
+    return metadata
 
-    # Get current chat session data
-    chat_session = db.session.get(ChatSession, session['session_id'])
-    
-    chat_data = {
-        'chat_history': chat_session.chat_history,
-        'conversations': conversations,
-        'confidence_level': chat_session.confidence_level or 0,
-        'product_category': chat_session.product_category or "",
-        'detected_language': chat_session.detected_language or "",
-        'focus_area': chat_session.focus_area or "New Conversation",
-        'metadata': chat_session.sales_metadata
-    }
+def get_chat_session_or_draft(user_id: str, metadata: dict) -> 'ChatSession':
+    """
+    The chat session in the cookie, or an unsaved draft for a new chat.
 
-    return render_template("food.html", user_name=user_email, user_id=user_id, **chat_data)
+    Drafts are never added to the database session: loading a page writes
+    nothing, and the row is created together with the first turn in /message.
+    """
+    session_id = session.get('session_id')
+    if session_id:
+        chat_writer.wait_for(session_id)  # A draft's first turn may still be queued
+    chat_session = get_chat_session(session_id, user_id, SESSION_OWNER_COLUMNS)
+    if chat_session is not None and chat_session.user_id == user_id:
+        # Update existing session's metadata with new data, only if it changed
+        if chat_session.sales_snapshot_id != encode_sales_snapshot(metadata)[0]:
+            attach_sales_snapshot(chat_session, metadata)
+            safe_commit()
+        return chat_session
 
-@app.route('/protective')
-def protective():
+    if not session_id or chat_session is not None:
+        # No chat yet, or another user's session: start a new draft id
+        session['session_id'] = str(uuid4())
+    return initialize_chat_session(session['session_id'], user_id, metadata)
+
+@app.route('/food')
+def food():
      # Check for authentication
     user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
     user_email = request.headers.get('X-MS-CLIENT-PRINCIPAL-NAME')
@@ -691,136 +1387,33 @@ def protective():
         logger.debug(f"Headers: {dict(request.headers)}")
         return "Authentication required", 401
     
-    # Initialize metadata with defaults
-    metadata = {
-        'Email': user_email if user_email else "Not Available",
-        'Phone': "Not Available",
-        'total_orders': 0,
-        'blocked_orders': 0,
-        'total_order_quantity': 0,
-        'total_open_quantity': 0,
-        'execution_status': [],
-        'stock_availability': {
-            'claimed': 0,
-            'not_claimed': 0
-        },
-        'sales_documents': {
-            'types': [],
-            'total_value_usd': 0.0,
-            'total_value_dc': 0.0
-        },
-        'delivery_metrics': {
-            'on_time': 0,
-            'delayed': 0,
-            'reliability_scores': []
-        },
-        'territories': {
-            'companies': [],
-            'sales_orgs': [],
-            'plants': [],
-            'divisions': []
-        },
-        'customer_data': {
-            'sold_to_parties': [],
-            'ship_to_parties': [],
-            'countries': [],
-            'regions': []
-        },
-        'orders': []
-    }
-    
-    try:
-        # Get user groups for federated search
-        user_groups = get_user_groups_from_headers()
-        
-        # Perform federated search to get full context
-        search_results = orchestrate_federated_search("*", user_groups, user_email)
-        
-        if search_results:
-            # Organize results by index
-            index_data = {}
-            for result in search_results:
-                if result.get('_index_name') in Config.SALES_GENERAL_INDEX:
-                    # Update metadata with sales data
-                    metadata.update(result)
-                else:
-                    # Store other results in index_data
-                    index_name = result.pop('_index_name', 'unknown_index')
-                    index_data[index_name] = result
-            
-            # Store the organized data in metadata
-            metadata['index_data'] = index_data
-            
-            # Store additional search results in metadata for context
-            metadata['additional_context'] = []
-            for result in search_results[1:3]:  # Store up to 2 additional results
-                if result.get('_index_name') not in Config.SALES_GENERAL_INDEX:
-                    context_data = {}
-                    for key, value in result.items():
-                        if key not in ['_federated_score', '_index_name']:
-                            context_data[key] = value
-                    if context_data:
-                        metadata['additional_context'].append(context_data)
-            
-            # Update cache with new data
-            sales_data_cache.set(user_email, metadata)
-            
-    except Exception as e:
-        logger.error(f"Error retrieving sales rep data: {e}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        # Continue with default metadata
-    
-    # Filter chat sessions by user_id
-    all_chats = ChatSession.query.filter_by(user_id=user_id).order_by(ChatSession.created_at.desc()).all()
+    metadata = build_sales_metadata(user_email)
     
     # Get current session_id safely
     current_session_id = session.get('session_id')
     
-    conversations = [{
-        'id': chat.id,
-        'title': chat.focus_area or 'New Conversation',
-        'time': datetime.datetime.utcnow().fromisoformat(chat.created_at).strftime('%I:%M %p') if chat.created_at else '',
-        'active': chat.id == current_session_id
-    } for chat in all_chats]
-
-    # Create new session if none exists
-    if not current_session_id:
-        session['session_id'] = str(uuid4())
-        chat_session = initialize_chat_session(session['session_id'], user_id, metadata)
-        db.session.add(chat_session)
-        safe_commit()
-    else:
-        # Verify the session exists and belongs to this user
-        chat_session = db.session.get(ChatSession, current_session_id)
-        if not chat_session or chat_session.user_id != user_id:
-            # Invalid or unauthorized session, create new one
-            session['session_id'] = str(uuid4())
-            chat_session = initialize_chat_session(session['session_id'], user_id, metadata)
-            db.session.add(chat_session)
-            safe_commit()
-        else:
-            # Update existing session's metadata with new data
-            chat_session.sales_metadata = metadata
-            safe_commit()
+    # First page of the user's chat sessions; chat.js loads the rest on scroll
+    conversations, conversations_cursor = list_conversations(user_id, current_session_id)
 
-    # Get current chat session data
-    chat_session = db.session.get(ChatSession, session['session_id'])
+    # The cookie's chat, or a draft that becomes a row on its first message
+    chat_session = get_chat_session_or_draft(user_id, metadata)
     
     chat_data = {
-        'chat_history': chat_session.chat_history,
+        'chat_history': get_chat_history_entries(chat_session.id),
         'conversations': conversations,
+        'conversations_cursor': conversations_cursor,
         'confidence_level': chat_session.confidence_level or 0,
         'product_category': chat_session.product_category or "",
         'detected_language': chat_session.detected_language or "",
         'focus_area': chat_session.focus_area or "New Conversation",
-        'metadata': chat_session.sales_metadata
+        'metadata': session_sales_metadata(chat_session)
     }
 
-    return render_template("protective.html", user_name=user_email, user_id=user_id, **chat_data)
+    return render_template("food.html", user_name=user_email, user_id=user_id, **chat_data)
 
-@app.route('/', methods=['GET'])
-def index():
-    # Check for authentication
+@app.route('/protective')
+def protective():
+     # Check for authentication
     user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
     user_email = request.headers.get('X-MS-CLIENT-PRINCIPAL-NAME')
     
@@ -834,136 +1427,130 @@ def index():
         logger.debug(f"Headers: {dict(request.headers)}")
         return "Authentication required", 401
     
-    # Initialize metadata with defaults
-    metadata = {
-        'Email': user_email if user_email else "Not Available",
-        'Phone': "Not Available",
-        'total_orders': 0,
-        'blocked_orders': 0,
-        'total_order_quantity': 0,
-        'total_open_quantity': 0,
-        'execution_status': [],
-        'stock_availability': {
-            'claimed': 0,
-            'not_claimed': 0
-        },
-        'sales_documents': {
-            'types': [],
-            'total_value_usd': 0.0,
-            'total_value_dc': 0.0
-        },
-        'delivery_metrics': {
-            'on_time': 0,
-            'delayed': 0,
-            'reliability_scores': []
-        },
-        'territories': {
-            'companies': [],
-            'sales_orgs': [],
-            'plants': [],
-            'divisions': []
-        },
-        'customer_data': {
-            'sold_to_parties': [],
-            'ship_to_parties': [],
-            'countries': [],
-            'regions': []
-        },
-        'orders': []
-    }
+    metadata = build_sales_metadata(user_email)
     
-    try:
-        # Get user groups for federated search
-        user_groups = get_user_groups_from_headers()
-        
-        # Perform federated search to get full context
-        search_results = orchestrate_federated_search("*", user_groups, user_email)
-        
-        if search_results:
-            # Organize results by index
-            index_data = {}
-            for result in search_results:
-                if result.get('_index_name') in Config.SALES_GENERAL_INDEX:
-                    # Update metadata with sales data
-                    metadata.update(result)
-                else:
-                    # Store other results in index_data
-                    index_name = result.pop('_index_name', 'unknown_index')
-                    index_data[index_name] = result
-            
-            # Store the organized data in metadata
-            metadata['index_data'] = index_data
-            
-            # Store additional search results in metadata for context
-            metadata['additional_context'] = []
-            for result in search_results[1:3]:  # Store up to 2 additional results
-                if result.get('_index_name') not in Config.SALES_GENERAL_INDEX:
-                    context_data = {}
-                    for key, value in result.items():
-                        if key not in ['_federated_score', '_index_name']:
-                            context_data[key] = value
-                    if context_data:
-                        metadata['additional_context'].append(context_data)
-            
-            # Update cache with new data
-            sales_data_cache.set(user_email, metadata)
-            
-    except Exception as e:
-        logger.error(f"Error retrieving sales rep data: {e}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        # Continue with default metadata
+    # Get current session_id safely
+    current_session_id = session.get('session_id')
+    
+    # First page of the user's chat sessions; chat.js loads the rest on scroll
+    conversations, conversations_cursor = list_conversations(user_id, current_session_id)
+
+    # The cookie's chat, or a draft that becomes a row on its first message
+    chat_session = get_chat_session_or_draft(user_id, metadata)
+    
+    chat_data = {
+        'chat_history': get_chat_history_entries(chat_session.id),
+        'conversations': conversations,
+        'conversations_cursor': conversations_cursor,
+        'confidence_level': chat_session.confidence_level or 0,
+        'product_category': chat_session.product_category or "",
+        'detected_language': chat_session.detected_language or "",
+        'focus_area': chat_session.focus_area or "New Conversation",
+        'metadata': session_sales_metadata(chat_session)
+    }
+
+    return render_template("protective.html", user_name=user_email, user_id=user_id, **chat_data)
+
+@app.route('/', methods=['GET'])
+def index():
+    # Check for authentication
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
+    user_email = request.headers.get('X-MS-CLIENT-PRINCIPAL-NAME')
+    
+    # Add local development bypass using environment variables
+    if Config.IS_LOCAL_DEV:
+        user_id = user_id or Config.get_env('DEBUG_USER_ID', 'local-dev-user')
+        user_email = user_email or Config.get_env('DEBUG_USER_EMAIL', 'local-dev@example.com')
+    
+    if not user_id or not user_email:
+        logger.error("Missing authentication headers")
+        logger.debug(f"Headers: {dict(request.headers)}")
+        return "Authentication required", 401
     
-    # Filter chat sessions by user_id
-    all_chats = ChatSession.query.filter_by(user_id=user_id).order_by(ChatSession.created_at.desc()).all()
+    metadata = build_sales_metadata(user_email)
     
     # Get current session_id safely
     current_session_id = session.get('session_id')
     
-    conversations = [{
-        'id': chat.id,
-        'title': chat.focus_area or 'New Conversation',
-        'time': datetime.datetime.utcnow().fromisoformat(chat.created_at).strftime('%I:%M %p') if chat.created_at else '',
-        'active': chat.id == current_session_id
-    } for chat in all_chats]
-
-    # Create new session if none exists
-    if not current_session_id:
-        session['session_id'] = str(uuid4())
-        chat_session = initialize_chat_session(session['session_id'], user_id, metadata)
-        db.session.add(chat_session)
-        safe_commit()
-    else:
-        # Verify the session exists and belongs to this user
-        chat_session = db.session.get(ChatSession, current_session_id)
-        if not chat_session or chat_session.user_id != user_id:
-            # Invalid or unauthorized session, create new one
-            session['session_id'] = str(uuid4())
-            chat_session = initialize_chat_session(session['session_id'], user_id, metadata)
-            db.session.add(chat_session)
-            safe_commit()
-        else:
-            # Update existing session's metadata with new data
-            chat_session.sales_metadata = metadata
-            safe_commit()
+    # First page of the user's chat sessions; chat.js loads the rest on scroll
+    conversations, conversations_cursor = list_conversations(user_id, current_session_id)
 
-    # Get current chat session data
-    chat_session = db.session.get(ChatSession, session['session_id'])
+    # The cookie's chat, or a draft that becomes a row on its first message
+    chat_session = get_chat_session_or_draft(user_id, metadata)
     
     chat_data = {
-        'chat_history': chat_session.chat_history,
+        'chat_history': get_chat_history_entries(chat_session.id),
         'conversations': conversations,
+        'conversations_cursor': conversations_cursor,
         'confidence_level': chat_session.confidence_level or 0,
         'product_category': chat_session.product_category or "",
         'detected_language': chat_session.detected_language or "",
         'focus_area': chat_session.focus_area or "New Conversation",
-        'metadata': chat_session.sales_metadata
+        'metadata': session_sales_metadata(chat_session)
     }
 
     return render_template("chat.html", user_name=user_email, user_id=user_id, **chat_data)
 
+# Telemetry streams are hourly partitions of these blob prefixes: (container, log file name)
+TELEMETRY_PREFIXES = {
+    'chats': (Config.AZURE_STORAGE_CONTAINER_TELEMETRY_NAME, 'chat_log'),
+    'feedback': (Config.AZURE_STORAGE_CONTAINER_FEEDBACK_NAME, 'feedback_log')
+}
+telemetry_blobs = HourlyBlobNames()
+
+def telemetry_container(container_name: str):
+    return azure_clients.container(Config.AZURE_STORAGE_ACCOUNT, container_name)
+
+def append_telemetry(stream: str, data: bytes) -> None:
+    """
+    Append a batch of JSONL records to this worker's blob for the stream's hour
+    (Append or Create), rolling to a new blob when it is full. Runs on the
+    telemetry thread.
+    """
+    if '/' not in stream:  # Spooled before streams were hourly partitions ('chat' / 'feedback')
+        stream = hourly_partition('chats' if stream == 'chat' else stream, datetime.datetime.utcnow())
+    container_name, log_name = TELEMETRY_PREFIXES[stream.split('/', 1)[0]]
+    container_client = telemetry_container(container_name)
+    for _ in range(2):
+        blob_name = telemetry_blobs.blob_name(stream, log_name)
+        blob_client = container_client.get_blob_client(blob_name)
+        try:
+            try:
+                blob_client.append_block(data)
+            except ResourceNotFoundError:
+                blob_client.upload_blob(data, blob_type="AppendBlob")
+        except HttpResponseError as e:
+            if e.error_code != 'BlockCountExceedsLimit':
+                raise
+            telemetry_blobs.roll(stream)  # Left full by an earlier process with this pid
+            continue
+        telemetry_blobs.appended(stream)
+        logger.debug(f"Telemetry appended to blob: {blob_name} ({len(data)} bytes)")
+        return
+    raise RuntimeError(f"No telemetry blob with room left for {stream}")
+
+telemetry_spool = TelemetrySpool(
+    Config.TELEMETRY_SPOOL_DIR or os.path.join(db_dir, 'telemetry_spool'),
+    segment_bytes=Config.TELEMETRY_SPOOL_SEGMENT_KB * 1024,
+    max_bytes=Config.TELEMETRY_SPOOL_MAX_MB * 1024 * 1024
+) if Config.TELEMETRY_SPOOL_ENABLED else None
+
+telemetry = TelemetryWriter(
+    append_telemetry,
+    flush_interval_seconds=Config.TELEMETRY_FLUSH_INTERVAL_SECONDS,
+    max_queue=Config.TELEMETRY_MAX_QUEUE,
+    max_batch_records=Config.TELEMETRY_MAX_BATCH_RECORDS,
+    enabled=Config.TELEMETRY_ASYNC_ENABLED,
+    spool=telemetry_spool,
+    spool_retry_seconds=Config.TELEMETRY_SPOOL_RETRY_SECONDS
+)
+telemetry.start()
+atexit.register(telemetry.close)
+
 def log_chat_to_blob(user_id, user_email, chat_input, session_id):
     """
-    Log chat messages to Azure Blob Storage in JSONL format.
+    Queue a chat message for Azure Blob Storage in JSONL format; the telemetry
+    thread appends it with the other records of its flush interval.
     
     Args:
         user_id: The ID of the user
@@ -973,7 +1560,6 @@ def log_chat_to_blob(user_id, user_email, chat_input, session_id):
     """
     try:
         now = datetime.datetime.utcnow()
-        blob_name = f"chats/{now.year}/{now.month:02d}/{now.day:02d}/{now.hour:02d}/chat_log_{int(now.timestamp())}.jsonl"
 
         # Chat data as JSON
         chat_data = {
@@ -984,28 +1570,7 @@ def log_chat_to_blob(user_id, user_email, chat_input, session_id):
             "session_id": session_id,
             "message": chat_input
         }
-
-        # Convert to JSON line
-        chat_jsonl = json.dumps(chat_data) + "\n"
-
-        # Initialize the Blob Service Client using DefaultAzureCredential
-        account_url = f"https://{Config.AZURE_STORAGE_ACCOUNT}.blob.core.windows.net"
-        credential = DefaultAzureCredential()
-        blob_service_client = BlobServiceClient(account_url, credential=credential)
-        
-        # Get the container client for telemetry
-        container_client = blob_service_client.get_container_client(Config.AZURE_STORAGE_CONTAINER_TELEMETRY_NAME)
-
-        # Upload to Blob Storage (Append or Create)
-        blob_client = container_client.get_blob_client(blob_name)
-        try:
-            # Try to append to existing blob
-            blob_client.append_block(chat_jsonl)
-        except ResourceNotFoundError:
-            # If blob doesn't exist, create it
-            blob_client.upload_blob(chat_jsonl, blob_type="AppendBlob")
-        
-        logger.info(f"Chat logged to blob: {blob_name}")
+        telemetry.log(hourly_partition('chats', now), chat_data)
         
     except Exception as e:
         logger.error(f"Failed to log chat to blob: {str(e)}")
@@ -1013,24 +1578,291 @@ def log_chat_to_blob(user_id, user_email, chat_input, session_id):
 
 @app.route('/message', methods=['POST'])
 def handle_message():
+    """
+    Run one chat turn under a deadline, cancellable by the client via /cancel_message.
+
+    One turn per chat at a time: a second message for the same session (another
+    tab, a double submit) is rejected with 409 before any work is done.
+    """
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
+    if Config.IS_LOCAL_DEV:
+        user_id = user_id or Config.DEBUG_USER_ID
+    if not user_id:
+        return jsonify({"error": "Authentication required"}), 401
+
+    session_id = session.get('session_id')
+    if session_id:
+        chat_writer.wait_for(session_id)  # This worker's previous turn releases its claim when it lands
+        token = claim_turn(session_id)
+        if token is None:
+            logger.info(f"Rejected concurrent turn for session {session_id}")
+            return jsonify({"conflict": True, "error": "A reply for this chat is still in progress"}), 409
+        g.turn_claim = (session_id, token)
+
+    deadline = Deadline(Config.MESSAGE_DEADLINE_SECONDS)
+    cancel_token = inflight_requests.register(user_id, request.form.get('request_id'), deadline)
+    try:
+        # Keep the turn's writes pending until its commit: an autoflushed INSERT or UPDATE
+        # would hold the shard's write lock across the completion call
+        with db.session.no_autoflush:
+            return process_chat_message(cancel_token, deadline)
+    except RequestCancelled as e:
+        # The client went away: drop the turn instead of spending more work on it
+        db.session.rollback()
+        logger.info(f"Message cancelled by client during {e.stage}")
+        return jsonify({"cancelled": True, "error": "Request cancelled"}), 499
+    except TurnConflict as e:
+        db.session.rollback()
+        logger.warning(f"Dropped turn for session {e.session_id}: another turn committed first")
+        return jsonify({"conflict": True, "error": "This chat was updated by another message; please resend"}), 409
+    finally:
+        inflight_requests.unregister(cancel_token)
+        claim = g.pop('turn_claim', None)  # Unless handed to the write-behind queue with the turn
+        if claim:
+            db.session.rollback()  # End the turn's transaction, if it failed mid-way, so the release can write
+            release_turn(*claim)
+
+
+@app.route('/cancel_message', methods=['POST'])
+def cancel_message():
+    """Cancel one of the current user's in-flight /message requests."""
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
+    if Config.IS_LOCAL_DEV:
+        user_id = user_id or Config.DEBUG_USER_ID
+    if not user_id:
+        return jsonify({"success": False, "error": "Authentication required"}), 401
+
+    data = request.get_json(silent=True) or request.form
+    if not inflight_requests.cancel(user_id, data.get('request_id')):
+        return jsonify({"success": False, "error": "No such request in progress"}), 404
+    return jsonify({"success": True})
+
+
+def run_scheduled_completion(cancel_token, deadline, **kwargs):
+    """
+    Run a streamed chat completion behind the token-rate scheduler.
 
-    chat_session = db.session.get(ChatSession, session['session_id'])
+    The request is charged its estimated prompt tokens (plus retrieved
+    documents and the completion allowance) before it is sent, and settled
+    against actual usage afterwards. The deployment pool fails over between
+    deployments; once all of them are rate limited, admissions pause for
+    Retry-After and the request is retried while the deadline allows.
+    """
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID', Config.DEBUG_USER_ID)
+    estimated_tokens = estimate_tokens(kwargs['messages']) + kwargs.get('max_tokens', 0)
+    for data_source in (kwargs.get('extra_body') or {}).get('data_sources', []):
+        estimated_tokens += data_source['parameters'].get('top_n_documents', 0) * RETRIEVED_DOC_TOKEN_ESTIMATE
+
+    attempts = Config.AZURE_OPENAI_RATE_LIMIT_RETRIES + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            ticket = completion_scheduler.acquire(
+                user_id, estimated_tokens,
+                timeout=deadline.remaining(),
+                abort=lambda: cancel_token.abandoned
+            )
+        except AdmissionRejected:
+            if cancel_token.cancelled:
+                raise RequestCancelled(cancel_token.reason, "admission")
+            raise
+
+        started = time.monotonic()
+        try:
+            response = openai_pool.run(lambda deployment: stream_chat_completion(
+                deployment.client,
+                cancel_token=cancel_token,
+                deadline=deadline,
+                include_usage=Config.AZURE_OPENAI_STREAM_USAGE,
+                model=deployment.deployment,
+                **kwargs
+            ))
+            degradation.record(time.monotonic() - started, ok=True)
+            ticket.actual_tokens = response.usage.total_tokens
+            return response
+        except (RateLimitError, DeploymentUnavailable) as e:
+            if isinstance(e, RateLimitError):
+                degradation.record(time.monotonic() - started, ok=False)
+            # Rejected requests are not billed against the quota
+            ticket.actual_tokens = 0
+            delay = (openai_pool.seconds_until_available() or retry_after_seconds(e)
+                     or Config.AZURE_OPENAI_RETRY_AFTER_DEFAULT)
+            completion_scheduler.pause_for(delay)
+            if attempt == attempts or delay >= deadline.remaining():
+                raise
+            logger.warning(f"Azure OpenAI returned 429; retrying after {delay:.1f}s (attempt {attempt}/{attempts})")
+        except RequestCancelled as e:
+            # A client leaving says nothing about upstream health; running out of time does
+            if e.reason == "deadline":
+                degradation.record(time.monotonic() - started, ok=False)
+            raise
+        except Exception:
+            degradation.record(time.monotonic() - started, ok=False)
+            raise
+        finally:
+            completion_scheduler.release(ticket)
+
+
+def start_draft_chat_session():
+    """Create the row for a draft chat on its first message; it is committed together with the turn."""
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID', Config.DEBUG_USER_ID)
+    user_email = request.headers.get('X-MS-CLIENT-PRINCIPAL-NAME', Config.DEBUG_USER_EMAIL)
+    if not session.get('session_id'):
+        session['session_id'] = str(uuid4())
+    chat_session = initialize_chat_session(session['session_id'], user_id, None)
+    attach_sales_snapshot(chat_session, build_sales_metadata(user_email, prefer_cache=True))
+    db.session.add(chat_session)
+    return chat_session
+
+
+class TurnConflict(Exception):
+    """Another turn for the session committed after this one read it."""
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Concurrent turn on session {session_id}")
+        self.session_id = session_id
+
+def claim_turn(session_id: str) -> Optional[str]:
+    """
+    Claim a session for one turn, across workers; returns the claim token, or
+    None while another turn holds it.
+
+    A single upsert on the user's shard: it takes the row if there is none or
+    the holder's claim has expired (a crashed worker), and changes nothing
+    otherwise. The claim is released after the turn is committed.
+    """
+    turn_claims = TurnClaim.__table__
+    token = str(uuid4())
+    now = datetime.datetime.utcnow()
+    expired = now - datetime.timedelta(seconds=Config.TURN_CLAIM_TIMEOUT_SECONDS)
+    insert = sqlite_insert(turn_claims).values(session_id=session_id, token=token, claimed_at=now)
+    with shard_engine().begin() as conn:
+        result = conn.execute(insert.on_conflict_do_update(
+            index_elements=['session_id'],
+            set_={'token': insert.excluded.token, 'claimed_at': insert.excluded.claimed_at},
+            where=turn_claims.c.claimed_at < expired
+        ))
+    return token if result.rowcount else None
+
+def release_turn(session_id: str, token: str) -> None:
+    turn_claims = TurnClaim.__table__
+    try:
+        with shard_engine().begin() as conn:
+            conn.execute(turn_claims.delete().where(turn_claims.c.session_id == session_id,
+                                                    turn_claims.c.token == token))
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to release turn claim for session {session_id}, it expires on its own: {str(e)}")
+
+def chat_turn_write(chat_session, turn_messages: list, claim: Optional[tuple] = None) -> dict:
+    """A chat turn as plain column values, so it can be committed outside the request."""
+    now = datetime.datetime.utcnow()
+    unloaded = inspect(chat_session).unloaded  # Deferred JSON columns; reading them would load them
+    return {
+        'claim': claim,  # (session_id, token), released in the turn's transaction
+        'session': {column.name: getattr(chat_session, column.name) for column in ChatSession.__table__.columns
+                    if column.key not in unloaded},
+        'messages': [
+            {**{column.name: getattr(message, column.name) for column in ChatMessage.__table__.columns
+                if column.name != 'id'}, 'created_at': now}
+            for message in turn_messages
+        ]
+    }
+
+def chat_turn_shard(turn: dict) -> int:
+    return shard_router.shard_for(turn['session']['user_id'])
+
+def apply_chat_turns(turns: list) -> None:
+    """Commit queued chat turns of one shard in one transaction. Runs on the write-behind thread."""
+    chat_sessions = ChatSession.__table__
+    with shard_router.use(chat_turn_shard(turns[0])), app.app_context():
+        try:
+            for turn in turns:
+                row = turn['session']
+                # A draft chat's first turn also creates its row
+                db.session.execute(
+                    sqlite_insert(chat_sessions).values(**{**row, 'message_count': 0, 'version': 0})
+                    .on_conflict_do_nothing(index_elements=['id'])
+                )
+                db.session.execute(chat_sessions.update().where(chat_sessions.c.id == row['id']).values(
+                    last_activity=row['last_activity'],
+                    confidence_level=row['confidence_level'],
+                    product_category=row['product_category'],
+                    focus_area=row['focus_area'],
+                    detected_language=row['detected_language'],
+                    message_count=chat_sessions.c.message_count + len(turn['messages']),
+                    version=chat_sessions.c.version + 1  # Turns are serialized by the claim held until now
+                ))
+                db.session.execute(ChatMessage.__table__.insert(), turn['messages'])
+                if turn.get('claim'):
+                    session_id, token = turn['claim']
+                    db.session.execute(TurnClaim.__table__.delete().where(
+                        TurnClaim.session_id == session_id, TurnClaim.token == token
+                    ))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+def release_dropped_turn(turn: dict) -> None:
+    """Free the claim of a turn the write-behind queue gave up on, so the chat takes new messages."""
+    if turn.get('claim'):
+        with shard_router.use(chat_turn_shard(turn)), app.app_context():
+            release_turn(*turn['claim'])
+
+chat_writer = WriteBehindQueue(
+    apply_chat_turns,
+    max_queue=Config.WRITE_BEHIND_MAX_QUEUE,
+    batch_size=Config.WRITE_BEHIND_BATCH_SIZE,
+    enabled=Config.WRITE_BEHIND_ENABLED,
+    partition=chat_turn_shard,  # apply_chat_turns commits to one shard at a time
+    on_drop=release_dropped_turn
+)
+chat_writer.start()
+atexit.register(chat_writer.close)  # Durability flush on graceful worker shutdown
+
+
+def process_chat_message(cancel_token, deadline):
+
+    if session.get('session_id'):
+        chat_writer.wait_for(session['session_id'])  # The previous turn may still be queued
+    chat_session = get_chat_session(session.get('session_id'),
+                                    request.headers.get('X-MS-CLIENT-PRINCIPAL-ID', Config.DEBUG_USER_ID))
+    if chat_session is None:
+        chat_session = start_draft_chat_session()
+    read_version = chat_session.version  # None for a draft
     
     #check if sales_metadata is empty, if so, set it to an empty dictionary
-    try:
-        sales_context = chat_session.sales_metadata
-    except:
-        logger.info("Sales metadata is empty")
-        sales_context = {}
+    sales_context = session_sales_metadata(chat_session) or {}
     
     # Update last activity timestamp
-    chat_session.last_activity = datetime.datetime.utcnow().isoformat()
+    chat_session.last_activity = datetime.datetime.utcnow()
     
     # Initialize citations list
     citations = []
-    
+
+    user_question = request.form.get('question', '').strip()
+    uploaded_file = request.files.get('photoupload')
+
+    # Route the turn before building the prompt: the route decides how much
+    # sales context goes into it and whether documents are retrieved
+    referrer = request.referrer or ""
+    is_food_route = "/food" in referrer
+    route = query_router.route(
+        user_question,
+        has_image=bool(uploaded_file and uploaded_file.filename != ''),
+        is_food_route=is_food_route
+    )
+
+    # Under upstream pressure the turn is made cheaper (see DegradationController)
+    degradation_level = degradation.level()
+    reduced_context = degradation_level >= DegradationController.REDUCED_CONTEXT
+    llm_route = degradation.apply(route, degradation_level, Config.DEGRADED_MAX_TOKENS)
+
     # Create base messages list with combined system prompt
-    combined_system_prompt = get_system_prompt_with_sales_context(get_base_system_prompt(), sales_context)
+    base_system_prompt = get_base_system_prompt()
+    combined_system_prompt = get_system_prompt_with_sales_context(
+        base_system_prompt, sales_context, include_orders=route.include_orders,
+        max_orders=Config.DEGRADED_MAX_ORDERS if reduced_context else None
+    )
     
     # Add logging for the combined system prompt
     logger.debug("Combined System Prompt:")
@@ -1038,12 +1870,15 @@ def handle_message():
     
     new_messages = [{"role": "system", "content": combined_system_prompt}]
     
-    # Copy lists for local modifications and limit to last N messages
-    new_chat_history = list(chat_session.chat_history[-MESSAGE_HISTORY_LIMIT:])
-    
-    # For OpenAI messages, use standardized truncation
-    conversation_messages = get_truncated_messages(chat_session.messages)
-    new_messages.extend(conversation_messages[1:])  # Skip system message as we already added it
+    # Only the last N messages are read (an indexed range query), so the cost
+    # of a turn does not grow with the length of the conversation
+    recent_rows = load_chat_messages(chat_session.id, limit=MESSAGE_HISTORY_LIMIT, with_payload=True)
+    new_chat_history = [row.to_history_entry() for row in recent_rows]
+
+    # Failed turns stay visible but are kept out of the prompt
+    history_limit = Config.DEGRADED_HISTORY_MESSAGES if reduced_context else MESSAGE_HISTORY_LIMIT
+    context_rows = [row for row in recent_rows if row.in_context][-history_limit:]
+    new_messages.extend(row.to_model_message() for row in context_rows)
 
     # Add these debug statements
     logger.debug(f"Form data: {request.form}")
@@ -1052,8 +1887,6 @@ def handle_message():
     
     # Log incoming request
     logger.debug("Received classification request")
-    user_question = request.form.get('question', '').strip()
-    uploaded_file = request.files.get('photoupload')
     logger.debug(f"User question: {user_question}")
     logger.debug(f"File uploaded: {bool(uploaded_file and uploaded_file.filename != '')}")
 
@@ -1103,11 +1936,10 @@ def handle_message():
             return render_template("chat.html", error="Error processing image. Please try again.")
     
     # Update messages structure for image support
+    user_payload = None
     if image_data:
         # Keep existing messages and append new message with image
-        new_messages.append({
-            "role": "user",
-            "content": [
+        user_payload = [
                 {
                     "type": "text",
                     "text": user_question
@@ -1119,6 +1951,9 @@ def handle_message():
                     }
                 }
             ]
+        new_messages.append({
+            "role": "user",
+            "content": user_payload
         })
     else:
         # Regular text message
@@ -1143,168 +1978,228 @@ def handle_message():
     product_category = ""
     focus_area = ""
     detected_language = ""
+    key_takeaways = []
     actions = None
+    response = None
+    response_source = "llm"
+    turn_in_context = False
+
+    # Plain order-status lookups are answered from the rep's orders without an LLM call
+    fast_answer = None
+    if not image_data:
+        fast_answer = fast_path.answer(user_question, sales_context)
+
+    # Self-contained product questions on the product route (first turn, no image,
+    # no rep-specific references) can be answered from the shared answer cache
+    cache_key = None
+    cached_answer = None
+    if (fast_answer is None and Config.ANSWER_CACHE_ENABLED and route.use_retrieval and not route.include_orders
+            and not image_data and len(new_chat_history) == 1 and AnswerCache.is_cacheable(user_question)):
+        # A shared answer must not see this rep's sales context, so it is generated from the base prompt alone
+        new_messages[0] = {"role": "system", "content": base_system_prompt}
+        cache_key = answer_cache.make_key(
+            user_question,
+            get_answer_cache_prompt_variant(route, base_system_prompt),
+            answer_cache_index.current_version()
+        )
+        cached_answer = answer_cache.get(cache_key)
     
     try:
-        client = AzureOpenAI(
-            azure_endpoint=Config.AZURE_OPENAI_ENDPOINT,
-            api_key=Config.AZURE_OPENAI_KEY,
-            api_version=Config.AZURE_OPENAI_API_VERSION,
-        )
-
-        # Determine which index to use based on the request path
-        referrer = request.referrer or ""
-        if "/food" in referrer:
-            # For food route, don't include data source
-            response = client.chat.completions.create(
-                model=Config.AZURE_OPENAI_DEPLOYMENT,
-                messages=new_messages,
-                temperature=TEMPERATURE,
-                max_tokens=MAX_TOKENS['COMPLETION'],
-                stream=False
-            )
+        prepared_answer = fast_answer or cached_answer
+        if prepared_answer is not None:
+            # Fast-path and cached answers skip both the data-source retrieval and the completion
+            response_source = "fast_path" if fast_answer is not None else "answer_cache"
+            logger.debug(f"Serving answer from {response_source}")
+            guidance = prepared_answer['response']
+            citations = deepcopy(prepared_answer['citations'])
+            confidence_level = prepared_answer['confidence_level']
+            product_category = prepared_answer['product_category']
+            focus_area = prepared_answer['focus_area']
+            detected_language = prepared_answer['detected_language']
+            key_takeaways = list(prepared_answer['key_takeaways'])
+        elif degradation_level >= DegradationController.CACHED_ONLY:
+            # Shed LLM work entirely until upstream latency recovers
+            response_source = "degraded"
+            guidance = ("The assistant is under heavy load right now, so only quick order lookups are available. "
+                        "Please try again in a few minutes.")
         else:
-            # For default route, include data source with semantic search
-            index_name = Config.AZURE_OPENAI_SEARCH_INDEX
-            semantic_config = f"{Config.AZURE_OPENAI_SEARCH_INDEX}-semantic-configuration"
-            query_type = "semantic"
-            data_source = {
-                "type": "azure_search",
-                "parameters": {
-                    "endpoint": Config.AZURE_AI_SEARCH_ENDPOINT,
-                    "key": Config.AZURE_AI_SEARCH_KEY,
-                    "index_name": index_name,
-                    "semantic_configuration": semantic_config,
-                    "query_type": query_type,
-                    "fields_mapping": {},
-                    "in_scope": True,
-                    "filter": None,
-                    "strictness": 4,
-                    "top_n_documents": Config.AZURE_AI_SEARCH_TOP_N_DOCS,
-                    "authentication": {
-                        "type": "api_key",
-                        "key": Config.AZURE_AI_SEARCH_KEY
+            completion_started = time.monotonic()
+            if not llm_route.use_retrieval:
+                # Food and order routes answer from the sales context, no data source
+                response = run_scheduled_completion(
+                    cancel_token,
+                    deadline,
+                    messages=new_messages,
+                    temperature=TEMPERATURE,
+                    max_tokens=llm_route.max_tokens
+                )
+            else:
+                # Product and mixed routes include data source with semantic search
+                index_name = Config.AZURE_OPENAI_SEARCH_INDEX
+                semantic_config = f"{Config.AZURE_OPENAI_SEARCH_INDEX}-semantic-configuration"
+                query_type = "semantic"
+                data_source = {
+                    "type": "azure_search",
+                    "parameters": {
+                        "endpoint": Config.AZURE_AI_SEARCH_ENDPOINT,
+                        "key": Config.AZURE_AI_SEARCH_KEY,
+                        "index_name": index_name,
+                        "semantic_configuration": semantic_config,
+                        "query_type": query_type,
+                        "fields_mapping": {},
+                        "in_scope": True,
+                        "filter": None,
+                        "strictness": 4,
+                        "top_n_documents": llm_route.top_n,
+                        "authentication": {
+                            "type": "api_key",
+                            "key": Config.AZURE_AI_SEARCH_KEY
+                        }
                     }
                 }
-            }
-            response = client.chat.completions.create(
-                model=Config.AZURE_OPENAI_DEPLOYMENT,
-                messages=new_messages,
-                temperature=TEMPERATURE,
-                max_tokens=MAX_TOKENS['COMPLETION'],
-                stream=False,
-                extra_body={
-                    "data_sources": [data_source]
-                }
+                response = run_scheduled_completion(
+                    cancel_token,
+                    deadline,
+                    messages=new_messages,
+                    temperature=TEMPERATURE,
+                    max_tokens=llm_route.max_tokens,
+                    extra_body={
+                        "data_sources": [data_source]
+                    }
+                )
+    
+            logger.debug("Successfully received Azure OpenAI response")
+            query_router.record(
+                route.name,
+                time.monotonic() - completion_started,
+                response.usage.prompt_tokens,
+                response.usage.completion_tokens
             )
-    
-        logger.debug("Successfully received Azure OpenAI response")
         
-        # Extract citations and context information
-        if hasattr(response.choices[0].message, 'context'):
-            context = response.choices[0].message.context
+            # Extract citations and context information
+            if response.context:
+                context = response.context
             
-            # Handle citations
-            if context and 'citations' in context:
-                citations = [{
-                    'title': citation.get('title', ''),
-                    'content': citation.get('content', ''),  # New field in the schema
-                    'filepath': citation.get('filepath', ''),
-                    'url': (f"/documents/{citation.get('filepath')}" if citation.get('filepath')
-                            else f"/documents/{citation.get('url').split('/')[-1]}" if citation.get('url')
-                            else ""),  # Provide default empty string if both are None
-                    'chunk_id': citation.get('chunk_id', '')  # New field in the schema
-                } for citation in context['citations']]
+                # Handle citations
+                if context and 'citations' in context:
+                    citations = [{
+                        'title': citation.get('title', ''),
+                        'content': citation.get('content', ''),  # New field in the schema
+                        'filepath': citation.get('filepath', ''),
+                        'url': (f"/documents/{citation.get('filepath')}" if citation.get('filepath')
+                                else f"/documents/{citation.get('url').split('/')[-1]}" if citation.get('url')
+                                else ""),  # Provide default empty string if both are None
+                        'chunk_id': citation.get('chunk_id', '')  # New field in the schema
+                    } for citation in context['citations']]
                 
-                # Log retrieved documents if available
-                if 'all_retrieved_documents' in context:
-                    logger.debug("All retrieved documents:")
-                    for doc in context['all_retrieved_documents']:
-                        logger.debug(f"  Search queries: {doc.get('search_queries', [])}")
-                        logger.debug(f"  Data source index: {doc.get('data_source_index')}")
-                        logger.debug(f"  Original search score: {doc.get('original_search_score')}")
-                        logger.debug(f"  Rerank score: {doc.get('rerank_score')}")
-                        logger.debug(f"  Filter reason: {doc.get('filter_reason')}")
+                    # Log retrieved documents if available
+                    if 'all_retrieved_documents' in context:
+                        logger.debug("All retrieved documents:")
+                        for doc in context['all_retrieved_documents']:
+                            logger.debug(f"  Search queries: {doc.get('search_queries', [])}")
+                            logger.debug(f"  Data source index: {doc.get('data_source_index')}")
+                            logger.debug(f"  Original search score: {doc.get('original_search_score')}")
+                            logger.debug(f"  Rerank score: {doc.get('rerank_score')}")
+                            logger.debug(f"  Filter reason: {doc.get('filter_reason')}")
                 
-                # Log intent if available
-                if 'intent' in context:
-                    logger.debug(f"Detected intent: {context['intent']}")
+                    # Log intent if available
+                    if 'intent' in context:
+                        logger.debug(f"Detected intent: {context['intent']}")
 
-        guidance = response.choices[0].message.content.strip()
+            guidance = response.content.strip()
         
-        # Clean up guidance text
-        guidance = guidance.replace('```', '')
-        guidance = guidance.strip()
+            # Clean up guidance text
+            guidance = guidance.replace('```', '')
+            guidance = guidance.strip()
         
-        # Filter out response prefixes using regex
-        prefix_pattern = r'^\s*(?:#+\s*)?(?:PART\s*2\s*[-:]*\s*(?:RESPONSE)?[^\n]*\n)'
-        guidance = re.sub(prefix_pattern, '', guidance, flags=re.IGNORECASE|re.MULTILINE).strip()
+            # Filter out response prefixes using regex
+            prefix_pattern = r'^\s*(?:#+\s*)?(?:PART\s*2\s*[-:]*\s*(?:RESPONSE)?[^\n]*\n)'
+            guidance = re.sub(prefix_pattern, '', guidance, flags=re.IGNORECASE|re.MULTILINE).strip()
 
-        try:
-            # Now try to parse the JSON metadata
-            json_str = guidance[guidance.find('{'):guidance.find('}')+1]
-            conversation = guidance[guidance.find('}')+1:]
+            try:
+                # Now try to parse the JSON metadata
+                json_str = guidance[guidance.find('{'):guidance.find('}')+1]
+                conversation = guidance[guidance.find('}')+1:]
             
-            # Parse the JSON metadata
-            metadata = json.loads(json_str)
+                # Parse the JSON metadata
+                metadata = json.loads(json_str)
             
-            # Clean up the conversation text - only trim start and end
-            guidance = conversation.strip()
-
-            # Store metadata values with new fields
-            confidence_level = metadata.get('confidence_level', 0)
-            product_category = metadata.get('product_category')
-            focus_area = metadata.get('query_focus_area')
-            detected_language = metadata.get('detected_language')
-            key_takeaways = metadata.get('key_takeaways', [])
+                # Clean up the conversation text - only trim start and end
+                guidance = conversation.strip()
+
+                # Store metadata values with new fields
+                confidence_level = metadata.get('confidence_level', 0)
+                product_category = metadata.get('product_category')
+                focus_area = metadata.get('query_focus_area')
+                detected_language = metadata.get('detected_language')
+                key_takeaways = metadata.get('key_takeaways', [])
                 
-            # Process actions field
-            actions = metadata.get('actions', None)
-            if actions == "":
-                actions = None
+                # Process actions field
+                actions = metadata.get('actions', None)
+                if actions == "":
+                    actions = None
                 
-            if actions == "send_email":
-                try:
-                    # Generate final approved email draft
-                    email_package = email_service.generate_email_content(chat_session, citations)
+                if actions == "send_email":
+                    try:
+                        # Don't draft emails for a rep who has already left
+                        cancel_token.raise_if_cancelled("email")
+
+                        # Generate final approved email draft
+                        email_package = email_service.generate_email_content(
+                            new_chat_history, sales_context, citations, timeout=deadline.timeout()
+                        )
                     
-                    # Get access token from headers
-                    access_token = request.headers.get('X-MS-TOKEN-AAD-ACCESS-TOKEN')
+                        # Get access token from headers
+                        access_token = request.headers.get('X-MS-TOKEN-AAD-ACCESS-TOKEN')
                     
-                    # Use synchronous version instead of async
-                    draft_result = email_service.create_email_draft_sync(email_package, user_email, access_token)
+                        # Use synchronous version instead of async
+                        draft_result = email_service.create_email_draft_sync(email_package, user_email, access_token)
                     
-                    if draft_result["success"]:
-                        guidance += "\n\nEmail Draft Created:\n"
-                        guidance += f"\nSubject: {email_package['subject']}"
-                        guidance += f"\n\n{email_package['body']}"
-                        if email_package['attachments']:
-                            guidance += "\n\nAttachments:"
-                            for att in email_package['attachments']:
-                                guidance += f"\n- {att['title']}"
+                        if draft_result["success"]:
+                            guidance += "\n\nEmail Draft Created:\n"
+                            guidance += f"\nSubject: {email_package['subject']}"
+                            guidance += f"\n\n{email_package['body']}"
+                            if email_package['attachments']:
+                                guidance += "\n\nAttachments:"
+                                for att in email_package['attachments']:
+                                    guidance += f"\n- {att['title']}"
                         
-                        guidance += "\n\nThe email draft has been automatically created in your Outlook drafts folder."
-                        guidance += "\nYou can review and send it from your email client."
-                    else:
-                        guidance += "\n\nI created the email draft but couldn't save it to your drafts folder."
-                        guidance += "\nYou can copy the content above and create the email manually."
-                        logger.error(f"\nError: " + draft_result.get("error", "Unknown error") ) 
+                            guidance += "\n\nThe email draft has been automatically created in your Outlook drafts folder."
+                            guidance += "\nYou can review and send it from your email client."
+                        else:
+                            guidance += "\n\nI created the email draft but couldn't save it to your drafts folder."
+                            guidance += "\nYou can copy the content above and create the email manually."
+                            logger.error(f"\nError: " + draft_result.get("error", "Unknown error") ) 
                 
-                except Exception as e:
-                    logger.error(f"Failed to process email action: {e}")
-                    logger.error(f"Traceback: {traceback.format_exc()}")
-                    guidance += "\n\nI encountered an error while creating the email draft. Please try again."
-                    actions = None
-
-        except (ValueError, json.JSONDecodeError) as e:
-            logger.debug(f"No valid JSON metadata found in response: {e}")
-            # If JSON parsing fails, use the entire cleaned guidance as the response
-            confidence_level = 0
-            product_category = ""
-            focus_area = ""
-            detected_language = ""
-            key_takeaways = []
-            actions = None # Set actions to None if JSON parsing fails
+                    except RequestCancelled:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Failed to process email action: {e}")
+                        logger.error(f"Traceback: {traceback.format_exc()}")
+                        guidance += "\n\nI encountered an error while creating the email draft. Please try again."
+                        actions = None
+
+            except (ValueError, json.JSONDecodeError) as e:
+                logger.debug(f"No valid JSON metadata found in response: {e}")
+                # If JSON parsing fails, use the entire cleaned guidance as the response
+                confidence_level = 0
+                product_category = ""
+                focus_area = ""
+                detected_language = ""
+                key_takeaways = []
+                actions = None # Set actions to None if JSON parsing fails
+
+            # Only grounded, action-free answers are shared with other reps
+            if cache_key and actions is None and guidance and citations and confidence_level:
+                answer_cache.set(cache_key, {
+                    'response': guidance,
+                    'citations': deepcopy(citations),
+                    'confidence_level': confidence_level,
+                    'product_category': product_category,
+                    'focus_area': focus_area,
+                    'detected_language': detected_language,
+                    'key_takeaways': list(key_takeaways)
+                })
 
         # Update session metadata
         chat_session.confidence_level = confidence_level
@@ -1322,19 +2217,35 @@ def handle_message():
                 "actions": actions  # Include the actions in metadata
             }
         })
-        new_messages.append({"role": "assistant", "content": guidance})
-        chat_session.chat_history = new_chat_history
-        chat_session.messages = new_messages
-
-        # After processing citations
-        chat_session.citations = citations if actions is None else []  # More explicit check for None
+        turn_in_context = response_source != "degraded"
         
         # Add token monitoring
-        logger.debug("Token Usage Analysis:")
-        logger.debug(f"  Prompt tokens used: {response.usage.prompt_tokens}/{MAX_TOKENS['PROMPT']}")
-        logger.debug(f"  Completion tokens used: {response.usage.completion_tokens}/{MAX_TOKENS['COMPLETION']}")
-        logger.debug(f"  Total tokens used: {response.usage.total_tokens}/{MAX_TOKENS['TOTAL']}")
-        logger.debug(f"  Prompt tokens percentage: {(response.usage.prompt_tokens/MAX_TOKENS['PROMPT'])*100:.1f}%")
+        if response is not None:
+            logger.debug("Token Usage Analysis:")
+            logger.debug(f"  Prompt tokens used: {response.usage.prompt_tokens}/{MAX_TOKENS['PROMPT']}")
+            logger.debug(f"  Completion tokens used: {response.usage.completion_tokens}/{llm_route.max_tokens}")
+            logger.debug(f"  Total tokens used: {response.usage.total_tokens}/{MAX_TOKENS['TOTAL']}")
+            logger.debug(f"  Prompt tokens percentage: {(response.usage.prompt_tokens/MAX_TOKENS['PROMPT'])*100:.1f}%")
+
+    except RequestCancelled as e:
+        if e.reason != "deadline":
+            raise
+        logger.warning(f"Message deadline of {deadline.seconds}s exceeded during {e.stage}")
+        guidance = "Sorry, this request took too long to complete. Please try again."
+        new_chat_history.append({
+            "role": "assistant",
+            "content": guidance,
+            "citations": []
+        })
+
+    except (AdmissionRejected, RateLimitError, DeploymentUnavailable) as e:
+        logger.warning(f"Completion not admitted: {e}")
+        guidance = "The assistant is handling a lot of requests right now. Please try again in a moment."
+        new_chat_history.append({
+            "role": "assistant",
+            "content": guidance,
+            "citations": []
+        })
 
     except Exception as e:
         logger.error(f"Error processing response: {e}")
@@ -1344,16 +2255,42 @@ def handle_message():
             "content": guidance,
             "citations": []  # No citations when there's an error
         })
-        chat_session.chat_history = new_chat_history
 
     # Store sales metadata before committing
-    sales_metadata = chat_session.sales_metadata
-
-    # After modifications, save to database:
-    safe_commit()
-    
-    # Refresh the session to ensure we have the latest data
-    db.session.refresh(chat_session)
+    sales_metadata = sales_context
+
+    # Nothing to persist if the rep abandoned the chat while we were working
+    if cancel_token.abandoned:
+        raise RequestCancelled("client", "commit")
+
+    # Append the turn: the user entry and the reply as two new rows
+    turn_messages = [
+        ChatMessage.from_history_entry(chat_session.id, new_chat_history[-2], turn_in_context, payload=user_payload),
+        ChatMessage.from_history_entry(chat_session.id, new_chat_history[-1], turn_in_context)
+    ]
+    if chat_writer.submit(chat_session.id, chat_turn_write(chat_session, turn_messages, g.get('turn_claim'))):
+        # Committed after the response by the write-behind thread, which also releases the claim
+        g.pop('turn_claim', None)
+        db.session.rollback()
+    else:
+        db.session.add_all(turn_messages)
+        if inspect(chat_session).persistent:
+            chat_session.message_count = ChatSession.message_count + 2  # In SQL, so concurrent turns don't lose counts
+        else:
+            chat_session.message_count = 2  # First turn of a draft chat
+        if read_version is None:
+            chat_session.version = 1  # A draft's row is created by this commit
+        else:
+            # Compare-and-swap on the version read at the start of the turn
+            chat_sessions = ChatSession.__table__
+            result = db.session.execute(chat_sessions.update().where(
+                chat_sessions.c.id == chat_session.id, chat_sessions.c.version == read_version
+            ).values(version=read_version + 1))
+            if result.rowcount != 1:
+                raise TurnConflict(chat_session.id)
+
+        # After modifications, save to database:
+        safe_commit()
 
     # Return JSON response with citations
     return jsonify({
@@ -1363,144 +2300,255 @@ def handle_message():
             'product_category': product_category,
             'focus_area': focus_area,
             'detected_language': detected_language,
+            'response_source': response_source,
+            'route': route.name,
+            'degradation_level': degradation_level,
             'metadata': sales_metadata  # Include sales metadata in the response
         },
         'citations': citations if actions is None else []  # More explicit check for None
     })
 
 
-chat_creation_lock = Lock()
+def cleanup_old_empty_chats(batch_size: int = Config.EMPTY_CHAT_CLEANUP_BATCH_SIZE) -> int:
+    """
+    Remove empty chats that are older than the timeout period, in short batches. Runs on the janitor thread.
+    New chats are drafts with no row until their first message, so only rows left by earlier versions match.
+    """
+    deleted = 0
+    with app.app_context():
+        try:
+            cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=EMPTY_CHAT_TIMEOUT)
+            while True:
+                # Range scan on (message_count, created_at); each batch is its own short write transaction
+                batch = [chat_id for (chat_id,) in db.session.query(ChatSession.id).filter(
+                    ChatSession.message_count == 0,
+                    ChatSession.created_at < cutoff_time
+                ).limit(batch_size).all()]
+                if not batch:
+                    break
+                # Re-check emptiness in the DELETE in case a first message landed since the SELECT
+                result = db.session.execute(
+                    ChatSession.__table__.delete().where(
+                        ChatSession.id.in_(batch),
+                        ChatSession.message_count == 0
+                    )
+                )
+                safe_commit()
+                deleted += result.rowcount
+                if len(batch) < batch_size:
+                    break
+        except Exception as e:
+            logger.error(f"Failed to cleanup old empty chats: {str(e)}")
+            db.session.rollback()
+            raise
+    return deleted
+
+empty_chat_janitor = Janitor('empty_chats', shard_router.for_each_shard(cleanup_old_empty_chats),
+                             Config.EMPTY_CHAT_CLEANUP_INTERVAL_SECONDS)
+empty_chat_janitor.start()
+
+def cleanup_orphaned_sales_snapshots(batch_size: int = 100) -> int:
+    """Remove snapshots no session refers to. Only ones unused for a day, so a snapshot stored or reused for a turn still being committed is kept."""
+    deleted = 0
+    with app.app_context():
+        try:
+            cutoff_time = datetime.datetime.utcnow() - SALES_SNAPSHOT_RETENTION
+            referenced = db.session.query(ChatSession.sales_snapshot_id).filter(
+                ChatSession.sales_snapshot_id == SalesSnapshot.id
+            ).exists()
+            while True:
+                batch = [snapshot_id for (snapshot_id,) in db.session.query(SalesSnapshot.id).filter(
+                    SalesSnapshot.last_used_at < cutoff_time, ~referenced
+                ).limit(batch_size).all()]
+                if not batch:
+                    break
+                # Rechecked in the delete: a worker may have reused one of them since
+                result = db.session.execute(SalesSnapshot.__table__.delete().where(
+                    SalesSnapshot.id.in_(batch), SalesSnapshot.last_used_at < cutoff_time, ~referenced
+                ))
+                safe_commit()
+                deleted += result.rowcount
+                if len(batch) < batch_size:
+                    break
+        except Exception as e:
+            logger.error(f"Failed to cleanup orphaned sales snapshots: {str(e)}")
+            db.session.rollback()
+            raise
+    return deleted
+
+sales_snapshot_janitor = Janitor('sales_snapshots', shard_router.for_each_shard(cleanup_orphaned_sales_snapshots),
+                                 Config.SALES_SNAPSHOT_CLEANUP_INTERVAL_SECONDS)
+sales_snapshot_janitor.start()
+
+def archived_value(column: str, value):
+    """A column value as stored in an archive record (JSON), or back from one."""
+    if column in ARCHIVED_DATETIME_COLUMNS:
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        return datetime.datetime.fromisoformat(value) if value else None
+    return value
+
+def archive_record(chat_session) -> dict:
+    """The archived_session row for a hot session, with its messages and sales metadata."""
+    messages = ChatMessage.query.options(undefer_group('model_payload')).filter_by(
+        session_id=chat_session.id
+    ).order_by(ChatMessage.id).all()
+    return {
+        'id': chat_session.id,
+        'user_id': chat_session.user_id,
+        'focus_area': chat_session.focus_area,
+        'created_at': chat_session.created_at,
+        'last_activity': chat_session.last_activity,
+        'message_count': len(messages),
+        'archived_at': datetime.datetime.utcnow(),
+        'data': {
+            'session': {column: archived_value(column, getattr(chat_session, column))
+                        for column in ARCHIVED_SESSION_COLUMNS},
+            'sales_metadata': session_sales_metadata(chat_session),
+            'messages': [{column: archived_value(column, getattr(message, column))
+                          for column in ARCHIVED_MESSAGE_COLUMNS} for message in messages]
+        }
+    }
 
-def cleanup_old_empty_chats():
-    """Remove empty chats that are older than the timeout period"""
-    try:
-        current_time = datetime.datetime.utcnow()
-        cutoff_time = (current_time - datetime.timedelta(seconds=EMPTY_CHAT_TIMEOUT)).isoformat()
-        
-        # Find all empty chats older than the cutoff
-        old_empty_chats = ChatSession.query.filter(
-            ChatSession.chat_history == [],  # Empty chat history
-            ChatSession.created_at < cutoff_time  # Older than timeout
-        ).all()
-        
-        # Delete the old empty chats
-        for chat in old_empty_chats:
-            db.session.delete(chat)
-        
-        safe_commit()
-        logger.info(f"Cleaned up {len(old_empty_chats)} old empty chats")
-        
-    except Exception as e:
-        logger.error(f"Failed to cleanup old empty chats: {str(e)}")
-        db.session.rollback()
+def archive_inactive_sessions(batch_size: int = Config.SESSION_ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Move sessions idle for SESSION_ARCHIVE_AFTER_DAYS to the archive database. Runs on the janitor thread.
+
+    A batch is committed to the archive before it's deleted here, so a failure
+    in between leaves a session in both databases rather than neither; the hot
+    copy is the one used, and the next run replaces the archived one. Sessions
+    that became active again since they were read are kept hot.
+    """
+    archived = 0
+    archived_sessions = ArchivedSession.__table__
+    with app.app_context():
+        try:
+            cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(days=Config.SESSION_ARCHIVE_AFTER_DAYS)
+            while True:
+                batch = ChatSession.query.filter(
+                    ChatSession.last_activity < cutoff_time,
+                    ChatSession.message_count > 0  # Empty chats are left to the empty-chat janitor
+                ).order_by(ChatSession.last_activity).limit(batch_size).all()
+                if not batch:
+                    break
+                records = [archive_record(chat_session) for chat_session in batch]
+                ids = [record['id'] for record in records]
+
+                insert = sqlite_insert(archived_sessions)
+                with db.engines['archive'].begin() as conn:
+                    conn.execute(insert.on_conflict_do_update(index_elements=['id'], set_={
+                        column.name: insert.excluded[column.name]
+                        for column in archived_sessions.columns if column.name != 'id'
+                    }), records)
+
+                # Messages first, then sessions, both re-checking idleness in the same write transaction
+                still_idle = select(ChatSession.id).where(ChatSession.id.in_(ids),
+                                                          ChatSession.last_activity < cutoff_time)
+                db.session.execute(ChatMessage.__table__.delete().where(ChatMessage.session_id.in_(still_idle)))
+                result = db.session.execute(ChatSession.__table__.delete().where(ChatSession.id.in_(still_idle)))
+                safe_commit()
+                archived += result.rowcount
+
+                kept = [chat_id for (chat_id,) in db.session.query(ChatSession.id).filter(ChatSession.id.in_(ids))]
+                if kept:
+                    with db.engines['archive'].begin() as conn:
+                        conn.execute(archived_sessions.delete().where(archived_sessions.c.id.in_(kept)))
+                db.session.expunge_all()
+                if len(batch) < batch_size:
+                    break
+        except Exception as e:
+            logger.error(f"Failed to archive inactive sessions: {str(e)}")
+            db.session.rollback()
+            raise
+    return archived
+
+def restore_archived_session(session_id: str, user_id: str) -> bool:
+    """Move an archived session back into the hot database; False if it isn't archived or isn't user_id's."""
+    archived_sessions = ArchivedSession.__table__
+    with db.engines['archive'].connect() as conn:
+        data = conn.execute(select(archived_sessions.c.data).where(archived_sessions.c.id == session_id)).scalar()
+    if data is None:
+        return False
+    if data['session'].get('user_id') != user_id:
+        logger.warning(f"Refused to restore archived session {session_id} for a user who doesn't own it")
+        return False
+
+    metadata = data.get('sales_metadata')
+    row = {column: archived_value(column, value) for column, value in data['session'].items()}
+    messages = [{**{column: archived_value(column, value) for column, value in message.items()},
+                 'session_id': session_id} for message in data['messages']]
+    # Into the owner's shard, whichever user's request opened it
+    with shard_router.use(shard_router.shard_for(row.get('user_id'))):
+        row.update(id=session_id, message_count=len(data['messages']),
+                   sales_snapshot_id=store_sales_snapshot(metadata) if metadata else None)
+        with shard_engine().begin() as conn:
+            # Another worker may have restored it already; its copy stands
+            result = conn.execute(sqlite_insert(ChatSession.__table__).values(**row)
+                                  .on_conflict_do_nothing(index_elements=['id']))
+            if result.rowcount and messages:
+                conn.execute(ChatMessage.__table__.insert(), messages)
+    with db.engines['archive'].begin() as conn:
+        conn.execute(archived_sessions.delete().where(archived_sessions.c.id == session_id))
+    logger.info(f"Restored archived session {session_id} ({len(messages)} messages)")
+    return True
+
+session_archive_janitor = Janitor(
+    'session_archive', shard_router.for_each_shard(archive_inactive_sessions),
+    Config.SESSION_ARCHIVE_INTERVAL_SECONDS if Config.SESSION_ARCHIVE_AFTER_DAYS > 0 else 0
+)
+session_archive_janitor.start()
 
 @app.route('/new_chat', methods=['POST'])
 def new_chat():
-    with chat_creation_lock:
-        if session.get('creating_chat'):
-            return jsonify({"success": False, "error": "Chat creation in progress"})
-        session['creating_chat'] = True
-        try:
-            # Clean up old empty chats first
-            cleanup_old_empty_chats()
-            
-            # Get and validate user ID first
-            user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
-            user_email = request.headers.get('X-MS-CLIENT-PRINCIPAL-NAME')
-            
-            # Add local development bypass using environment variables
-            if Config.IS_LOCAL_DEV:
-                user_id = user_id or Config.get_env('DEBUG_USER_ID', 'local-dev-user')
-                user_email = user_email or Config.get_env('DEBUG_USER_EMAIL', 'local-dev@example.com')
-            
-            if not user_id:
-                return jsonify({"success": False, "error": "Authentication required"}), 401
-
-            # Check if user has any empty chats that are recent
-            current_time = datetime.datetime.utcnow()
-            user_chats = ChatSession.query.filter_by(user_id=user_id).all()
-            for chat in user_chats:
-                if len(chat.chat_history) == 0:
-                    # Check if chat is within the empty chat timeout period
-                    chat_created = datetime.datetime.fromisoformat(chat.created_at)
-                    if (current_time - chat_created).total_seconds() < EMPTY_CHAT_TIMEOUT:
-                        return jsonify({
-                            "success": False,
-                            "error": "You already have an empty chat. Please use your existing empty chat before creating a new one."
-                        })
-
-            # Initialize metadata with defaults
-            metadata = {
-                'Email': user_email if user_email else "Not Available",
-                'Phone': "Not Available",
-                'total_orders': 0,
-                'blocked_orders': 0,
-                'total_order_quantity': 0,
-                'total_open_quantity': 0,
-                'execution_status': [],
-                'stock_availability': {
-                    'claimed': 0,
-                    'not_claimed': 0
-                },
-                'sales_documents': {
-                    'types': [],
-                    'total_value_usd': 0.0,
-                    'total_value_dc': 0.0
-                },
-                'delivery_metrics': {
-                    'on_time': 0,
-                    'delayed': 0,
-                    'reliability_scores': []
-                },
-                'territories': {
-                    'companies': [],
-                    'sales_orgs': [],
-                    'plants': [],
-                    'divisions': []
-                },
-                'customer_data': {
-                    'sold_to_parties': [],
-                    'ship_to_parties': [],
-                    'countries': [],
-                    'regions': []
-                },
-                'orders': []
-            }
-            
-            # Try to find sales rep data if we have an email
-            if user_email:
-                try:
-                    sales_rep = get_cached_sales_rep_data(user_email)
-                    if sales_rep:
-                        # Since sales_rep already has the correct structure from orchestrator,
-                        # we can directly update the metadata with it
-                        metadata.update(sales_rep)
-                except Exception as e:
-                    logger.error(f"Error retrieving cached sales rep data: {e}")
-                    # Continue with default metadata
-            
-            session['session_id'] = str(uuid4())
-            chat_session = initialize_chat_session(session['session_id'], user_id, metadata)
-            db.session.add(chat_session)
-            safe_commit()
-            
-            return jsonify({"success": True})
+    """
+    Start a new draft chat. Nothing is written here, so no lock is needed: the
+    draft's row is created by its first message, under that turn's claim on
+    the session (claim_turn), which holds across workers.
+    """
+    try:
+        # Get and validate user ID first
+        user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
+        user_email = request.headers.get('X-MS-CLIENT-PRINCIPAL-NAME')
         
-        except Exception as e:
-            logger.error(f"Error creating new chat: {str(e)}")
-            return jsonify({"success": False, "error": str(e)})
+        # Add local development bypass using environment variables
+        if Config.IS_LOCAL_DEV:
+            user_id = user_id or Config.get_env('DEBUG_USER_ID', 'local-dev-user')
+            user_email = user_email or Config.get_env('DEBUG_USER_EMAIL', 'local-dev@example.com')
         
-        finally:
-            session.pop('creating_chat', None)  # Always clean up the lock
+        if not user_id:
+            return jsonify({"success": False, "error": "Authentication required"}), 401
+
+        # The chat in the cookie is still an unsaved draft (no row until its first
+        # message): keep it rather than starting another empty chat
+        session_id = session.get('session_id')
+        if session_id:
+            chat_writer.wait_for(session_id)
+            if get_chat_session(session_id, user_id, SESSION_OWNER_COLUMNS) is None:
+                return jsonify({"success": True})
+
+        # Start a draft; its row is created with the first message
+        session['session_id'] = str(uuid4())
+        
+        return jsonify({"success": True})
+    
+    except Exception as e:
+        logger.error(f"Error creating new chat: {str(e)}")
+        return jsonify({"success": False, "error": str(e)})
 
 @app.route('/switch_chat', methods=['POST'])
 def switch_chat():
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
+    if Config.IS_LOCAL_DEV:
+        user_id = user_id or Config.get_env('DEBUG_USER_ID', 'local-dev-user')
+    if not user_id:
+        return jsonify({"success": False, "error": "Authentication required"}), 401
+
     data = request.get_json()
     new_session_id = data.get('session_id')
     
-    # Verify session exists
-    chat_session = db.session.get(ChatSession, new_session_id)
-    if chat_session:
+    # Verify session exists and belongs to the caller
+    chat_session = get_chat_session(new_session_id, user_id, SESSION_OWNER_COLUMNS)
+    if chat_session and chat_session.user_id == user_id:
         # Update session ID
         session['session_id'] = new_session_id
         
@@ -1546,7 +2594,7 @@ def switch_chat():
         }
         
         # If chat session has metadata, use it, otherwise use defaults
-        session_metadata = chat_session.sales_metadata
+        session_metadata = session_sales_metadata(chat_session)
         if session_metadata and has_sales_rep_data(session_metadata):
             metadata = session_metadata
         
@@ -1574,14 +2622,8 @@ def serve_document(filename):
             logger.error(f"Invalid filename format: {decoded_filename}")
             return "Invalid filename", 400
             
-        # Initialize the Blob Service Client using DefaultAzureCredential
-        account_url = f"https://{Config.AZURE_STORAGE_ACCOUNT}.blob.core.windows.net"
-        credential = DefaultAzureCredential()
-        blob_service_client = BlobServiceClient(account_url, credential=credential)
-        
-        # Get the container client
-        container_name = Config.AZURE_STORAGE_CONTAINER_NAME
-        container_client = blob_service_client.get_container_client(container_name)
+        # Get the shared container client
+        container_client = azure_clients.container(Config.AZURE_STORAGE_ACCOUNT, Config.AZURE_STORAGE_CONTAINER_NAME)
         
         # List all blobs (for debugging)
         try:
@@ -1662,6 +2704,11 @@ def get_base_system_prompt():
 
     return validate_system_prompt(SYSTEM_PROMPT)
 
+def get_answer_cache_prompt_variant(route: Route, system_prompt: str):
+    """Identify the prompt/deployment/route combination an answer was generated with."""
+    prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()[:16]
+    return f"{openai_pool.model_signature()}:{Config.AZURE_OPENAI_SEARCH_INDEX}:{route.name}:{route.top_n}:{prompt_hash}"
+
 def validate_system_prompt(prompt):
     """Validate system prompt structure and content."""
     if not prompt or not isinstance(prompt, str):
@@ -1670,60 +2717,24 @@ def validate_system_prompt(prompt):
         logger.warning("System prompt missing sales context placeholder. There will be no sales context in the response.")
     return prompt.strip()
 
-def get_truncated_messages(messages, limit=MESSAGE_HISTORY_LIMIT):
-    """Standardized message history truncation that preserves system prompt."""
-    if not messages or not isinstance(messages, list):
-        logger.warning("Empty or invalid messages list, returning empty list")
-        return []
-        
-    try:
-        # Always keep system message if it exists
-        if len(messages) > 0 and messages[0].get('role') == 'system':
-            system_message = messages[0]
-            user_messages = messages[1:]
-        else:
-            logger.warning("No system message found at start of messages")
-            system_message = {"role": "system", "content": get_base_system_prompt()}
-            user_messages = messages
-            
-        # Validate message structure
-        for msg in user_messages:
-            if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg:
-                logger.warning(f"Invalid message structure found: {msg}")
-                continue
-                
-        # Truncate user messages
-        truncated_messages = user_messages[-limit:] if len(user_messages) > limit else user_messages
-        
-        # Return combined messages
-        return [system_message] + truncated_messages
-    except Exception as e:
-        logger.error(f"Error in message truncation: {str(e)}")
-        # Return at least a system message in case of error
-        return [{"role": "system", "content": get_base_system_prompt()}]
-
 def initialize_chat_session(session_id, user_id, metadata):
     """Standardized chat session initialization."""
-    system_prompt = get_system_prompt_with_sales_context(get_base_system_prompt(), metadata)
     return ChatSession(
         id=session_id,
-        messages=[{"role": "system", "content": system_prompt}],
-        chat_history=[],
         detected_language="",
         focus_area="New Conversation",
-        created_at=datetime.datetime.utcnow().isoformat(),
-        last_activity=datetime.datetime.utcnow().isoformat(),
+        created_at=datetime.datetime.utcnow(),
+        last_activity=datetime.datetime.utcnow(),
         user_id=user_id,
         sales_metadata=metadata,
         product_category="",  # Add missing field
-        confidence_level=0,   # Add missing field
-        citations=[]          # Add missing field
+        confidence_level=0    # Add missing field
     )
 
 
 def log_feedback_to_blob(user_id, user_email, feedback_type, feedback_content, session_id, metadata=None):
     """
-    Log user feedback to Azure Blob Storage in JSONL format.
+    Queue user feedback for Azure Blob Storage in JSONL format.
     
     Args:
         user_id: The ID of the user
@@ -1732,10 +2743,12 @@ def log_feedback_to_blob(user_id, user_email, feedback_type, feedback_content, s
         feedback_content: The feedback message
         session_id: The chat session ID
         metadata: Additional metadata to include (optional)
+
+    Returns:
+        False if the record couldn't be queued or spooled
     """
     try:
         now = datetime.datetime.utcnow()
-        blob_name = f"feedback/{now.year}/{now.month:02d}/{now.day:02d}/feedback_log_{int(now.timestamp())}.jsonl"
 
         # Feedback data as JSON
         feedback_data = {
@@ -1748,29 +2761,7 @@ def log_feedback_to_blob(user_id, user_email, feedback_type, feedback_content, s
             "content": feedback_content,
             "metadata": metadata or {}
         }
-
-        # Convert to JSON line
-        feedback_jsonl = json.dumps(feedback_data) + "\n"
-
-        # Initialize the Blob Service Client using DefaultAzureCredential
-        account_url = f"https://{Config.AZURE_STORAGE_ACCOUNT}.blob.core.windows.net"
-        credential = DefaultAzureCredential()
-        blob_service_client = BlobServiceClient(account_url, credential=credential)
-
-        # Get the container client for feedback
-        container_client = blob_service_client.get_container_client(Config.AZURE_STORAGE_CONTAINER_FEEDBACK_NAME)
-
-        # Upload to Blob Storage (Append or Create)
-        blob_client = container_client.get_blob_client(blob_name)
-        try:
-            # Try to append to existing blob
-            blob_client.append_block(feedback_jsonl)
-        except ResourceNotFoundError:
-            # If blob doesn't exist, create it
-            blob_client.upload_blob(feedback_jsonl, blob_type="AppendBlob")
-
-        logger.info(f"Feedback logged to blob: {blob_name}")
-        return True
+        return telemetry.log(hourly_partition('feedback', now), feedback_data)
 
     except Exception as e:
         logger.error(f"Failed to log feedback to blob: {str(e)}")
@@ -1886,12 +2877,12 @@ def handle_feedback():
             }), 400
 
         # Get current chat session for metadata
-        chat_session = db.session.get(ChatSession, session_id)
+        chat_session = get_chat_session(session_id, user_id, SESSION_SUMMARY_COLUMNS)
         metadata = {
             "product_category": chat_session.product_category if chat_session else "",
             "focus_area": chat_session.focus_area if chat_session else "",
             "detected_language": chat_session.detected_language if chat_session else "",
-            "sales_metadata": chat_session.sales_metadata if chat_session else {}
+            "sales_metadata": (session_sales_metadata(chat_session) or {}) if chat_session else {}
         }
 
         # Log the feedback with sanitized data
@@ -1982,9 +2973,12 @@ def get_allowed_indexes(user_groups: list) -> set:
     logger.debug(f"Allowed indexes for user: {allowed_indexes}")
     return allowed_indexes
 
-def orchestrate_federated_search(query: str, user_groups: list, email: str) -> list:
+def orchestrate_federated_search(query: str, user_groups: list, email: str, deadline: Optional[Deadline] = None) -> list:
     """
     Perform federated search across all indexes the user has access to and process sales data.
+
+    When a deadline is given, each attempt's timeout is capped by the remaining
+    budget and no further indexes or retries are started once it has passed.
     """
     allowed_indexes = get_allowed_indexes(user_groups)
     
@@ -2029,6 +3023,9 @@ def orchestrate_federated_search(query: str, user_groups: list, email: str) -> l
     }
     
     for index_name in allowed_indexes:
+        if deadline is not None and deadline.expired():
+            logger.warning(f"Federated search deadline reached, skipping index '{index_name}'")
+            continue
         try:
             # Specify only the fields we want to return
             search_query = {
@@ -2049,17 +3046,19 @@ def orchestrate_federated_search(query: str, user_groups: list, email: str) -> l
 
             for attempt in range(3):
                 try:
-                    response = requests.get(
+                    response = search_http.get(
                         url,
                         headers=headers,
                         params=search_query,
-                        timeout=30  # Add timeout
+                        timeout=deadline.timeout(cap=30) if deadline else 30
                     )
                     response.raise_for_status()
                     break
                 except requests.exceptions.RequestException as e:
                     if attempt == 2:  # Last attempt
                         raise
+                    if deadline is not None and deadline.remaining() <= 2 ** attempt:
+                        raise  # No budget left for another attempt
                     time.sleep(2 ** attempt)  # Exponential backoff
             
             
@@ -2262,6 +3261,26 @@ def orchestrate_federated_search(query: str, user_groups: list, email: str) -> l
 def regex_match(value, pattern):
     return bool(re.search(pattern, str(value)))
 
+@app.route('/conversations')
+def conversations():
+    """A page of the user's conversations for the sidebar; pass the returned next_cursor to get the next one."""
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
+    if Config.IS_LOCAL_DEV:
+        user_id = user_id or Config.get_env('DEBUG_USER_ID', 'local-dev-user')
+
+    if not user_id:
+        return jsonify({"error": "Authentication required"}), 401
+
+    limit = request.args.get('limit', CONVERSATION_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, 100))
+    try:
+        page, next_cursor = list_conversations(user_id, session.get('session_id'), limit, request.args.get('cursor'))
+    except ValueError as e:
+        logger.warning(f"Rejected conversations request: {e}")
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    return jsonify({"conversations": page, "next_cursor": next_cursor})
+
 @app.route('/get_chat_history/<session_id>')
 def get_chat_history(session_id):
     try:
@@ -2274,13 +3293,13 @@ def get_chat_history(session_id):
             return jsonify({"error": "Authentication required"}), 401
             
         # Get chat session and verify ownership
-        chat_session = db.session.get(ChatSession, session_id)
+        chat_session = get_chat_session(session_id, user_id, SESSION_SUMMARY_COLUMNS)
         if not chat_session or chat_session.user_id != user_id:
             return jsonify({"error": "Session not found"}), 404
             
         # Return formatted chat history
         return jsonify({
-            "messages": chat_session.chat_history,
+            "messages": get_chat_history_entries(chat_session.id),
             "metadata": {
                 "confidence_level": chat_session.confidence_level,
                 "product_category": chat_session.product_category,
@@ -2293,6 +3312,41 @@ def get_chat_history(session_id):
         logger.error(f"Error retrieving chat history: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/metrics')
+def get_metrics():
+    """Expose in-process performance counters for this worker."""
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
+    if Config.IS_LOCAL_DEV:
+        user_id = user_id or Config.get_env('DEBUG_USER_ID', 'local-dev-user')
+
+    if not user_id:
+        return jsonify({"error": "Authentication required"}), 401
+
+    return jsonify({
+        "pid": os.getpid(),
+        "answer_cache": {
+            **answer_cache.stats(),
+            "index_version": answer_cache_index.version
+        },
+        "requests": inflight_requests.stats(),
+        "completion_scheduler": completion_scheduler.stats(),
+        "deployments": openai_pool.stats(),
+        "query_router": query_router.stats(),
+        "fast_path": fast_path.stats(),
+        "degradation": degradation.stats(),
+        "empty_chat_janitor": empty_chat_janitor.stats(),
+        "sales_snapshot_janitor": sales_snapshot_janitor.stats(),
+        "session_archive_janitor": session_archive_janitor.stats(),
+        "telemetry": {**telemetry.stats(), "blobs": telemetry_blobs.stats()},
+        "azure": azure_clients.stats(),
+        "storage": {
+            "sqlite": sqlite_profile.stats(),
+            "shards": shard_router.stats(),
+            "write_behind": chat_writer.stats(),
+            "json_codec": json_codec.stats()
+        }
+    })
+
 # And at the bottom:
 if __name__ == '__main__':
     debug_mode = Config.get_env('FLASK_DEBUG', default=False, var_type=bool)
@@ -1,3 +1,19 @@
+import os
+
+# Gunicorn process layout. gunicorn.conf.py starts this many workers, and app.py
+# splits the Azure OpenAI TPM budget across the same count, so both read it here.
+DEFAULT_GUNICORN_WORKERS = 2
+DEFAULT_GUNICORN_THREADS = 64
+
+
+def gunicorn_workers() -> int:
+    return int(os.environ.get('GUNICORN_WORKERS', DEFAULT_GUNICORN_WORKERS))
+
+
+def gunicorn_threads() -> int:
+    return int(os.environ.get('GUNICORN_THREADS', DEFAULT_GUNICORN_THREADS))
+
+
 FOOD_SYSTEM_PROMPT = '''1. RESPONSE STRUCTURE
     You must always respond in **two parts**. No markdown, no code fences — only plain text and HTML.
 
@@ -64,7 +80,7 @@ END PRIORITIZED DATA CONTEXT
         "Need status update and escalation contact"  
     ],  
     "requires_followup": true,  
-    "detected_language": "English",  
+    "detected_language": "EN",  
     "actions": ""  
     }
 
@@ -171,8 +187,8 @@ PART 2 - RESPONSE (Plain Text)
 
 6. EXAMPLES RESPONSE STRUCTURE (Plain Text Only)
 
-Example (Structure Only): { "confidence_level": 7, "product_category": "Instapak", "query_focus_area": "Environmental benefits for electronics packaging", "key_takeaways": [ "Customer concerned about foam sustainability", "Shipping sensitive electronics internationally", "Current solution creates excess waste" ], "requires_followup": true, "detected_language": "English", "actions": "" } I understand you're looking into sustainable packaging solutions for electronics. Let me ask a few clarifying questions...
-Example (Structure Only): { "confidence_level": 9, "product_category": "Instapak", "query_focus_area": "Draft Email - Environmental benefits for electronics packaging", "key_takeaways": ["Customer concerned about foam sustainability", "Shipping sensitive electronics internationally", "Current solution creates excess waste"], "requires_followup": true, "detected_language": "English", "actions": "" } I have prepared an email draft for your review. Please let me know if you'd like to proceed and I can place it in your drafts.
+Example (Structure Only): { "confidence_level": 7, "product_category": "Instapak", "query_focus_area": "Environmental benefits for electronics packaging", "key_takeaways": [ "Customer concerned about foam sustainability", "Shipping sensitive electronics internationally", "Current solution creates excess waste" ], "requires_followup": true, "detected_language": "EN", "actions": "" } I understand you're looking into sustainable packaging solutions for electronics. Let me ask a few clarifying questions...
+Example (Structure Only): { "confidence_level": 9, "product_category": "Instapak", "query_focus_area": "Draft Email - Environmental benefits for electronics packaging", "key_takeaways": ["Customer concerned about foam sustainability", "Shipping sensitive electronics internationally", "Current solution creates excess waste"], "requires_followup": true, "detected_language": "EN", "actions": "" } I have prepared an email draft for your review. Please let me know if you'd like to proceed and I can place it in your drafts.
 
 7. IMPORTANT REMINDER
     - Your entire response must include BOTH Part 1 (JSON) and Part 2 (Plain Text).
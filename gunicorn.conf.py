@@ -0,0 +1,58 @@
+"""
+Gunicorn configuration for the sales agent.
+
+A /message request spends most of its life waiting on Azure OpenAI, Azure AI
+Search and Blob Storage. With the default sync worker each of those waits pins a
+whole worker process, so a handful of slow completions saturates the instance.
+The threaded profile below lets every worker hold many in-flight chats at once.
+
+All settings can be overridden through environment variables (App Service
+application settings):
+
+    GUNICORN_WORKER_CLASS        gthread (default), gevent or sync
+    GUNICORN_WORKERS             worker processes (default: 2)
+    GUNICORN_THREADS             threads per gthread worker (default: 64)
+    GUNICORN_WORKER_CONNECTIONS  greenlets per gevent worker (default: 500)
+    GUNICORN_TIMEOUT             worker timeout in seconds (default: 600)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import gunicorn_threads, gunicorn_workers  # noqa: E402
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = gunicorn_workers()  # app.py splits the TPM budget by the same count
+
+# gthread: each worker runs a thread pool; a thread blocked on an upstream call
+# no longer blocks the rest of the worker.
+threads = gunicorn_threads() if worker_class == 'gthread' else 1
+
+# gevent: requires `pip install gevent`; gunicorn monkey-patches sockets so the
+# OpenAI, Search and Blob clients yield while waiting on the network.
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+
+# Long completions (email drafting in particular) can take minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def when_ready(server):
+    """Log the effective concurrency once the master is up."""
+    if worker_class == 'gthread':
+        capacity = workers * threads
+    elif worker_class == 'gevent':
+        capacity = workers * worker_connections
+    else:
+        capacity = workers
+    server.log.info(
+        f"Serving with {workers} x {worker_class} workers "
+        f"(up to {capacity} concurrent requests)"
+    )
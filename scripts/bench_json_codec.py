@@ -0,0 +1,164 @@
+"""
+Compare database size and read latency of plain JSON columns and CompressedJSON.
+
+Builds two throwaway SQLite databases with the same synthetic data: sales
+metadata snapshots shaped like the federated search results (one per rep,
+with their open orders) and chat messages with citations. One uses
+SQLAlchemy's JSON type, the other services.json_codec.CompressedJSON. It then
+times point reads of snapshots and the last-N-messages read /message does.
+
+    python scripts/bench_json_codec.py
+    python scripts/bench_json_codec.py --reps 100 --orders 2000 --codec zstd
+
+Sizes are real; latencies are for a warm page cache on this machine.
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.json_codec import CompressedJSON, json_codec  # noqa: E402
+
+STATUSES = ['Open', 'In Process', 'Delivered', 'Blocked', 'Partially Delivered']
+
+
+def make_order(rng: random.Random, index: int) -> dict:
+    return {
+        'order_number': str(31000000 + index),
+        'execution_status': rng.choice(STATUSES),
+        'order_quantity': rng.randint(1, 500),
+        'open_quantity': rng.randint(0, 100),
+        'value_usd': round(rng.uniform(100, 50000), 2),
+        'delivery_number': str(80000000 + index),
+        'customer_info': {
+            'sold_to': f"Customer {rng.randint(1, 300)}",
+            'ship_to': f"Plant {rng.randint(1, 40)}",
+            'purchase_order': f"PO{rng.randint(100000, 999999)}"
+        },
+        'sales_team': {'customer_service_representative': f"CSR {rng.randint(1, 20)}"},
+        'credit_status': {'overall_status': rng.choice(['', 'Released', 'Blocked'])},
+        'material': f"{rng.choice(['Instapak', 'Autobag', 'Cryovac'])} {rng.randint(100, 999)}"
+    }
+
+
+def make_snapshot(rng: random.Random, rep: int, orders: int) -> dict:
+    return {
+        'Email': f"rep{rep}@example.com",
+        'Phone': '555-0100',
+        'total_orders': orders,
+        'territories': {'companies': ['1000', '2000'], 'sales_orgs': ['US01'], 'plants': ['P1', 'P2']},
+        'orders': [make_order(rng, rep * 100000 + i) for i in range(orders)]
+    }
+
+
+def make_message(rng: random.Random, assistant: bool) -> dict:
+    words = ' '.join(rng.choice(['glove', 'cut', 'level', 'order', 'ship', 'foam', 'bag', 'the', 'and'])
+                     for _ in range(rng.randint(20, 200)))
+    citations = [{
+        'title': f"Datasheet {rng.randint(1, 500)}",
+        'url': f"https://docs.example.com/{''.join(rng.choices(string.ascii_lowercase, k=12))}.pdf",
+        'content': words
+    } for _ in range(rng.randint(1, 5))] if assistant else None
+    return {'content': words, 'citations': citations,
+            'metadata': {'key_takeaways': [words[:80]] * 3} if assistant else None}
+
+
+def build(path: str, json_type, args) -> sa.Engine:
+    engine = sa.create_engine(f"sqlite:///{path}")
+    metadata = sa.MetaData()
+    snapshots = sa.Table('sales_snapshot', metadata,
+                         sa.Column('id', sa.Integer, primary_key=True),
+                         sa.Column('data', json_type))
+    messages = sa.Table('chat_message', metadata,
+                        sa.Column('id', sa.Integer, primary_key=True),
+                        sa.Column('session_id', sa.Integer, index=True),
+                        sa.Column('content', sa.Text),
+                        sa.Column('citations', json_type),
+                        sa.Column('message_metadata', json_type))
+    metadata.create_all(engine)
+
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        for rep in range(args.reps):
+            conn.execute(snapshots.insert(), {'id': rep, 'data': make_snapshot(rng, rep, args.orders)})
+        rows = []
+        for session_id in range(args.sessions):
+            for turn in range(args.messages):
+                message = make_message(rng, assistant=turn % 2 == 1)
+                rows.append({'session_id': session_id, 'content': message['content'],
+                             'citations': message['citations'], 'message_metadata': message['metadata']})
+        conn.execute(messages.insert(), rows)
+    return engine, snapshots, messages
+
+
+def time_reads(engine, snapshots, messages, args) -> dict:
+    rng = random.Random(7)
+    snapshot_times, history_times = [], []
+    with engine.connect() as conn:
+        for _ in range(args.reads):
+            started = time.perf_counter()
+            conn.execute(sa.select(snapshots.c.data).where(snapshots.c.id == rng.randrange(args.reps))).scalar_one()
+            snapshot_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            conn.execute(sa.select(messages).where(messages.c.session_id == rng.randrange(args.sessions))
+                         .order_by(messages.c.id.desc()).limit(10)).fetchall()
+            history_times.append(time.perf_counter() - started)
+    return {'snapshot': snapshot_times, 'history': history_times}
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reps', type=int, default=50, help='Sales snapshots (one per rep)')
+    parser.add_argument('--orders', type=int, default=1000, help='Orders per snapshot')
+    parser.add_argument('--sessions', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=20, help='Messages per session')
+    parser.add_argument('--reads', type=int, default=500, help='Timed reads of each kind')
+    parser.add_argument('--codec', default='zlib', choices=['zlib', 'zstd'])
+    parser.add_argument('--min-bytes', type=int, default=1024)
+    parser.add_argument('--level', type=int, default=6)
+    args = parser.parse_args()
+    json_codec.configure(args.codec, args.min_bytes, args.level)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for name, json_type in (('json', sa.JSON), (f"compressed ({json_codec.codec})", CompressedJSON)):
+            path = os.path.join(directory, f"{name.split()[0]}.db")
+            started = time.perf_counter()
+            engine, snapshots, messages = build(path, json_type, args)
+            build_seconds = time.perf_counter() - started
+            timings = time_reads(engine, snapshots, messages, args)
+            engine.dispose()
+            results[name] = (os.path.getsize(path), build_seconds, timings)
+
+        print(f"{args.reps} snapshots x {args.orders} orders, {args.sessions} sessions x {args.messages} messages")
+        print(f"{'':<20} {'DB size':>10} {'write':>8} {'snapshot p50':>13} {'p95':>8} {'history p50':>12} {'p95':>8}")
+        for name, (size, build_seconds, timings) in results.items():
+            print(f"{name:<20} {size / 1e6:>8.1f}MB {build_seconds:>7.1f}s "
+                  f"{percentile(timings['snapshot'], 50) * 1000:>11.2f}ms "
+                  f"{percentile(timings['snapshot'], 95) * 1000:>6.2f}ms "
+                  f"{percentile(timings['history'], 50) * 1000:>10.2f}ms "
+                  f"{percentile(timings['history'], 95) * 1000:>6.2f}ms")
+        plain_size = results['json'][0]
+        for name, (size, _, timings) in results.items():
+            if name != 'json':
+                print(f"Size ratio: {plain_size / size:.1f}x smaller; snapshot read "
+                      f"{statistics.mean(timings['snapshot']) / statistics.mean(results['json'][2]['snapshot']):.2f}x "
+                      f"the plain JSON time")
+
+
+if __name__ == '__main__':
+    main()
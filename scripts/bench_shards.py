@@ -0,0 +1,137 @@
+"""
+Measure chat-turn write throughput with many concurrent writers, sharded and not.
+
+Each writer process stands in for a gunicorn worker thread committing chat
+turns (upsert the session row, insert two messages) for random users, routed
+with services.shard_router to one of N SQLite files using the app's pragmas.
+The run is repeated for every shard count given, on fresh files.
+Run it on the same storage as the app's databases (--dir): tmpfs hides the
+fsync costs that make the write lock contended.
+
+    python scripts/bench_shards.py
+    python scripts/bench_shards.py --writers 32 --turns 300 --shards 1 2 4 8 --synchronous FULL
+
+With synchronous=NORMAL a WAL commit doesn't fsync and the write lock is held
+only briefly, so sharding mostly pays off with FULL, slow disks (Azure Files
+under $HOME), or larger transactions.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.shard_router import ShardRouter  # noqa: E402
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS chat_session (id VARCHAR(36) PRIMARY KEY, user_id VARCHAR(50), "
+    "focus_area VARCHAR(100), last_activity DATETIME, message_count INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS chat_message (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id VARCHAR(36), "
+    "role VARCHAR(20), content TEXT, created_at DATETIME)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_message_session_id_id ON chat_message (session_id, id)",
+]
+
+
+def connect(path: str, synchronous: str, busy_timeout_ms: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+    return conn
+
+
+def writer(args: tuple) -> tuple:
+    """One writer: returns (commit latencies, lock errors)."""
+    db_dir, shard_count, turns, users, synchronous, busy_timeout_ms, seed, message_bytes = args
+    router = ShardRouter(db_dir, 'chat_sessions', shard_count)
+    connections = {}
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    content = 'x' * message_bytes
+    for _ in range(turns):
+        user_id = f"user-{rng.randrange(users)}"
+        session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        shard = router.shard_for(user_id)
+        if shard not in connections:
+            connections[shard] = connect(router.path(shard), synchronous, busy_timeout_ms)
+        conn = connections[shard]
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO chat_session (id, user_id, focus_area, last_activity) "
+                         "VALUES (?, ?, 'Bench', ?)", (session_id, user_id, now))
+            conn.execute("UPDATE chat_session SET last_activity = ?, message_count = message_count + 2 "
+                         "WHERE id = ?", (now, session_id))
+            conn.executemany("INSERT INTO chat_message (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                             [(session_id, 'user', content, now), (session_id, 'assistant', content, now)])
+            conn.execute("COMMIT")
+            latencies.append(time.perf_counter() - started)
+        except sqlite3.OperationalError:
+            errors += 1  # "database is locked" after busy_timeout
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+    for conn in connections.values():
+        conn.close()
+    return latencies, errors
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def run(shard_count: int, args) -> dict:
+    with tempfile.TemporaryDirectory(dir=args.dir) as db_dir:
+        router = ShardRouter(db_dir, 'chat_sessions', shard_count)
+        for shard in router.shards():
+            conn = connect(router.path(shard), args.synchronous, args.busy_timeout_ms)
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.close()
+
+        jobs = [(db_dir, shard_count, args.turns, args.users, args.synchronous, args.busy_timeout_ms, seed,
+                 args.message_bytes) for seed in range(args.writers)]
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.writers) as pool:
+            results = pool.map(writer, jobs)
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for result in results for latency in result[0]]
+    return {
+        'turns_per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'errors': sum(result[1] for result in results)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=16, help='Concurrent writer processes')
+    parser.add_argument('--turns', type=int, default=200, help='Turns committed per writer')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--synchronous', default='NORMAL', choices=['OFF', 'NORMAL', 'FULL'])
+    parser.add_argument('--busy-timeout-ms', type=int, default=5000)
+    parser.add_argument('--message-bytes', type=int, default=2000)
+    parser.add_argument('--dir', help='Where to create the databases; use the app\'s disk for realistic fsync costs')
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers x {args.turns} turns, {args.users} users, synchronous={args.synchronous}")
+    print(f"{'shards':>6} {'turns/s':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'locked':>7}")
+    for shard_count in args.shards:
+        result = run(shard_count, args)
+        print(f"{shard_count:>6} {result['turns_per_second']:>9.0f} {result['p50_ms']:>6.2f}ms "
+              f"{result['p95_ms']:>6.2f}ms {result['p99_ms']:>6.2f}ms {result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
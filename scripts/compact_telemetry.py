@@ -0,0 +1,168 @@
+"""
+Merge small telemetry blobs into one blob per stream and hour.
+
+Before telemetry was batched, every chat message and feedback entry went to
+its own append blob (chats/Y/M/D/H/chat_log_<unix time>.jsonl, and
+feedback/Y/M/D/feedback_log_<unix time>.jsonl), so the containers hold
+millions of tiny objects. This tool groups those blobs by the UTC hour in
+their name and writes each hour as a single block blob under the hourly
+layout the app now uses, chats/Y/M/D/H/chat_log_compacted.jsonl, or as
+Parquet with --format parquet (needs pyarrow). With --include-workers the
+per-worker hourly blobs (chat_log_<host>-<pid>.jsonl) are merged in too, for
+one object per hour.
+
+    python scripts/compact_telemetry.py --dry-run
+    python scripts/compact_telemetry.py --stream chats --format parquet --delete
+
+Hours newer than --min-age-hours are left alone while they may still be
+written. Sources are deleted only with --delete and only after their hour's
+output is uploaded. Rerunning is safe: an hour's existing output is merged
+with any sources still present, and identical records are written once.
+Reads AZURE_STORAGE_ACCOUNT and the container names from the environment
+(or .env) and signs in with DefaultAzureCredential.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Optional: pip install pyarrow, for --format parquet
+    pyarrow = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.azure_clients import azure_clients  # noqa: E402
+from services.telemetry import hourly_partition  # noqa: E402
+
+# stream -> (container setting, log file name)
+STREAMS = {
+    'chats': ('AZURE_STORAGE_CONTAINER_TELEMETRY_NAME', 'chat_log'),
+    'feedback': ('AZURE_STORAGE_CONTAINER_FEEDBACK_NAME', 'feedback_log')
+}
+PER_SECOND = re.compile(r'^(?P<stream>chats|feedback)/\d{4}/\d{2}/\d{2}/(?:\d{2}/)?\w+_log_(?P<ts>\d+)\.jsonl$')
+PER_WORKER = re.compile(r'^(?P<stream>chats|feedback)/(?P<y>\d{4})/(?P<m>\d{2})/(?P<d>\d{2})/(?P<h>\d{2})/'
+                        r'\w+_log_[\w.-]+-\d+(?:_\d+)?\.jsonl$')
+DELETE_BATCH = 256  # Most blobs one batch delete request takes
+
+
+def blob_hour(name: str, include_workers: bool):
+    """(stream, UTC hour) a source blob belongs to, or None if it isn't compacted."""
+    match = PER_SECOND.match(name)
+    if match:
+        return match.group('stream'), datetime.datetime.utcfromtimestamp(int(match.group('ts'))).replace(
+            minute=0, second=0, microsecond=0)
+    match = PER_WORKER.match(name) if include_workers else None
+    if match and not name.endswith('_compacted.jsonl'):
+        return match.group('stream'), datetime.datetime(int(match.group('y')), int(match.group('m')),
+                                                        int(match.group('d')), int(match.group('h')))
+    return None
+
+
+def output_name(stream: str, hour: datetime.datetime, fmt: str) -> str:
+    extension = 'parquet' if fmt == 'parquet' else 'jsonl'
+    return f"{hourly_partition(stream, hour)}/{STREAMS[stream][1]}_compacted.{extension}"
+
+
+def read_lines(container, name: str) -> list:
+    data = container.download_blob(name).readall()
+    return [line for line in data.decode('utf-8').splitlines() if line.strip()]
+
+
+def read_output(container, name: str, fmt: str) -> list:
+    """Lines already compacted for an hour by an earlier run, if any."""
+    blob = container.get_blob_client(name)
+    if not blob.exists():
+        return []
+    if fmt != 'parquet':
+        return read_lines(container, name)
+    table = pyarrow.parquet.read_table(io.BytesIO(blob.download_blob().readall()))
+    return [json.dumps(record) for record in table.to_pylist()]
+
+
+def to_parquet(lines: list) -> bytes:
+    """One column per top-level field; nested values (metadata) are kept as JSON text."""
+    records = []
+    for line in lines:
+        record = json.loads(line)
+        records.append({key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                        for key, value in record.items()})
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(pyarrow.Table.from_pylist(records), buffer, compression='zstd')
+    return buffer.getvalue()
+
+
+def compact_hour(container, stream: str, hour: datetime.datetime, sources: list, args) -> tuple:
+    """Write an hour's output and delete its sources if asked; returns (records, bytes written)."""
+    target = output_name(stream, hour, args.format)
+    with ThreadPoolExecutor(args.workers) as pool:
+        source_lines = list(pool.map(lambda name: read_lines(container, name), sources))
+    seen, lines = set(), []
+    for line in read_output(container, target, args.format) + [line for part in source_lines for line in part]:
+        key = json.dumps(json.loads(line), sort_keys=True)  # The same record read back from Parquet or JSONL
+        if key not in seen:
+            seen.add(key)
+            lines.append(line)
+
+    data = to_parquet(lines) if args.format == 'parquet' else ('\n'.join(lines) + '\n').encode('utf-8')
+    container.upload_blob(target, data, overwrite=True)
+    if args.delete:
+        for start in range(0, len(sources), DELETE_BATCH):
+            container.delete_blobs(*sources[start:start + DELETE_BATCH])
+    return len(lines), len(data)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stream', choices=sorted(STREAMS), nargs='+', default=sorted(STREAMS))
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl')
+    parser.add_argument('--include-workers', action='store_true',
+                        help='Also merge the per-worker hourly blobs written by the app')
+    parser.add_argument('--min-age-hours', type=int, default=2, help='Skip hours newer than this')
+    parser.add_argument('--workers', type=int, default=16, help='Parallel downloads')
+    parser.add_argument('--delete', action='store_true', help='Delete the source blobs once merged')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be merged without writing')
+    args = parser.parse_args()
+    if args.format == 'parquet' and pyarrow is None:
+        parser.error("--format parquet needs pyarrow (pip install pyarrow)")
+
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=args.min_age_hours)
+    started = time.perf_counter()
+
+    for stream in args.stream:
+        container = azure_clients.container(os.environ['AZURE_STORAGE_ACCOUNT'], os.environ[STREAMS[stream][0]])
+        hours = defaultdict(list)
+        sizes = defaultdict(int)
+        for blob in container.list_blobs(name_starts_with=f"{stream}/"):
+            key = blob_hour(blob.name, args.include_workers)
+            if key and key[1] + datetime.timedelta(hours=1) <= cutoff:
+                hours[key[1]].append(blob.name)
+                sizes[key[1]] += blob.size
+        print(f"{stream}: {sum(len(names) for names in hours.values())} blobs in {len(hours)} hours "
+              f"({sum(sizes.values()) / 1e6:.1f}MB) in {container.container_name}")
+
+        for hour in sorted(hours):
+            sources = sorted(hours[hour])
+            if args.dry_run:
+                print(f"  {output_name(stream, hour, args.format)}: {len(sources)} blobs, {sizes[hour] / 1e3:.0f}KB")
+                continue
+            records, written = compact_hour(container, stream, hour, sources, args)
+            print(f"  {output_name(stream, hour, args.format)}: {len(sources)} blobs -> {records} records, "
+                  f"{written / 1e3:.0f}KB" + (", sources deleted" if args.delete else ""))
+
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Rewrite existing JSON column values in chat_sessions.db with the compression codec.
+
+New and updated values are compressed by the CompressedJSON column type as
+they are written; this tool converts the rows written before it existed (or
+re-encodes them after changing JSON_COMPRESSION_CODEC). Rows are processed in
+short, id-ordered batches, each in its own transaction, so it can run while
+the app is serving: the rewritten tables are append-only, and the app reads
+plain and compressed values alike.
+
+    python scripts/compress_json_columns.py --dry-run
+    python scripts/compress_json_columns.py --codec zlib --min-bytes 1024 --vacuum
+
+VACUUM rewrites the whole file to give the freed pages back to the
+filesystem; it needs free disk space equal to the database size and blocks
+writers while it runs, so schedule it for a quiet period.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.json_codec import JSONCodec  # noqa: E402
+
+# (table, primary key, JSON columns) stored through CompressedJSON
+COLUMNS = [
+    ('sales_snapshot', 'id', ['data']),
+    ('chat_message', 'id', ['payload', 'citations', 'message_metadata']),
+    ('chat_session', 'id', ['messages', 'chat_history', 'citations', 'sales_metadata']),
+]
+
+
+def default_db_path() -> str:
+    return os.path.join(os.environ.get('HOME', ''), 'site', 'wwwroot', 'chat_sessions.db')
+
+
+def existing_columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def compress_table(conn: sqlite3.Connection, codec: JSONCodec, table: str, key: str, columns: list,
+                   batch_size: int, dry_run: bool, recompress: bool) -> tuple:
+    """Returns (rows rewritten, bytes before, bytes after) for one table."""
+    present = existing_columns(conn, table)
+    columns = [column for column in columns if column in present]
+    if not columns:
+        return 0, 0, 0
+
+    rewritten = before = after = 0
+    last_key = None
+    while True:
+        where = f"WHERE {key} > ?" if last_key is not None else ""
+        rows = conn.execute(
+            f"SELECT {key}, {', '.join(columns)} FROM {table} {where} ORDER BY {key} LIMIT ?",
+            ((last_key,) if last_key is not None else ()) + (batch_size,)
+        ).fetchall()
+        if not rows:
+            break
+        last_key = rows[-1][0]
+
+        updates = []
+        for row in rows:
+            changes = {}
+            for column, stored in zip(columns, row[1:]):
+                if stored is None or (codec.is_compressed(stored) and not recompress):
+                    continue
+                encoded = codec.encode(codec.decode(stored))
+                old_size = len(stored.encode('utf-8') if isinstance(stored, str) else stored)
+                if encoded is None or (not codec.is_compressed(encoded) and not codec.is_compressed(stored)):
+                    continue  # Below the threshold and already uncompressed; leave as is
+                changes[column] = encoded
+                before += old_size
+                after += len(encoded)
+            if changes:
+                updates.append((row[0], changes))
+
+        if updates and not dry_run:
+            with conn:
+                for row_key, changes in updates:
+                    assignments = ', '.join(f"{column} = ?" for column in changes)
+                    conn.execute(f"UPDATE {table} SET {assignments} WHERE {key} = ?",
+                                 list(changes.values()) + [row_key])
+        rewritten += len(updates)
+    return rewritten, before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=default_db_path(), help='Path to chat_sessions.db')
+    parser.add_argument('--codec', default=os.environ.get('JSON_COMPRESSION_CODEC', 'zlib'),
+                        choices=['zlib', 'zstd'])
+    parser.add_argument('--min-bytes', type=int, default=int(os.environ.get('JSON_COMPRESSION_MIN_BYTES', 1024)))
+    parser.add_argument('--level', type=int, default=int(os.environ.get('JSON_COMPRESSION_LEVEL', 6)))
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--recompress', action='store_true',
+                        help='Also re-encode values that are already compressed (e.g. after switching codec)')
+    parser.add_argument('--dry-run', action='store_true', help='Report the savings without writing')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM afterwards to shrink the file')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"Database not found: {args.db}")
+
+    codec = JSONCodec(args.codec, args.min_bytes, args.level)
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.execute("PRAGMA busy_timeout=30000")
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    print(f"{'Dry run on' if args.dry_run else 'Compressing'} {args.db} with {codec.codec} "
+          f"(values >= {args.min_bytes} bytes)")
+    size_before = os.path.getsize(args.db)
+    started = time.perf_counter()
+    for table, key, columns in COLUMNS:
+        if table not in tables:
+            continue
+        rows, before, after = compress_table(conn, codec, table, key, columns, args.batch_size,
+                                             args.dry_run, args.recompress)
+        saved = before - after
+        print(f"  {table:<15} {rows:>8} rows  {before / 1e6:>9.1f} MB -> {after / 1e6:>8.1f} MB  "
+              f"(saves {saved / 1e6:.1f} MB)")
+
+    if args.vacuum and not args.dry_run:
+        print("Running VACUUM...")
+        conn.execute("VACUUM")
+    conn.close()
+
+    print(f"Done in {time.perf_counter() - started:.1f}s; file {size_before / 1e6:.1f} MB -> "
+          f"{os.path.getsize(args.db) / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Concurrency load test for the /message endpoint.
+
+Each virtual user opens the chat page (which creates its Flask session cookie)
+and then posts messages back to back. The report shows throughput and latency
+percentiles, so running it against the sync and the threaded gunicorn profiles
+makes the concurrency gain visible.
+
+Typical run against the local stub (see scripts/stub_openai.py):
+
+    python scripts/stub_openai.py --latency 2 &
+    IS_LOCAL_DEV=True GUNICORN_WORKER_CLASS=sync GUNICORN_WORKERS=2 \\
+        gunicorn --config gunicorn.conf.py app:app &
+    python scripts/load_test.py --users 100 --messages 3
+
+    # restart gunicorn with the default gthread profile and run again
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def run_user(base_url: str, user_index: int, messages: int, question: str, timeout: float) -> list:
+    """Simulate one sales rep; returns a list of (ok, seconds) tuples."""
+    results = []
+    headers = {
+        'X-MS-CLIENT-PRINCIPAL-ID': f'load-test-user-{user_index}',
+        'X-MS-CLIENT-PRINCIPAL-NAME': f'load-test-user-{user_index}@example.com',
+    }
+    with requests.Session() as http:
+        http.headers.update(headers)
+        try:
+            http.get(f'{base_url}/', timeout=timeout)
+        except requests.RequestException:
+            return [(False, 0.0)] * messages
+
+        for _ in range(messages):
+            started = time.perf_counter()
+            try:
+                response = http.post(
+                    f'{base_url}/message',
+                    data={'question': question},
+                    headers={'Referer': f'{base_url}/'},
+                    timeout=timeout
+                )
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            results.append((ok, time.perf_counter() - started))
+    return results
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', type=int, default=50, help='Concurrent virtual users')
+    parser.add_argument('--messages', type=int, default=3, help='Messages sent by each user')
+    parser.add_argument('--question', default='Instapak vs Autobag for electronics?')
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    print(f"Running {args.users} users x {args.messages} messages against {args.url}")
+    started = time.perf_counter()
+    lock = threading.Lock()
+    all_results = []
+
+    def worker(index):
+        user_results = run_user(args.url, index, args.messages, args.question, args.timeout)
+        with lock:
+            all_results.extend(user_results)
+
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(worker, range(args.users)))
+
+    elapsed = time.perf_counter() - started
+    latencies = [seconds for ok, seconds in all_results if ok]
+    failures = sum(1 for ok, _ in all_results if not ok)
+
+    print(f"Completed:   {len(latencies)} ok, {failures} failed in {elapsed:.1f}s")
+    print(f"Throughput:  {len(latencies) / elapsed:.2f} messages/s")
+    if latencies:
+        print(f"Latency p50: {percentile(latencies, 50):.2f}s")
+        print(f"Latency p95: {percentile(latencies, 95):.2f}s")
+        print(f"Latency max: {max(latencies):.2f}s")
+        print(f"Latency avg: {statistics.mean(latencies):.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Move chat sessions to the shard their user belongs to after changing SESSION_SHARD_COUNT.
+
+Reads every chat_sessions*.db file in the database directory and moves each
+session whose user now hashes to another shard, with its messages and its
+sales snapshot, into that shard's file (created with the same schema if it
+doesn't exist yet). Stop the app first: sessions written while it runs could
+land in the old shard after they were scanned.
+
+    python scripts/reshard_sessions.py --shards 4 --dry-run
+    python scripts/reshard_sessions.py --shards 4
+
+Each batch is one transaction over the source and the target file (attached).
+In WAL mode SQLite commits the two files separately, so an interruption can
+leave a batch in both; rerunning is safe, as a batch replaces the target's
+copy of its sessions. Going down in shard count leaves the dropped shard
+files empty; delete them once this has run.
+"""
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.shard_router import ShardRouter  # noqa: E402
+
+BASE_NAME = 'chat_sessions'
+
+
+def default_db_dir() -> str:
+    return os.path.join(os.environ.get('HOME', ''), 'site', 'wwwroot')
+
+
+def shard_files(db_dir: str) -> dict:
+    """{shard number: path} for the shard files present."""
+    files = {}
+    if os.path.exists(os.path.join(db_dir, f"{BASE_NAME}.db")):
+        files[0] = os.path.join(db_dir, f"{BASE_NAME}.db")
+    for path in glob.glob(os.path.join(db_dir, f"{BASE_NAME}_shard*.db")):
+        match = re.search(r'_shard(\d+)\.db$', path)
+        if match:
+            files[int(match.group(1))] = path
+    return files
+
+
+def columns(conn: sqlite3.Connection, table: str, schema: str = 'main') -> list:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def create_shard(source: sqlite3.Connection, path: str) -> None:
+    """A new shard file with the source's tables, indexes and applied migrations."""
+    schema = source.execute(
+        "SELECT sql FROM sqlite_master WHERE type IN ('table', 'index') AND sql IS NOT NULL "
+        "AND name NOT LIKE 'sqlite_%' ORDER BY type DESC"  # Tables before their indexes
+    ).fetchall()
+    target = sqlite3.connect(path)
+    with target:
+        for (sql,) in schema:
+            target.execute(sql)
+        if 'schema_migration' in {row[0] for row in source.execute("SELECT name FROM sqlite_master")}:
+            migration_columns = columns(source, 'schema_migration')
+            rows = source.execute(f"SELECT {', '.join(migration_columns)} FROM schema_migration").fetchall()
+            target.executemany(
+                f"INSERT INTO schema_migration ({', '.join(migration_columns)}) "
+                f"VALUES ({', '.join('?' for _ in migration_columns)})", rows)
+    target.execute("PRAGMA journal_mode=WAL")
+    target.close()
+
+
+def copy_rows(conn: sqlite3.Connection, table: str, where: str, params: list, conflict: str = 'IGNORE',
+              exclude: tuple = ()) -> int:
+    """Copy matching rows from main to dest by column name; the two files may order columns differently."""
+    target_columns = set(columns(conn, table, 'dest'))
+    shared = [column for column in columns(conn, table) if column in target_columns and column not in exclude]
+    column_list = ', '.join(shared)
+    cursor = conn.execute(f"INSERT OR {conflict} INTO dest.{table} ({column_list}) "
+                          f"SELECT {column_list} FROM main.{table} WHERE {where}", params)
+    return cursor.rowcount
+
+
+def move_sessions(conn: sqlite3.Connection, session_ids: list) -> int:
+    """Move sessions with their messages and snapshots from main to dest; returns messages moved."""
+    placeholders = ', '.join('?' for _ in session_ids)
+    if 'sales_snapshot_id' in columns(conn, 'chat_session'):
+        copy_rows(conn, 'sales_snapshot',
+                  f"id IN (SELECT sales_snapshot_id FROM main.chat_session WHERE id IN ({placeholders}))",
+                  session_ids)
+    copy_rows(conn, 'chat_session', f"id IN ({placeholders})", session_ids, conflict='REPLACE')
+    # Messages get new ids in the target, in their original order; drop a partial earlier copy first
+    conn.execute(f"DELETE FROM dest.chat_message WHERE session_id IN ({placeholders})", session_ids)
+    messages = copy_rows(conn, 'chat_message', f"session_id IN ({placeholders}) ORDER BY id", session_ids,
+                         conflict='ABORT', exclude=('id',))
+    conn.execute(f"DELETE FROM main.chat_message WHERE session_id IN ({placeholders})", session_ids)
+    conn.execute(f"DELETE FROM main.chat_session WHERE id IN ({placeholders})", session_ids)
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-dir', default=default_db_dir(), help='Directory holding chat_sessions*.db')
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('SESSION_SHARD_COUNT', 1)),
+                        help='New shard count (SESSION_SHARD_COUNT)')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--dry-run', action='store_true', help='Report what would move without writing')
+    args = parser.parse_args()
+
+    files = shard_files(args.db_dir)
+    if 0 not in files:
+        parser.error(f"{BASE_NAME}.db not found in {args.db_dir}")
+    router = ShardRouter(args.db_dir, BASE_NAME, args.shards)
+    started = time.perf_counter()
+    print(f"{'Dry run:' if args.dry_run else 'Resharding'} {len(files)} file(s) in {args.db_dir} "
+          f"to {args.shards} shard(s)")
+
+    totals = defaultdict(int)
+    for source_shard, source_path in sorted(files.items()):
+        conn = sqlite3.connect(source_path, timeout=30, isolation_level=None)
+        moved_sessions = moved_messages = 0
+        after_id = ''
+        while True:
+            batch = conn.execute("SELECT id, user_id FROM chat_session WHERE id > ? ORDER BY id LIMIT ?",
+                                 (after_id, args.batch_size)).fetchall()
+            if not batch:
+                break
+            after_id = batch[-1][0]
+            by_target = defaultdict(list)
+            for session_id, user_id in batch:
+                target = router.shard_for(user_id)
+                if target != source_shard:
+                    by_target[target].append(session_id)
+
+            for target, session_ids in by_target.items():
+                totals[(source_shard, target)] += len(session_ids)
+                moved_sessions += len(session_ids)
+                if args.dry_run:
+                    continue
+                target_path = router.path(target)
+                if not os.path.exists(target_path):
+                    create_shard(conn, target_path)
+                conn.execute("ATTACH DATABASE ? AS dest", (target_path,))
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        moved_messages += move_sessions(conn, session_ids)
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+                finally:
+                    conn.execute("DETACH DATABASE dest")
+        conn.close()
+        print(f"  shard {source_shard}: moved {moved_sessions} sessions"
+              + ("" if args.dry_run else f" ({moved_messages} messages)"))
+
+    for (source, target), count in sorted(totals.items()):
+        print(f"    {source} -> {target}: {count}")
+    extra = [path for shard, path in files.items() if shard >= args.shards]
+    if extra and not args.dry_run:
+        print(f"Now empty and unused: {', '.join(extra)}")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
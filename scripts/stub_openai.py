@@ -0,0 +1,161 @@
+"""
+Local stand-in for Azure OpenAI and Azure AI Search.
+
+Answers chat completion requests after a configurable delay so the app can be
+exercised under load without spending tokens. Point the app at it with:
+
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8100
+    AZURE_AI_SEARCH_ENDPOINT=http://127.0.0.1:8100
+
+Usage:
+    python scripts/stub_openai.py --port 8100 --latency 2.0 --error-rate 0.05
+
+To exercise deployment routing and failover, run several stubs with different
+latency/error profiles and list them in AZURE_OPENAI_DEPLOYMENTS, e.g.
+
+    python scripts/stub_openai.py --port 8100 --latency 1.0
+    python scripts/stub_openai.py --port 8101 --latency 3.0 --error-rate 0.3 --error-status 503
+    AZURE_OPENAI_DEPLOYMENTS='[{"name": "fast", "endpoint": "http://127.0.0.1:8100", "deployment": "stub"},
+                               {"name": "slow", "endpoint": "http://127.0.0.1:8101", "deployment": "stub"}]'
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETION_TEXT = (
+    '{"confidence_level": 8, "product_category": "Product Information", '
+    '"query_focus_area": "Stub response", "key_takeaways": ["stub"], '
+    '"requires_followup": true, "detected_language": "EN", "actions": ""}\n'
+    'This is a stubbed answer from the local test endpoint.'
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 1.0
+    jitter = 0.0
+    error_rate = 0.0
+    error_status = 429
+    retry_after = 1
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # Azure AI Search document queries used by the federated search
+        if '/indexes/' in self.path:
+            self._send_json(200, {'value': []})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request_body = json.loads(self.rfile.read(length) or b'{}')
+
+        if '/chat/completions' not in self.path:
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if random.random() < self.error_rate:
+            if self.error_status == 429:
+                self._send_json(
+                    429,
+                    {'error': {'code': '429', 'message': 'Rate limit is exceeded.'}},
+                    {'Retry-After': str(self.retry_after)}
+                )
+            else:
+                self._send_json(self.error_status, {'error': {'code': str(self.error_status), 'message': 'Stub failure.'}})
+            return
+
+        prompt_chars = sum(len(str(m.get('content', ''))) for m in request_body.get('messages', []))
+        prompt_tokens = prompt_chars // 4
+        completion_tokens = len(COMPLETION_TEXT) // 4
+
+        if request_body.get('stream'):
+            include_usage = (request_body.get('stream_options') or {}).get('include_usage', False)
+            self._send_stream(prompt_tokens, completion_tokens, include_usage)
+            return
+
+        self._send_json(200, {
+            'id': f'chatcmpl-stub-{int(time.time() * 1000)}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': 'stub',
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': COMPLETION_TEXT}
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        })
+
+    def _send_stream(self, prompt_tokens: int, completion_tokens: int, include_usage: bool):
+        """Answer as server-sent events, the way chat completions stream with stream=True."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+
+        base = {'id': f'chatcmpl-stub-{int(time.time() * 1000)}', 'object': 'chat.completion.chunk',
+                'created': int(time.time()), 'model': 'stub'}
+        pieces = [COMPLETION_TEXT[i:i + 40] for i in range(0, len(COMPLETION_TEXT), 40)]
+        events = [{**base, 'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+                  for piece in pieces]
+        events.append({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        if include_usage:
+            events.append({**base, 'choices': [], 'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }})
+
+        for event in events:
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        # Keep the console quiet under load
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=1.0, help='Seconds per completion')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random +/- seconds added to latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of completions answered with 429')
+    parser.add_argument('--error-status', type=int, default=429, help='HTTP status for injected errors (429 or 5xx)')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.jitter = args.jitter
+    StubHandler.error_rate = args.error_rate
+    StubHandler.error_status = args.error_status
+    StubHandler.retry_after = args.retry_after
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub Azure OpenAI listening on http://{args.host}:{args.port} (latency={args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Questions mentioning the rep's own orders, customers or accounts depend on the
+# sales context in the system prompt and must never be served from a shared cache.
+REP_SPECIFIC_PATTERN = re.compile(
+    r"\b(?:my|mine|our|ours|order|orders|po|pos|purchase\s+order|delivery|deliveries|"
+    r"shipment|shipments|invoice|invoices|customer|customers|account|accounts|territory|"
+    r"quota|credit|backlog|blocked)\b|\d{5,}",
+    re.IGNORECASE
+)
+
+
+class AnswerCache:
+    """Thread-safe TTL/LRU cache of RAG answers keyed by normalized question, prompt variant and index version."""
+
+    def __init__(self, max_size: int = 1000, ttl: int = 86400):
+        self.entries = OrderedDict()  # key -> (stored_at, entry); ordered by recency of use
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Lowercase, drop punctuation and collapse whitespace so trivial rewordings share a key."""
+        question = question.lower()
+        question = re.sub(r"[^\w\s]", " ", question)
+        return " ".join(question.split())
+
+    @staticmethod
+    def is_cacheable(question: str) -> bool:
+        """Only self-contained product-knowledge questions without rep-specific references are cacheable."""
+        if not question or len(question) > 500:
+            return False
+        return not REP_SPECIFIC_PATTERN.search(question)
+
+    def make_key(self, question: str, prompt_variant: str, index_version: str) -> str:
+        raw = "\x1f".join([self.normalize_question(question), prompt_variant, index_version])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return a cached answer if present and not expired."""
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            stored_at, entry = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: str, entry: Dict) -> None:
+        """Store an answer, evicting the least recently used entries when full."""
+        with self.lock:
+            self.entries[key] = (time.monotonic(), entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached answer (e.g. after the document index was rebuilt)."""
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+class IndexVersionTracker:
+    """
+    Tracks the version of the document search index used for cache keys.
+
+    When an indexer name is configured, the version is the end time of the
+    indexer's last successful run, polled at most once per poll interval, so a
+    reindex automatically invalidates cached answers. Otherwise the configured
+    static version string is used.
+    """
+
+    def __init__(self, static_version: str, fetch_status: Optional[Callable[[], Optional[Dict]]] = None,
+                 poll_interval: int = 300, on_change: Optional[Callable[[str, str], None]] = None):
+        self.version = static_version
+        self.static_version = static_version
+        self.fetch_status = fetch_status
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self.last_poll = float('-inf')
+        self.lock = Lock()
+
+    def current_version(self) -> str:
+        if self.fetch_status is None:
+            return self.version
+
+        with self.lock:
+            if time.monotonic() - self.last_poll < self.poll_interval:
+                return self.version
+            self.last_poll = time.monotonic()
+            previous = self.version
+
+        try:
+            status = self.fetch_status() or {}
+            last_result = status.get('lastResult') or {}
+            if last_result.get('status') == 'success' and last_result.get('endTime'):
+                new_version = f"{self.static_version}:{last_result['endTime']}"
+                with self.lock:
+                    self.version = new_version
+                if previous != new_version:
+                    logger.info(f"Search index version changed: {previous} -> {new_version}")
+                    if self.on_change:
+                        self.on_change(previous, new_version)
+        except Exception as e:
+            # Keep serving with the last known version; a stale poll is not an error for the request
+            logger.warning(f"Failed to poll search indexer status: {e}")
+
+        return self.version
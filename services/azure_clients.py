@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from azure.core.credentials import AccessToken
+from azure.identity import DefaultAzureCredential
+from azure.storage.blob import BlobServiceClient, ContainerClient
+
+logger = logging.getLogger(__name__)
+
+
+class CachedCredential:
+    """
+    One credential for the process, with a token cache in front of it.
+
+    Tokens are cached per scope (and tenant). Each cached token arms a timer
+    that fetches its replacement `refresh_margin_seconds` before expiry, so a
+    scope in use is renewed even when no caller asks for it in that window;
+    a failed refresh is retried every `RETRY_SECONDS` while the old token is
+    still valid. If a caller does find a token inside the margin (the timer
+    is late or failing), it is still returned while one background thread
+    fetches its replacement. Callers only wait on the credential chain for
+    the first token of a scope or after a token has expired. Concurrent
+    misses for a scope wait for one fetch. Requests carrying `claims` (a CAE
+    challenge) always go to the credential.
+    """
+
+    RETRY_SECONDS = 30
+
+    def __init__(self, factory: Callable[[], object] = DefaultAzureCredential, refresh_margin_seconds: int = 300):
+        self.factory = factory
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.credential = None
+        self.lock = threading.Lock()
+        self.tokens: Dict[tuple, AccessToken] = {}
+        self.fetch_locks: Dict[tuple, threading.Lock] = {}
+        self.refreshing = set()
+        self.timers: Dict[tuple, threading.Timer] = {}
+        self.closed = False
+
+        self.hits = 0
+        self.fetches = 0
+        self.failures = 0
+        self.background_refreshes = 0
+        self.refresh_failures = 0
+        self.fetch_times = deque(maxlen=200)
+
+    def _credential(self):
+        with self.lock:
+            if self.credential is None:
+                self.credential = self.factory()
+            return self.credential
+
+    def get_token(self, *scopes: str, claims: Optional[str] = None, tenant_id: Optional[str] = None,
+                  **kwargs) -> AccessToken:
+        if claims:
+            return self._fetch(scopes, claims=claims, tenant_id=tenant_id, **kwargs)
+        key = (scopes, tenant_id, kwargs.get('enable_cae', False))
+        with self.lock:
+            token = self.tokens.get(key)
+            remaining = token.expires_on - time.time() if token else 0
+            if remaining > self.refresh_margin_seconds:
+                self.hits += 1
+                return token
+            if remaining > 30 and key not in self.refreshing:
+                self.refreshing.add(key)
+                threading.Thread(target=self._refresh, args=(key, kwargs), name='token-refresh', daemon=True).start()
+            if remaining > 30:
+                self.hits += 1
+                return token
+            fetch_lock = self.fetch_locks.setdefault(key, threading.Lock())
+
+        with fetch_lock:
+            with self.lock:  # Another thread may have fetched it while this one waited
+                token = self.tokens.get(key)
+                if token and token.expires_on - time.time() > 30:
+                    self.hits += 1
+                    return token
+            token = self._fetch(scopes, tenant_id=tenant_id, **kwargs)
+            with self.lock:
+                self.tokens[key] = token
+                self._schedule_refresh(key, kwargs, token)
+            return token
+
+    def _schedule_refresh(self, key: tuple, kwargs: Dict, token: Optional[AccessToken] = None,
+                          delay: Optional[float] = None) -> None:
+        """Arm the refresh timer for a scope, replacing any earlier one. Caller holds self.lock."""
+        if self.closed:
+            return
+        if delay is None:
+            remaining = token.expires_on - time.time()
+            # Short-lived tokens (lifetime under the margin) are renewed halfway through instead
+            delay = max(1.0, remaining - self.refresh_margin_seconds, remaining / 2)
+        previous = self.timers.get(key)
+        if previous is not None:
+            previous.cancel()
+        timer = threading.Timer(delay, self._scheduled_refresh, args=(key, kwargs))
+        timer.name = 'token-refresh'
+        timer.daemon = True
+        self.timers[key] = timer
+        timer.start()
+
+    def _scheduled_refresh(self, key: tuple, kwargs: Dict) -> None:
+        with self.lock:
+            if self.closed or key in self.refreshing:
+                return  # A caller-triggered refresh is already running and will re-arm the timer
+            self.refreshing.add(key)
+        self._refresh(key, kwargs)
+
+    def _refresh(self, key: tuple, kwargs: Dict) -> None:
+        try:
+            token = self._fetch(key[0], tenant_id=key[1], **kwargs)
+            with self.lock:
+                self.tokens[key] = token
+                self.background_refreshes += 1
+                self._schedule_refresh(key, kwargs, token)
+        except Exception as e:
+            logger.warning(f"Background token refresh for {key[0]} failed: {str(e)}")
+            with self.lock:
+                self.refresh_failures += 1
+                current = self.tokens.get(key)
+                # Keep retrying while the old token is usable; after that the next caller fetches inline
+                if current is not None and current.expires_on - time.time() > self.RETRY_SECONDS + 30:
+                    self._schedule_refresh(key, kwargs, delay=self.RETRY_SECONDS)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def _fetch(self, scopes: tuple, **kwargs) -> AccessToken:
+        started = time.monotonic()
+        try:
+            token = self._credential().get_token(*scopes, **{k: v for k, v in kwargs.items() if v is not None})
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+        elapsed = time.monotonic() - started
+        with self.lock:
+            self.fetches += 1
+            self.fetch_times.append(elapsed)
+        logger.info(f"Fetched token for {', '.join(scopes)} in {elapsed:.2f}s")
+        return token
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers.clear()
+            if self.credential is not None and hasattr(self.credential, 'close'):
+                self.credential.close()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            fetch_times = sorted(self.fetch_times)
+            count = len(fetch_times)
+            now = time.time()
+            return {
+                'cache_hits': self.hits,
+                'fetches': self.fetches,
+                'failures': self.failures,
+                'background_refreshes': self.background_refreshes,
+                'refresh_failures': self.refresh_failures,
+                'fetch_p50_ms': round(fetch_times[count // 2] * 1000) if count else None,
+                'fetch_p95_ms': round(fetch_times[max(0, int(count * 0.95) - 1)] * 1000) if count else None,
+                'fetch_max_ms': round(fetch_times[-1] * 1000) if count else None,
+                'tokens': {', '.join(key[0]): round(token.expires_on - now) for key, token in self.tokens.items()}
+            }
+
+
+class AzureClients:
+    """
+    Process-wide Azure SDK clients: the cached credential, one BlobServiceClient
+    per storage account and one ContainerClient per container. The clients are
+    thread-safe and keep their HTTP connections open, so every module should
+    take them from here rather than building its own.
+    """
+
+    def __init__(self, credential: Optional[CachedCredential] = None):
+        self.credential = credential or CachedCredential()
+        self.lock = threading.Lock()
+        self.services: Dict[str, BlobServiceClient] = {}
+        self.containers: Dict[tuple, ContainerClient] = {}
+
+    def blob_service(self, account: str) -> BlobServiceClient:
+        with self.lock:
+            if account not in self.services:
+                self.services[account] = BlobServiceClient(f"https://{account}.blob.core.windows.net",
+                                                           credential=self.credential)
+            return self.services[account]
+
+    def container(self, account: str, container_name: str) -> ContainerClient:
+        key = (account, container_name)
+        with self.lock:
+            if key in self.containers:
+                return self.containers[key]
+        client = self.blob_service(account).get_container_client(container_name)
+        with self.lock:
+            return self.containers.setdefault(key, client)
+
+    def bearer_token(self, resource: str) -> str:
+        return f"Bearer {self.credential.get_token(resource).token}"
+
+    def stats(self) -> Dict:
+        with self.lock:
+            clients = {'blob_services': len(self.services), 'containers': len(self.containers)}
+        return {**clients, 'credential': self.credential.stats()}
+
+
+azure_clients = AzureClients()
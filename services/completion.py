@@ -0,0 +1,120 @@
+import logging
+from typing import Dict, List, Optional
+
+from services.request_control import CancelToken, Deadline, RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+# Rough cost of an attached image in prompt tokens (high-detail tile estimate)
+IMAGE_TOKEN_ESTIMATE = 765
+
+
+class TokenUsage:
+    """Token counts for a completion; `estimated` is set when the stream carried no usage block."""
+
+    def __init__(self, prompt_tokens: int, completion_tokens: int, estimated: bool = False):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.estimated = estimated
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class CompletionResult:
+    """The reassembled output of a streamed chat completion."""
+
+    def __init__(self, content: str, context: Optional[Dict], usage: TokenUsage, finish_reason: Optional[str]):
+        self.content = content
+        self.context = context
+        self.usage = usage
+        self.finish_reason = finish_reason
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """Cheap prompt-size estimate (~4 characters per token) used when exact counts are unavailable."""
+    total = 0
+    for message in messages:
+        total += 4  # per-message framing
+        content = message.get('content', '')
+        if isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'text':
+                    total += len(part.get('text', '')) // 4
+                else:
+                    total += IMAGE_TOKEN_ESTIMATE
+        else:
+            total += len(str(content)) // 4
+    return total
+
+
+def _extra_field(obj, name: str):
+    """Read a vendor extension (e.g. Azure's `context`) from an SDK model."""
+    value = getattr(obj, name, None)
+    if value is None:
+        value = (getattr(obj, 'model_extra', None) or {}).get(name)
+    return value
+
+
+def stream_chat_completion(client, cancel_token: Optional[CancelToken] = None, deadline: Optional[Deadline] = None,
+                           include_usage: bool = False, **kwargs) -> CompletionResult:
+    """
+    Run a chat completion as a stream so it can be abandoned part-way.
+
+    The cancel token is checked between chunks; closing the stream drops the
+    upstream connection, which stops Azure OpenAI from generating (and billing)
+    the rest of the answer.
+    """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled("completion")
+
+    request_kwargs = dict(kwargs, stream=True)
+    if include_usage:
+        request_kwargs['stream_options'] = {"include_usage": True}
+    if deadline is not None:
+        request_kwargs['timeout'] = deadline.timeout()
+
+    stream = client.chat.completions.create(**request_kwargs)
+
+    parts = []
+    context = None
+    usage = None
+    finish_reason = None
+    try:
+        for chunk in stream:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise RequestCancelled(cancel_token.reason, "completion")
+
+            if getattr(chunk, 'usage', None):
+                usage = TokenUsage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+
+            if not chunk.choices:
+                continue
+
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if delta is not None:
+                if delta.content:
+                    parts.append(delta.content)
+                delta_context = _extra_field(delta, 'context')
+                if delta_context:
+                    context = {**(context or {}), **delta_context}
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+    finally:
+        close = getattr(stream, 'close', None)
+        if close is not None:
+            close()
+        elif getattr(stream, 'response', None) is not None:
+            stream.response.close()
+
+    content = "".join(parts)
+    if usage is None:
+        usage = TokenUsage(
+            prompt_tokens=estimate_tokens(kwargs.get('messages', [])),
+            completion_tokens=len(content) // 4,
+            estimated=True
+        )
+
+    return CompletionResult(content, context, usage, finish_reason)
@@ -0,0 +1,78 @@
+import datetime
+import logging
+import time
+from typing import Callable, List
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+
+class Migration:
+    """A numbered, one-time schema or data change applied inside a single transaction."""
+
+    def __init__(self, version: str, description: str, apply: Callable):
+        self.version = version
+        self.description = description
+        self.apply = apply
+
+
+class MigrationRunner:
+    """
+    Applies migrations once per database, safely across gunicorn workers.
+
+    Each migration runs in its own transaction that first inserts its version
+    into `schema_migration`. The insert takes SQLite's write lock, so a second
+    worker starting at the same time waits, then sees the version and skips
+    it; a failed migration rolls back its claim and is retried on next start.
+    """
+
+    TABLE = 'schema_migration'
+
+    def __init__(self, engine, lock_timeout: int = 300):
+        self.engine = engine
+        self.lock_timeout = lock_timeout
+
+    def run(self, migrations: List[Migration]) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {self.TABLE} ("
+                "version VARCHAR(64) PRIMARY KEY, description TEXT, applied_at VARCHAR(50))"
+            ))
+        for migration in migrations:
+            self._apply(migration)
+
+    def _apply(self, migration: Migration) -> bool:
+        give_up_at = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                with self.engine.begin() as conn:
+                    applied = conn.execute(
+                        text(f"SELECT 1 FROM {self.TABLE} WHERE version = :version"),
+                        {'version': migration.version}
+                    ).first()
+                    if applied:
+                        return False
+
+                    logger.info(f"Applying migration {migration.version}: {migration.description}")
+                    started = time.monotonic()
+                    conn.execute(
+                        text(f"INSERT INTO {self.TABLE} (version, description, applied_at) "
+                             "VALUES (:version, :description, :applied_at)"),
+                        {
+                            'version': migration.version,
+                            'description': migration.description,
+                            'applied_at': datetime.datetime.utcnow().isoformat()
+                        }
+                    )
+                    migration.apply(conn)
+                logger.info(f"Migration {migration.version} applied in {time.monotonic() - started:.1f}s")
+                return True
+            except IntegrityError:
+                # Another worker claimed and committed it first
+                return False
+            except OperationalError as e:
+                if 'locked' not in str(e).lower() or time.monotonic() > give_up_at:
+                    raise
+                time.sleep(0.5)
@@ -0,0 +1,142 @@
+import logging
+import time
+from collections import deque
+from threading import Lock
+from typing import Dict, List, Optional
+
+from services.query_router import Route
+
+logger = logging.getLogger(__name__)
+
+
+class DegradationController:
+    """
+    Steps chat turns down to cheaper modes while upstream calls are slow or failing.
+
+    Completion latency and outcome are tracked over a rolling time window.
+    When p95 latency or the error rate crosses a level's threshold the
+    controller moves straight up to that level; it steps back down one level at
+    a time, only after conditions have stayed below 80% of the thresholds for
+    the recovery period. Levels are cumulative:
+
+        1  reduced_context  fewer history messages and orders in the prompt
+        2  no_retrieval     no azure_search data source
+        3  reduced_output   lower max_tokens
+        4  cached_only      only fast-path and cached answers, no LLM calls
+    """
+
+    LEVEL_NAMES = ['normal', 'reduced_context', 'no_retrieval', 'reduced_output', 'cached_only']
+    REDUCED_CONTEXT = 1
+    NO_RETRIEVAL = 2
+    REDUCED_OUTPUT = 3
+    CACHED_ONLY = 4
+
+    RECOVERY_MARGIN = 0.8
+
+    def __init__(self, p95_thresholds: List[float], error_rate_thresholds: List[float],
+                 window_seconds: int = 120, min_samples: int = 10, recovery_seconds: int = 60,
+                 enabled: bool = True):
+        if len(p95_thresholds) != self.CACHED_ONLY or len(error_rate_thresholds) != self.CACHED_ONLY:
+            raise ValueError(f"Degradation needs {self.CACHED_ONLY} latency and error-rate thresholds")
+        self.p95_thresholds = p95_thresholds
+        self.error_rate_thresholds = error_rate_thresholds
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.recovery_seconds = recovery_seconds
+        self.enabled = enabled
+
+        self.samples = deque()  # (recorded_at, latency_seconds, ok)
+        self.current_level = 0
+        self.level_since = time.monotonic()
+        self.calm_since = None
+        self.transitions = 0
+        self.lock = Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        """Record one upstream completion attempt."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.samples.append((time.monotonic(), latency, ok))
+
+    def _window(self, now: float):
+        cutoff = now - self.window_seconds
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        latencies = sorted(sample[1] for sample in self.samples)
+        count = len(latencies)
+        if not count:
+            return None, 0.0, 0
+        p95 = latencies[max(0, int(count * 0.95) - 1)]
+        error_rate = sum(1 for sample in self.samples if not sample[2]) / count
+        return p95, error_rate, count
+
+    def _target_level(self, p95: Optional[float], error_rate: float, count: int, margin: float = 1.0) -> int:
+        if count < self.min_samples:
+            return 0
+        level = 0
+        for index in range(self.CACHED_ONLY):
+            if p95 > self.p95_thresholds[index] * margin or error_rate > self.error_rate_thresholds[index] * margin:
+                level = index + 1
+        return level
+
+    def _set_level(self, level: int, now: float, p95: Optional[float], error_rate: float) -> None:
+        logger.warning(
+            f"Degradation level {self.current_level} ({self.LEVEL_NAMES[self.current_level]}) -> "
+            f"{level} ({self.LEVEL_NAMES[level]}); p95={p95}, error_rate={error_rate:.2f}"
+        )
+        self.current_level = level
+        self.level_since = now
+        self.calm_since = None
+        self.transitions += 1
+
+    def level(self) -> int:
+        """Evaluate the window and return the level to apply to the next turn."""
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            p95, error_rate, count = self._window(now)
+
+            target = self._target_level(p95, error_rate, count)
+            if target > self.current_level:
+                self._set_level(target, now, p95, error_rate)
+                return self.current_level
+
+            # Step down only once conditions are comfortably below the current level's thresholds
+            if self._target_level(p95, error_rate, count, self.RECOVERY_MARGIN) < self.current_level:
+                if self.calm_since is None:
+                    self.calm_since = now
+                elif now - self.calm_since >= self.recovery_seconds:
+                    self._set_level(self.current_level - 1, now, p95, error_rate)
+            else:
+                self.calm_since = None
+            return self.current_level
+
+    def apply(self, route: Route, level: int, max_tokens: int) -> Route:
+        """Return the route with retrieval and output limits adjusted for the level."""
+        if level < self.NO_RETRIEVAL:
+            return route
+        return Route(
+            route.name,
+            include_orders=route.include_orders,
+            use_retrieval=False,
+            max_tokens=min(route.max_tokens, max_tokens) if level >= self.REDUCED_OUTPUT else route.max_tokens,
+            top_n=0
+        )
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self.lock:
+            p95, error_rate, count = self._window(now)
+            return {
+                'enabled': self.enabled,
+                'level': self.current_level,
+                'level_name': self.LEVEL_NAMES[self.current_level],
+                'seconds_in_level': round(now - self.level_since),
+                'transitions': self.transitions,
+                'window_seconds': self.window_seconds,
+                'samples': count,
+                'latency_p95_ms': round(p95 * 1000) if p95 is not None else None,
+                'error_rate': round(error_rate, 4)
+            }
@@ -0,0 +1,224 @@
+import json
+import logging
+import random
+import time
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+from openai import APIConnectionError, APIStatusError, AzureOpenAI
+
+from services.token_scheduler import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class DeploymentUnavailable(Exception):
+    """Raised when every deployment in the pool is cooling down after failures."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"No Azure OpenAI deployment available for {retry_after:.1f}s")
+
+
+class Deployment:
+    """One Azure OpenAI deployment with its own client and health/latency state."""
+
+    def __init__(self, name: str, endpoint: str, api_key: str, api_version: str, deployment: str,
+                 weight: float = 1.0, tpm: int = 0, client=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.weight = weight
+        self.tpm = tpm
+        self.client = client or AzureOpenAI(
+            azure_endpoint=endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            max_retries=0  # failover and 429 backoff are handled by the pool and scheduler
+        )
+
+        self.ewma_latency = None
+        self.inflight = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+
+class DeploymentPool:
+    """
+    Routes Azure OpenAI calls across one or more deployments.
+
+    Deployments are chosen by weight or by lowest observed latency (an EWMA
+    scaled by in-flight calls). A 429, 5xx or connection failure puts the
+    deployment into a cooldown (Retry-After when given, otherwise exponential)
+    and the call fails over to the next healthy deployment.
+    """
+
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, deployments: List[Deployment], strategy: str = 'least_latency',
+                 cooldown_seconds: float = 30, max_cooldown_seconds: float = 300):
+        if not deployments:
+            raise ValueError("Deployment pool needs at least one deployment")
+        if strategy not in ('least_latency', 'weighted'):
+            raise ValueError(f"Unknown deployment routing strategy: {strategy}")
+        self.deployments = deployments
+        self.strategy = strategy
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.failovers = 0
+        self.lock = Lock()
+
+    @classmethod
+    def from_config(cls, config) -> 'DeploymentPool':
+        """
+        Build the pool from AZURE_OPENAI_DEPLOYMENTS (a JSON list), falling back
+        to the single AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_DEPLOYMENT pair.
+        """
+        if config.AZURE_OPENAI_DEPLOYMENTS:
+            entries = json.loads(config.AZURE_OPENAI_DEPLOYMENTS)
+        else:
+            entries = [{
+                'name': 'default',
+                'endpoint': config.AZURE_OPENAI_ENDPOINT,
+                'deployment': config.AZURE_OPENAI_DEPLOYMENT
+            }]
+
+        deployments = [
+            Deployment(
+                name=entry.get('name') or entry['deployment'],
+                endpoint=entry['endpoint'],
+                api_key=entry.get('api_key') or config.AZURE_OPENAI_KEY,
+                api_version=entry.get('api_version') or config.AZURE_OPENAI_API_VERSION,
+                deployment=entry['deployment'],
+                weight=float(entry.get('weight', 1.0)),
+                tpm=int(entry.get('tpm', 0))
+            )
+            for entry in entries
+        ]
+        return cls(
+            deployments,
+            strategy=config.AZURE_OPENAI_ROUTING,
+            cooldown_seconds=config.AZURE_OPENAI_FAILOVER_COOLDOWN_SECONDS
+        )
+
+    @property
+    def total_tpm(self) -> int:
+        """Combined TPM quota, or 0 if any deployment's quota is unknown."""
+        if any(d.tpm <= 0 for d in self.deployments):
+            return 0
+        return sum(d.tpm for d in self.deployments)
+
+    def model_signature(self) -> str:
+        return ",".join(sorted({d.deployment for d in self.deployments}))
+
+    def seconds_until_available(self) -> float:
+        now = time.monotonic()
+        with self.lock:
+            return max(0.0, min(d.cooldown_until for d in self.deployments) - now)
+
+    def _candidates(self) -> List[Deployment]:
+        """Healthy deployments in the order they should be tried."""
+        now = time.monotonic()
+        with self.lock:
+            healthy = [d for d in self.deployments if d.available(now)]
+            if self.strategy == 'weighted':
+                ordered = []
+                remaining = list(healthy)
+                while remaining:
+                    choice = random.choices(remaining, weights=[d.weight for d in remaining])[0]
+                    ordered.append(choice)
+                    remaining.remove(choice)
+                return ordered
+            # Unmeasured deployments sort first so each gets probed
+            return sorted(healthy, key=lambda d: (d.ewma_latency or 0.0) * (1 + d.inflight) / max(d.weight, 0.01))
+
+    def _record_success(self, deployment: Deployment, latency: float) -> None:
+        with self.lock:
+            deployment.inflight -= 1
+            deployment.requests += 1
+            deployment.consecutive_failures = 0
+            if deployment.ewma_latency is None:
+                deployment.ewma_latency = latency
+            else:
+                deployment.ewma_latency += self.EWMA_ALPHA * (latency - deployment.ewma_latency)
+
+    def _record_failure(self, deployment: Deployment, error: Exception) -> None:
+        with self.lock:
+            deployment.inflight -= 1
+            deployment.requests += 1
+            deployment.errors += 1
+            deployment.consecutive_failures += 1
+            cooldown = retry_after_seconds(error)
+            if cooldown is None:
+                cooldown = min(self.max_cooldown_seconds,
+                               self.cooldown_seconds * 2 ** (deployment.consecutive_failures - 1))
+            deployment.cooldown_until = time.monotonic() + cooldown
+        logger.warning(f"Azure OpenAI deployment '{deployment.name}' failed ({error}); cooling down for {cooldown:.1f}s")
+
+    @staticmethod
+    def is_failover_error(error: Exception) -> bool:
+        if isinstance(error, APIConnectionError):
+            return True
+        if isinstance(error, APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return False
+
+    def run(self, call: Callable[[Deployment], object]):
+        """
+        Invoke `call(deployment)` on the best deployment, failing over on 429/5xx.
+
+        Re-raises the last failover error if every healthy deployment failed,
+        and DeploymentUnavailable if all of them were already cooling down.
+        """
+        candidates = self._candidates()
+        if not candidates:
+            raise DeploymentUnavailable(self.seconds_until_available())
+
+        last_error = None
+        for attempt, deployment in enumerate(candidates):
+            if attempt:
+                with self.lock:
+                    self.failovers += 1
+                logger.info(f"Failing over to Azure OpenAI deployment '{deployment.name}'")
+
+            with self.lock:
+                deployment.inflight += 1
+            started = time.monotonic()
+            try:
+                result = call(deployment)
+            except Exception as e:
+                if not self.is_failover_error(e):
+                    with self.lock:
+                        deployment.inflight -= 1
+                    raise
+                self._record_failure(deployment, e)
+                last_error = e
+                continue
+            self._record_success(deployment, time.monotonic() - started)
+            return result
+
+        raise last_error
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'strategy': self.strategy,
+                'failovers': self.failovers,
+                'deployments': [{
+                    'name': d.name,
+                    'deployment': d.deployment,
+                    'weight': d.weight,
+                    'healthy': d.available(now),
+                    'cooldown_seconds': round(max(0.0, d.cooldown_until - now), 1),
+                    'ewma_latency_ms': round(d.ewma_latency * 1000) if d.ewma_latency is not None else None,
+                    'inflight': d.inflight,
+                    'requests': d.requests,
+                    'errors': d.errors
+                } for d in self.deployments]
+            }
@@ -11,17 +11,17 @@ import os
 import re
 import urllib.parse
 from typing import Dict, List, Optional
-from azure.storage.blob import BlobServiceClient
-from azure.identity import DefaultAzureCredential
-from openai import AzureOpenAI
 from opencensus.ext.azure import metrics_exporter
 from opencensus.stats import aggregation, measure, stats, view
 from opencensus.tags import tag_key, tag_map
 
+from services.azure_clients import azure_clients
+from services.deployment_pool import DeploymentPool
+
 
 def get_access_token(resource: str) -> str:
     """
-    Get an access token using DefaultAzureCredential.
+    Get an access token from the process-wide cached credential.
     Falls back to Azure CLI if necessary.
     
     Args:
@@ -31,9 +31,7 @@ def get_access_token(resource: str) -> str:
         str: The access token as a Bearer token.
     """
     try:
-        credential = DefaultAzureCredential()
-        token = credential.get_token(resource)
-        return f"Bearer {token.token}"
+        return azure_clients.bearer_token(resource)
     except Exception:
         print("[WARNING] DefaultAzureCredential failed, falling back to Azure CLI...")
         return get_cli_token(resource)
@@ -70,24 +68,19 @@ class EmailService:
     # Microsoft Graph API limit for direct file attachments
     MAX_ATTACHMENT_SIZE = 3 * 1024 * 1024  # 3MB
 
-    def __init__(self, config):
-        """Initialize EmailService with configuration."""
+    def __init__(self, config, deployment_pool: Optional[DeploymentPool] = None):
+        """Initialize EmailService with configuration and the shared Azure OpenAI deployment pool."""
         self.config = config
         self.graph_api_endpoint = "https://graph.microsoft.com/v1.0"
         
-        # Initialize OpenAI client
-        self.openai_client = AzureOpenAI(
-            azure_endpoint=config.AZURE_OPENAI_ENDPOINT,
-            api_key=config.AZURE_OPENAI_KEY,
-            api_version=config.AZURE_OPENAI_API_VERSION,
-        )
+        # Route email generation through the same deployments (and failover) as chat
+        self.deployment_pool = deployment_pool or DeploymentPool.from_config(config)
         
-        # Initialize blob service client
-        account_url = f"https://{config.AZURE_STORAGE_ACCOUNT}.blob.core.windows.net"
-        self.credential = DefaultAzureCredential()
-        self.blob_service_client = BlobServiceClient(account_url, self.credential)
-        self.container_client = self.blob_service_client.get_container_client(
-            config.AZURE_STORAGE_CONTAINER_NAME
+        # Shared blob clients and credential
+        self.credential = azure_clients.credential
+        self.blob_service_client = azure_clients.blob_service(config.AZURE_STORAGE_ACCOUNT)
+        self.container_client = azure_clients.container(
+            config.AZURE_STORAGE_ACCOUNT, config.AZURE_STORAGE_CONTAINER_NAME
         )
         
         # Get application's managed identity token for Graph API
@@ -118,14 +111,22 @@ class EmailService:
         # Register view
         stats.stats.view_manager.register_view(self.email_draft_view)
 
-    def generate_email_content(self, chat_session, citations: List[Dict]) -> Dict:
-        """Generate the final, approved email content."""
+    def generate_email_content(self, chat_history: List[Dict], sales_metadata: Dict, citations: List[Dict],
+                               timeout: Optional[float] = None) -> Dict:
+        """Generate the final, approved email content.
+
+        Args:
+            chat_history: Recent chat history entries the email is drafted from
+            sales_metadata: The session's sales rep metadata, used for the signature
+            citations: Citations to attach to the email
+            timeout: Optional upper bound in seconds for the completion call
+        """
         try:
             # Get the last few messages for context
-            approved_messages = chat_session.chat_history[-10:]
+            approved_messages = chat_history[-10:]
             
             # Extract sales rep details from metadata
-            sales_metadata = chat_session.sales_metadata
+            sales_metadata = sales_metadata or {}
             sales_rep_info = {
                 'name': sales_metadata.get('SalesRepID', 'Sales Representative'),
                 'title': sales_metadata.get('Title', 'Sales Representative'),
@@ -159,16 +160,18 @@ class EmailService:
                 user_prompt += f"{key}: {value}\n"
 
             # Generate content using OpenAI
-            response = self.openai_client.chat.completions.create(
-                model=self.config.AZURE_OPENAI_DEPLOYMENT,
+            request_options = {"timeout": timeout} if timeout is not None else {}
+            response = self.deployment_pool.run(lambda deployment: deployment.client.chat.completions.create(
+                model=deployment.deployment,
                 messages=[
                     {"role": "system", "content": self._get_email_system_prompt()},
                     {"role": "user", "content": user_prompt}
                 ],
                 temperature=0.5,
                 max_tokens=1000,
-                response_format={"type": "json_object"}
-            )
+                response_format={"type": "json_object"},
+                **request_options
+            ))
 
             # Parse the response
             email_content = json.loads(response.choices[0].message.content)
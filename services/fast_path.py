@@ -0,0 +1,178 @@
+import html
+import logging
+import re
+from threading import Lock
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Order, PO and delivery numbers are long digit runs (SAP pads some with zeros)
+IDENTIFIER_PATTERN = re.compile(r"\b\d{6,12}\b")
+
+# Plain English status lookups ("status of order 31130481?", "where is PO 4500012345")
+LOOKUP_PATTERN = re.compile(
+    r"\b(?:status|update|details|info|information|where\s+is|where's|look\s*up|lookup|check\s+on|"
+    r"show\s+me|pull\s+up|what's\s+happening\s+with|tracking)\b",
+    re.IGNORECASE
+)
+
+# Anything asking for reasoning, actions or aggregation goes to the LLM
+NEEDS_LLM_PATTERN = re.compile(
+    r"\b(?:why|email|draft|send|write|compare|recommend|should|escalate|expedite|cancel|change|"
+    r"all|every|list|summar\w*|trend\w*|forecast\w*|how\s+many|total|customers?\s+like|explain)\b",
+    re.IGNORECASE
+)
+
+TABLE_HEADER = (
+    "<tr><th>Order Number</th><th>Status</th><th>Quantity</th><th>Value</th>"
+    "<th>Customer Service Rep</th><th>Credit Hold Status</th></tr>"
+)
+
+
+def _normalize_identifier(value) -> Optional[str]:
+    """Compare identifiers without SAP zero padding or item/line suffixes (e.g. '31130481/3/1')."""
+    if value is None:
+        return None
+    value = str(value).split('/')[0].strip().lstrip('0')
+    return value if value.isdigit() else None
+
+
+def _cell(value) -> str:
+    if value is None or value == '':
+        return 'N/A'
+    return html.escape(str(value))
+
+
+def _format_value(value) -> str:
+    try:
+        return "${:,.2f}".format(float(value))
+    except (TypeError, ValueError):
+        return 'N/A'
+
+
+class FastPathEngine:
+    """
+    Answers plain order-status lookups from the rep's cached orders without an LLM call.
+
+    A question qualifies when it reads as a simple English lookup, names one or
+    more order, PO or delivery numbers, and every number resolves to exactly
+    one kind of identifier in the rep's orders. Anything else (unknown or
+    ambiguous numbers, requests for reasoning or actions, too many lines)
+    returns None so the turn falls through to the LLM.
+    """
+
+    def __init__(self, enabled: bool = True, max_rows: int = 10):
+        self.enabled = enabled
+        self.max_rows = max_rows
+        self.lock = Lock()
+        self.answered = 0
+        self.fallthrough = {}
+
+    def _fall_through(self, reason: str):
+        with self.lock:
+            self.fallthrough[reason] = self.fallthrough.get(reason, 0) + 1
+        logger.debug(f"Fast path declined: {reason}")
+        return None
+
+    def _resolve(self, identifier: str, orders: List[Dict]):
+        """Return (kind, matching order lines) for an identifier, or (None, []) if unknown or ambiguous."""
+        matches = {'order': [], 'purchase order': [], 'delivery': []}
+        for order in orders:
+            if _normalize_identifier(order.get('order_number')) == identifier:
+                matches['order'].append(order)
+            if _normalize_identifier((order.get('customer_info') or {}).get('purchase_order')) == identifier:
+                matches['purchase order'].append(order)
+            if _normalize_identifier(order.get('delivery_number')) == identifier:
+                matches['delivery'].append(order)
+
+        kinds = [kind for kind, lines in matches.items() if lines]
+        if len(kinds) != 1:
+            return None, []
+        return kinds[0], matches[kinds[0]]
+
+    def answer(self, question: str, sales_context: Optional[Dict]) -> Optional[Dict]:
+        """Build a complete answer for a status lookup, or None to use the LLM."""
+        if not self.enabled:
+            return None
+        if not question or len(question) > 200:
+            return self._fall_through('length')
+        orders = (sales_context or {}).get('orders') or []
+        if not orders:
+            return self._fall_through('no_orders')
+        if not LOOKUP_PATTERN.search(question) or NEEDS_LLM_PATTERN.search(question):
+            return self._fall_through('not_a_lookup')
+
+        identifiers = list(dict.fromkeys(
+            _normalize_identifier(match) for match in IDENTIFIER_PATTERN.findall(question)
+        ))
+        if not identifiers:
+            return self._fall_through('no_identifier')
+
+        resolved = []
+        for identifier in identifiers:
+            kind, lines = self._resolve(identifier, orders)
+            if kind is None:
+                return self._fall_through('unresolved_or_ambiguous')
+            resolved.append((identifier, kind, lines))
+
+        rows = [line for _, _, lines in resolved for line in lines]
+        if len(rows) > self.max_rows:
+            return self._fall_through('too_many_rows')
+
+        with self.lock:
+            self.answered += 1
+        return self._render(resolved, rows)
+
+    def _render(self, resolved, rows: List[Dict]) -> Dict:
+        table_rows = []
+        for order in rows:
+            credit_status = (order.get('credit_status') or {}).get('overall_status')
+            table_rows.append(
+                "<tr>"
+                f"<td>{_cell(order.get('order_number'))}</td>"
+                f"<td>{_cell(order.get('execution_status'))}</td>"
+                f"<td>{_cell(order.get('order_quantity'))}</td>"
+                f"<td>{_format_value(order.get('value_usd'))}</td>"
+                f"<td>{_cell((order.get('sales_team') or {}).get('customer_service_representative'))}</td>"
+                f"<td>{_cell(credit_status)}</td>"
+                "</tr>"
+            )
+        table = f"<table>{TABLE_HEADER}{''.join(table_rows)}</table>"
+
+        subjects = ", ".join(f"{kind} {identifier}" for identifier, kind, _ in resolved)
+        customers = sorted({(order.get('customer_info') or {}).get('sold_to') for order in rows} - {None, 'Unknown'})
+        intro = f"Here's the latest on {subjects}"
+        if len(customers) == 1:
+            intro += f" for {html.escape(str(customers[0]))}"
+        intro += ":"
+
+        line_word = "line" if len(rows) == 1 else "lines"
+        outro = (f"That's {len(rows)} order {line_word} from your current order data. "
+                 "Let me know if you'd like me to dig into delivery dates or draft a follow-up email.")
+
+        key_takeaways = [
+            f"{kind.capitalize()} {identifier}: {', '.join(sorted({str(o.get('execution_status') or 'Unknown') for o in lines}))}"
+            for identifier, kind, lines in resolved
+        ]
+        if len(customers) == 1:
+            key_takeaways.append(f"Customer: {customers[0]}")
+
+        return {
+            'response': f"{intro}\n\n{table}\n\n{outro}",
+            'citations': [],
+            'confidence_level': 10,
+            'product_category': "Order Information",
+            'focus_area': f"Order status lookup: {subjects}",
+            'detected_language': "EN",
+            'key_takeaways': key_takeaways
+        }
+
+    def stats(self) -> Dict:
+        with self.lock:
+            declined = sum(self.fallthrough.values())
+            return {
+                'enabled': self.enabled,
+                'answered': self.answered,
+                'fell_through': declined,
+                'fallthrough_reasons': dict(self.fallthrough)
+            }
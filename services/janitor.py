@@ -0,0 +1,82 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Janitor:
+    """
+    Runs a housekeeping task on a daemon thread every `interval_seconds`.
+
+    Every gunicorn worker runs its own janitor, so tasks must be safe to run
+    concurrently and repeatedly. The first run is delayed by a random share of
+    the interval so workers started together don't all run at the same moment.
+    The task returns the number of items it handled, which is kept for /metrics.
+    """
+
+    def __init__(self, name: str, task: Callable[[], int], interval_seconds: int):
+        self.name = name
+        self.task = task
+        self.interval_seconds = interval_seconds
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.last_handled = 0
+        self.total_handled = 0
+        self.last_duration = None
+        self.last_run_at = None
+
+    def start(self) -> None:
+        if self.interval_seconds <= 0:
+            logger.info(f"Janitor '{self.name}' disabled")
+            return
+        self.thread = threading.Thread(target=self._loop, name=f"janitor-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def _loop(self) -> None:
+        delay = random.uniform(0, self.interval_seconds)
+        while not self.stop_event.wait(delay):
+            self.run_once()
+            delay = self.interval_seconds
+
+    def run_once(self) -> int:
+        started = time.monotonic()
+        try:
+            handled = self.task() or 0
+        except Exception as e:
+            logger.error(f"Janitor '{self.name}' failed: {str(e)}")
+            with self.lock:
+                self.runs += 1
+                self.failures += 1
+            return 0
+
+        with self.lock:
+            self.runs += 1
+            self.last_handled = handled
+            self.total_handled += handled
+            self.last_duration = time.monotonic() - started
+            self.last_run_at = time.time()
+        if handled:
+            logger.info(f"Janitor '{self.name}' handled {handled} items in {self.last_duration:.2f}s")
+        return handled
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'interval_seconds': self.interval_seconds,
+                'running': bool(self.thread and self.thread.is_alive()),
+                'runs': self.runs,
+                'failures': self.failures,
+                'last_handled': self.last_handled,
+                'total_handled': self.total_handled,
+                'last_duration_ms': round(self.last_duration * 1000) if self.last_duration is not None else None,
+                'seconds_since_last_run': round(time.time() - self.last_run_at) if self.last_run_at else None
+            }
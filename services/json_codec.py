@@ -0,0 +1,116 @@
+import json
+import logging
+import zlib
+from threading import Lock
+from typing import Dict, Optional, Union
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # Optional: pip install zstandard
+    zstandard = None
+
+# First byte of a stored value. Plain JSON text never starts with a control byte,
+# so values written before compression existed (and small ones) decode unchanged.
+ZLIB_VERSION = 0x01
+ZSTD_VERSION = 0x02
+
+
+class JSONCodec:
+    """
+    Encodes JSON column values, compressing those of at least `min_bytes`.
+
+    Stored layout: plain UTF-8 JSON, or a version byte followed by the
+    compressed JSON (0x01 zlib, 0x02 zstd). Decoding accepts all three as well
+    as the str values SQLite returns for rows written as JSON text, so a
+    database can hold a mix while it's being migrated.
+    """
+
+    def __init__(self, codec: str = 'zlib', min_bytes: int = 1024, level: int = 6):
+        self.lock = Lock()
+        self.configure(codec, min_bytes, level)
+        self.encoded = 0
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def configure(self, codec: str = 'zlib', min_bytes: int = 1024, level: int = 6) -> None:
+        codec = codec.lower()
+        if codec == 'zstd' and zstandard is None:
+            logger.warning("zstd JSON compression requested but zstandard isn't installed; using zlib")
+            codec = 'zlib'
+        if codec not in ('zlib', 'zstd', 'none'):
+            raise ValueError(f"Unsupported JSON compression codec: {codec}")
+        self.codec = codec
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def encode(self, value) -> Optional[bytes]:
+        if value is None:
+            return None
+        raw = json.dumps(value, separators=(',', ':'), default=str).encode('utf-8')
+        stored = raw
+        if self.codec != 'none' and len(raw) >= self.min_bytes:
+            if self.codec == 'zstd':
+                stored = bytes([ZSTD_VERSION]) + zstandard.ZstdCompressor(level=self.level).compress(raw)
+            else:
+                stored = bytes([ZLIB_VERSION]) + zlib.compress(raw, self.level)
+            if len(stored) >= len(raw):
+                stored = raw  # Incompressible; not worth the decode cost
+        with self.lock:
+            self.encoded += 1
+            self.compressed += stored is not raw
+            self.bytes_in += len(raw)
+            self.bytes_out += len(stored)
+        return stored
+
+    def decode(self, stored: Union[bytes, str, None]):
+        if stored is None:
+            return None
+        if isinstance(stored, str):
+            return json.loads(stored)
+        stored = bytes(stored)
+        if not stored:
+            return None
+        if stored[0] == ZLIB_VERSION:
+            return json.loads(zlib.decompress(stored[1:]))
+        if stored[0] == ZSTD_VERSION:
+            if zstandard is None:
+                raise RuntimeError("Value is zstd-compressed but zstandard isn't installed")
+            return json.loads(zstandard.ZstdDecompressor().decompress(stored[1:]))
+        return json.loads(stored)
+
+    @staticmethod
+    def is_compressed(stored: Union[bytes, str, None]) -> bool:
+        return isinstance(stored, (bytes, memoryview)) and len(stored) > 0 and bytes(stored[:1])[0] in (
+            ZLIB_VERSION, ZSTD_VERSION)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'codec': self.codec,
+                'min_bytes': self.min_bytes,
+                'values_encoded': self.encoded,
+                'values_compressed': self.compressed,
+                'compression_ratio': round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None
+            }
+
+
+# Shared by every CompressedJSON column; the app configures it from Config at startup
+json_codec = JSONCodec()
+
+
+class CompressedJSON(TypeDecorator):
+    """JSON column stored through `json_codec`; reads plain JSON text written by the JSON type too."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return json_codec.encode(value)
+
+    def process_result_value(self, value, dialect):
+        return json_codec.decode(value)
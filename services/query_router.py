@@ -0,0 +1,132 @@
+import logging
+import re
+from collections import deque
+from threading import Lock
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Questions about the rep's own orders, deliveries and accounts: answered from the
+# sales context in the system prompt, no document retrieval needed.
+ORDER_PATTERN = re.compile(
+    r"\b(?:orders?|po|pos|purchase\s+orders?|deliver(?:y|ies)|shipments?|shipped|ship\s+date|"
+    r"invoices?|backlog|blocked|credit\s+hold|on\s+hold|open\s+quantity|open\s+qty|"
+    r"status|eta|late|delayed|overdue|my\s+customers?|customers?|accounts?|territory|quota|"
+    r"sold[\s-]to|ship[\s-]to|sales\s+org|plant)\b|\b\d{6,}\b",
+    re.IGNORECASE
+)
+
+# Product knowledge questions: answered from the document index. Built from the
+# Sealed Air lines the assistant covers (the product_category values in the
+# system prompt) and the packaging materials and equipment they are sold as.
+PRODUCT_PATTERN = re.compile(
+    r"\b(?:instapak|autobag|cryovac|bubble\s*wrap|jiffy|korrvu|fill[\s-]?air|stealth|darfresh|tempguard|"
+    r"shrink(?:\s+(?:films?|bags?|wrap|solutions?))?|foam(?:[\s-]in[\s-]place)?|bubble|mailers?|cushion(?:ing)?|"
+    r"void[\s-]?fill|inflatables?|air\s+pillows?|paper\s+packaging|films?|vacuum\s+(?:bags?|packaging)|"
+    r"barrier|trays?|bagg(?:er|ers|ing)|machines?|equipment|packaging\s+(?:solutions?|materials?|systems?)|"
+    r"products?|specs?|specifications?|datasheets?|data\s+sheets?|sds|msds|brochures?|catalog(?:ue)?|"
+    r"materials?|sizes?|sizing|thickness|gauge|features?|benefits?|certifications?|certified|food[\s-]safe|"
+    r"recyclable|recycled|sustainab(?:le|ility)|compostable|"
+    r"recommend|alternatives?|compare|comparison|vs\.?|versus|difference|equivalent|replacement)\b",
+    re.IGNORECASE
+)
+
+
+class Route:
+    """How a turn is answered: which sales context and retrieval it gets, and its budgets."""
+
+    def __init__(self, name: str, include_orders: bool, use_retrieval: bool, max_tokens: int, top_n: int = 0):
+        self.name = name
+        self.include_orders = include_orders
+        self.use_retrieval = use_retrieval
+        self.max_tokens = max_tokens
+        self.top_n = top_n
+
+
+class RouteMetrics:
+    """Rolling latency and token usage for one route."""
+
+    SAMPLES = 500
+
+    def __init__(self):
+        self.requests = 0
+        self.latencies = deque(maxlen=self.SAMPLES)
+        self.prompt_tokens = deque(maxlen=self.SAMPLES)
+        self.completion_tokens = deque(maxlen=self.SAMPLES)
+
+    def stats(self) -> Dict:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'requests': self.requests,
+            'latency_p50_ms': round(latencies[count // 2] * 1000) if count else None,
+            'latency_p95_ms': round(latencies[max(0, int(count * 0.95) - 1)] * 1000) if count else None,
+            'avg_prompt_tokens': round(sum(self.prompt_tokens) / count) if count else None,
+            'avg_completion_tokens': round(sum(self.completion_tokens) / count) if count else None
+        }
+
+
+class QueryRouter:
+    """
+    Local, rule-based routing of chat turns.
+
+    Each non-food turn is classified from its text as an order question (sales
+    context only), a product question (retrieval plus a minimal sales summary)
+    or mixed (both). Anything unclear, and any turn with an image, is treated
+    as mixed so it gets the same context as before routing existed.
+    """
+
+    ORDER = 'order'
+    PRODUCT = 'product'
+    MIXED = 'mixed'
+    FOOD = 'food'
+
+    def __init__(self, routes: Dict[str, Route], enabled: bool = True):
+        self.routes = routes
+        self.enabled = enabled
+        self.metrics = {name: RouteMetrics() for name in routes}
+        self.lock = Lock()
+
+    def classify(self, question: str, has_image: bool = False) -> str:
+        if not self.enabled or has_image or not question:
+            return self.MIXED
+
+        order_hits = len(ORDER_PATTERN.findall(question))
+        product_hits = len(PRODUCT_PATTERN.findall(question))
+        if order_hits and not product_hits:
+            return self.ORDER
+        if product_hits and not order_hits:
+            return self.PRODUCT
+        return self.MIXED
+
+    def route(self, question: str, has_image: bool = False, is_food_route: bool = False) -> Route:
+        if is_food_route:
+            name = self.FOOD
+        else:
+            name = self.classify(question, has_image)
+        logger.debug(f"Query routed to '{name}'")
+        return self.routes[name]
+
+    def record(self, route_name: str, latency: float, prompt_tokens: Optional[int] = None,
+               completion_tokens: Optional[int] = None) -> None:
+        """Record one completion served on a route."""
+        with self.lock:
+            metrics = self.metrics[route_name]
+            metrics.requests += 1
+            metrics.latencies.append(latency)
+            metrics.prompt_tokens.append(prompt_tokens or 0)
+            metrics.completion_tokens.append(completion_tokens or 0)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'routes': {
+                    name: {
+                        **self.metrics[name].stats(),
+                        'max_tokens': route.max_tokens,
+                        'top_n_documents': route.top_n if route.use_retrieval else 0
+                    }
+                    for name, route in self.routes.items()
+                }
+            }
@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from threading import Event, Lock
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Client-generated request ids are UUIDs; anything else is rejected before it
+# is used to build a marker file name.
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9-]{8,64}$')
+
+
+class RequestCancelled(Exception):
+    """Raised when a request was abandoned by the client or ran past its deadline."""
+
+    def __init__(self, reason: str, stage: str = ""):
+        self.reason = reason
+        self.stage = stage
+        super().__init__(f"Request cancelled ({reason}) during {stage or 'processing'}")
+
+
+class Deadline:
+    """A monotonic per-request time budget."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def timeout(self, cap: Optional[float] = None, floor: float = 1.0) -> float:
+        """Timeout for the next upstream call: the remaining budget, optionally capped."""
+        remaining = self.remaining()
+        if cap is not None:
+            remaining = min(remaining, cap)
+        return max(floor, remaining)
+
+
+class CancelToken:
+    """
+    Cancellation signal for one in-flight request.
+
+    A token is cancelled either in-process (same worker received the cancel
+    call) or through a marker file, which lets another gunicorn worker on the
+    same instance cancel it. Marker checks are rate limited so the token can be
+    polled between streamed chunks.
+    """
+
+    MARKER_POLL_INTERVAL = 0.25
+
+    def __init__(self, key: str, marker_path: Optional[str] = None, deadline: Optional[Deadline] = None):
+        self.key = key
+        self.marker_path = marker_path
+        self.deadline = deadline
+        self.event = Event()
+        self.reason = None
+        self._last_marker_check = float('-inf')
+
+    def cancel(self, reason: str = "client") -> None:
+        self.reason = self.reason or reason
+        self.event.set()
+
+    @property
+    def abandoned(self) -> bool:
+        """True once the client asked for this request to be cancelled."""
+        if self.event.is_set():
+            return self.reason != "deadline"
+        if self.marker_path:
+            now = time.monotonic()
+            if now - self._last_marker_check >= self.MARKER_POLL_INTERVAL:
+                self._last_marker_check = now
+                if os.path.exists(self.marker_path):
+                    self.cancel("client")
+                    return True
+        return False
+
+    @property
+    def cancelled(self) -> bool:
+        """True if the client abandoned the request or its deadline has passed."""
+        if self.abandoned or self.event.is_set():
+            return True
+        if self.deadline is not None and self.deadline.expired():
+            self.cancel("deadline")
+            return True
+        return False
+
+    def raise_if_cancelled(self, stage: str = "") -> None:
+        if self.cancelled:
+            raise RequestCancelled(self.reason, stage)
+
+
+class InflightRegistry:
+    """
+    Tracks in-flight /message requests so a client can cancel them.
+
+    Each registered request also leaves a `<key>.inflight` file in the shared
+    marker directory, so a cancel that reaches another worker on the instance
+    can tell a live request (and write its cancel marker) from an unknown id.
+    Keys include the caller's principal, so one user never matches another
+    user's requests.
+    """
+
+    def __init__(self, marker_dir: Optional[str] = None, marker_ttl: int = 3600):
+        self.marker_dir = marker_dir or os.path.join(tempfile.gettempdir(), 'salesagent-cancel')
+        self.marker_ttl = marker_ttl
+        self.tokens = {}
+        self.lock = Lock()
+        self.cancel_requests = 0
+        self.unmatched = 0
+        os.makedirs(self.marker_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(user_id: str, request_id: Optional[str]) -> Optional[str]:
+        """Scope request ids to the user so one user cannot cancel another's request."""
+        if not user_id or not request_id or not REQUEST_ID_PATTERN.match(request_id):
+            return None
+        return hashlib.sha256(f"{user_id}:{request_id}".encode('utf-8')).hexdigest()
+
+    def _marker_path(self, key: str) -> str:
+        return os.path.join(self.marker_dir, key)
+
+    def _inflight_path(self, key: str) -> str:
+        return os.path.join(self.marker_dir, f"{key}.inflight")
+
+    def register(self, user_id: str, request_id: Optional[str], deadline: Optional[Deadline] = None) -> CancelToken:
+        key = self.make_key(user_id, request_id)
+        if key is None:
+            # No client request id: the request can still hit its deadline
+            return CancelToken(key="", deadline=deadline)
+
+        token = CancelToken(key, marker_path=self._marker_path(key), deadline=deadline)
+        with self.lock:
+            self.tokens[key] = token
+        try:
+            open(self._inflight_path(key), 'w').close()
+        except OSError as e:
+            logger.warning(f"Failed to write in-flight marker, cancels from other workers won't reach it: {e}")
+        return token
+
+    def unregister(self, token: CancelToken) -> None:
+        if not token.key:
+            return
+        with self.lock:
+            if self.tokens.get(token.key) is not token:
+                return  # The same request id was registered again since
+            del self.tokens[token.key]
+        for path in (self._inflight_path(token.key), self._marker_path(token.key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def cancel(self, user_id: str, request_id: str) -> bool:
+        """
+        Cancel one of the user's requests, locally if this worker owns it,
+        otherwise via a marker file; False if no such request is in flight.
+        """
+        key = self.make_key(user_id, request_id)
+        if key is None:
+            return False
+
+        with self.lock:
+            token = self.tokens.get(key)
+            self.cancel_requests += 1
+        if token is not None:
+            token.cancel("client")
+            return True
+
+        if not os.path.exists(self._inflight_path(key)):
+            with self.lock:
+                self.unmatched += 1
+            return False
+        try:
+            with open(self._marker_path(key), 'w') as marker:
+                marker.write(str(time.time()))
+        except OSError as e:
+            logger.warning(f"Failed to write cancel marker: {e}")
+            return False
+        self._sweep_markers()
+        return True
+
+    def _sweep_markers(self) -> None:
+        """Remove stale markers left by requests that finished on another worker."""
+        cutoff = time.time() - self.marker_ttl
+        try:
+            for entry in os.scandir(self.marker_dir):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'inflight': len(self.tokens),
+                'cancel_requests': self.cancel_requests,
+                'unmatched_cancels': self.unmatched
+            }
@@ -0,0 +1,104 @@
+import contextvars
+import hashlib
+import logging
+import os
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach): growing from N to N+1 buckets moves only 1/(N+1) of the keys."""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+class ShardRouter:
+    """
+    Assigns each user's chat data to one of `shard_count` SQLite files.
+
+    A user's shard is a stable hash of their user_id, so all of their sessions,
+    messages and snapshots live in one file and different users' writes take
+    different write locks. Shard 0 is the original database file, which makes
+    a single shard the unsharded layout. Changing the shard count moves users
+    between files; run scripts/reshard_sessions.py with the app stopped.
+
+    The shard used by the ORM session is held in a context variable, selected
+    per request from the signed-in user (`select`) or by background tasks for
+    the shard they are working on (`use`, `for_each_shard`).
+    """
+
+    def __init__(self, db_dir: str, base_name: str = 'chat_sessions', shard_count: int = 1):
+        if shard_count < 1:
+            raise ValueError(f"Shard count must be at least 1, got {shard_count}")
+        self.db_dir = db_dir
+        self.base_name = base_name
+        self.shard_count = shard_count
+        self.current_shard = contextvars.ContextVar('chat_shard', default=0)
+        self.lock = Lock()
+        self.routed = [0] * shard_count
+
+    def shard_for(self, user_id: Optional[str]) -> int:
+        if self.shard_count == 1 or not user_id:
+            return 0
+        digest = hashlib.sha256(user_id.encode('utf-8')).digest()
+        return jump_hash(int.from_bytes(digest[:8], 'big'), self.shard_count)
+
+    def path(self, shard: int) -> str:
+        name = self.base_name if shard == 0 else f"{self.base_name}_shard{shard}"
+        return os.path.join(self.db_dir, f"{name}.db")
+
+    def bind_key(self, shard: int) -> Optional[str]:
+        """Flask-SQLAlchemy bind key of a shard; shard 0 is the default bind."""
+        return None if shard == 0 else f"shard{shard}"
+
+    def binds(self) -> Dict[str, str]:
+        """SQLALCHEMY_BINDS entries for the shards other than 0."""
+        return {self.bind_key(shard): f"sqlite:///{self.path(shard)}" for shard in range(1, self.shard_count)}
+
+    def shards(self) -> range:
+        return range(self.shard_count)
+
+    def current(self) -> int:
+        return self.current_shard.get()
+
+    def select(self, user_id: Optional[str]) -> contextvars.Token:
+        """Route this request's queries to the user's shard; pass the token to `reset` when it ends."""
+        shard = self.shard_for(user_id)
+        with self.lock:
+            self.routed[shard] += 1
+        return self.current_shard.set(shard)
+
+    def reset(self, token: contextvars.Token) -> None:
+        self.current_shard.reset(token)
+
+    @contextmanager
+    def use(self, shard: int) -> Iterator[int]:
+        token = self.current_shard.set(shard)
+        try:
+            yield shard
+        finally:
+            self.current_shard.reset(token)
+
+    def for_each_shard(self, task: Callable[[], int]) -> Callable[[], int]:
+        """Wrap a janitor task to run once per shard; returns the total handled."""
+        def run_all() -> int:
+            handled = 0
+            for shard in self.shards():
+                with self.use(shard):
+                    handled += task() or 0
+            return handled
+        return run_all
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'shard_count': self.shard_count,
+                'requests_routed': list(self.routed)
+            }
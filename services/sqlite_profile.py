@@ -0,0 +1,82 @@
+import logging
+import sqlite3
+from typing import Dict
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+class SQLiteProfile:
+    """
+    Connection settings for the chat database, applied to every pooled connection.
+
+    The defaults suit several gunicorn workers sharing one database file:
+    WAL lets readers run alongside the single writer, synchronous=NORMAL only
+    fsyncs at checkpoints (safe in WAL; a power loss can drop the last few
+    commits but never corrupts the file), busy_timeout makes writers wait for
+    the lock instead of failing with "database is locked", and mmap_size
+    serves reads from the page cache without copying.
+    """
+
+    def __init__(self, journal_mode: str = 'WAL', synchronous: str = 'NORMAL', mmap_size: int = 268435456,
+                 busy_timeout_ms: int = 5000, cache_size_kb: int = 20000, pool_size: int = 10,
+                 max_overflow: int = 20):
+        self.journal_mode = journal_mode.upper()
+        self.synchronous = synchronous.upper()
+        if self.journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Unsupported SQLite journal mode: {journal_mode}")
+        if self.synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unsupported SQLite synchronous mode: {synchronous}")
+        self.mmap_size = mmap_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+
+    def engine_options(self) -> Dict:
+        """SQLALCHEMY_ENGINE_OPTIONS for Flask-SQLAlchemy."""
+        return {
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'pool_pre_ping': False,  # Local file; a dead connection isn't a failure mode here
+            'connect_args': {
+                'timeout': self.busy_timeout_ms / 1000,
+                'check_same_thread': False  # Pooled connections move between gthread workers' threads
+            }
+        }
+
+    def install(self, engine) -> None:
+        """Apply the pragmas to each new connection of the engine."""
+        event.listen(engine, 'connect', self._on_connect)
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            mode = cursor.fetchone()[0]
+            if mode.upper() != self.journal_mode:
+                logger.warning(f"SQLite journal_mode {self.journal_mode} not applied (got {mode})")
+            cursor.execute(f"PRAGMA synchronous={self.synchronous}")
+            cursor.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            cursor.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            cursor.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")  # Negative means KiB
+            cursor.execute("PRAGMA temp_store=MEMORY")
+        finally:
+            cursor.close()
+
+    def stats(self) -> Dict:
+        return {
+            'journal_mode': self.journal_mode,
+            'synchronous': self.synchronous,
+            'mmap_size': self.mmap_size,
+            'busy_timeout_ms': self.busy_timeout_ms,
+            'cache_size_kb': self.cache_size_kb,
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow
+        }
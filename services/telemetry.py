@@ -0,0 +1,450 @@
+import datetime
+import fcntl
+import glob
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Largest block a single Append Block call accepts, and most blocks an append blob can hold
+MAX_APPEND_BLOCK_BYTES = 4 * 1024 * 1024
+MAX_APPEND_BLOB_BLOCKS = 50000
+
+# What became of a chunk of records handed to TelemetryWriter._append
+APPENDED, SPOOLED, DROPPED = 'appended', 'spooled', 'dropped'
+
+
+def hourly_partition(prefix: str, when: datetime.datetime) -> str:
+    """Blob path prefix of the UTC hour a record belongs to, e.g. chats/2024/05/01/13."""
+    return f"{prefix}/{when.year}/{when.month:02d}/{when.day:02d}/{when.hour:02d}"
+
+
+class TelemetryWriter:
+    """
+    Ships JSONL telemetry records to blob storage from a background thread.
+
+    `log(stream, record)` serializes the record and puts it on a bounded queue
+    without blocking the request. The thread collects records for up to
+    `flush_interval_seconds` (or `max_batch_records`) after the first one
+    arrives and writes each stream's records as one JSONL payload through
+    `append(stream, data)`, split at the append block limit. A failed append
+    is retried with backoff; after `max_attempts` its records are dropped and
+    counted. When the queue is full new records are dropped and counted too,
+    so a slow storage account never slows down requests.
+
+    With a `spool`, records are written to local disk instead of being
+    dropped. After a failed append the writer spools everything for
+    `spool_retry_seconds` without trying the storage account, then tries
+    again. While appends succeed it drains spooled segments, including ones
+    left by earlier processes, one per loop.
+
+    With `enabled=False`, `log` appends each record synchronously.
+    `close()` flushes what is still queued; register it to run at exit.
+    """
+
+    def __init__(self, append: Callable[[str, bytes], None], flush_interval_seconds: float = 5.0,
+                 max_queue: int = 10000, max_batch_records: int = 1000, max_attempts: int = 3,
+                 enabled: bool = True, spool: Optional['TelemetrySpool'] = None, spool_retry_seconds: float = 30.0):
+        self.append = append
+        self.spool = spool
+        self.spool_retry_seconds = spool_retry_seconds
+        self.retry_at = 0.0  # Spool without trying the storage account until then
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_batch_records = max_batch_records
+        self.max_attempts = max_attempts
+        self.enabled = enabled
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+        self.logged = 0
+        self.written = 0
+        self.appends = 0
+        self.bytes_written = 0
+        self.retries = 0
+        self.dropped_full = 0
+        self.dropped_failed = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.lags = deque(maxlen=500)
+        self.append_times = deque(maxlen=500)
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        self.thread = threading.Thread(target=self._loop, name='telemetry-writer', daemon=True)
+        self.thread.start()
+
+    def log(self, stream: str, record: Dict) -> bool:
+        """Queue a record for `stream`; False if it was dropped (or, when disabled, not written)."""
+        entry = (stream, (json.dumps(record) + "\n").encode('utf-8'), time.monotonic())
+        if not self.enabled:
+            return self._flush([entry])
+        if self.stop_event.is_set():
+            return False
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            if self._spool(stream, [entry[1:]]):
+                return True
+            with self.lock:
+                self.dropped_full += 1
+            logger.warning(f"Telemetry queue full, dropping a '{stream}' record")
+            return False
+        with self.lock:
+            self.logged += 1
+        return True
+
+    def _collect(self) -> List:
+        """Wait for a record, then gather more until the flush interval has passed or the batch is full."""
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval_seconds
+        while len(batch) < self.max_batch_records:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.stop_event.is_set():
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self) -> List:
+        batch = []
+        try:
+            while len(batch) < self.max_batch_records:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _loop(self) -> None:
+        while not self.stop_event.is_set():
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+            if self.spool is not None and time.monotonic() >= self.retry_at:
+                self._replay_segment()
+
+    def _spool(self, stream: str, chunk: List) -> bool:
+        """Write (line, queued_at) pairs to the spool; False without a spool or when it is full."""
+        if self.spool is None:
+            return False
+        try:
+            if not self.spool.write([(stream, line) for line, _ in chunk]):
+                logger.error(f"Telemetry spool full, can't keep {len(chunk)} '{stream}' records")
+                return False
+        except OSError as e:
+            logger.error(f"Telemetry spool write failed: {str(e)}")
+            return False
+        with self.lock:
+            self.spooled += len(chunk)
+        return True
+
+    def _replay_segment(self) -> None:
+        """Append the records of one spooled segment; ones that fail go back to the spool."""
+        try:
+            self.spool.seal()
+            path = self.spool.claim()
+            if path is None:
+                return
+            streams = {}
+            for stream, line in self.spool.read(path):
+                streams.setdefault(stream, []).append((line, None))
+        except OSError as e:
+            logger.error(f"Telemetry spool read failed: {str(e)}")
+            return
+        outcomes = {APPENDED: 0, SPOOLED: 0, DROPPED: 0}
+        for stream, entries in streams.items():
+            for chunk in self._chunks(entries):
+                outcomes[self._append(stream, chunk)] += len(chunk)
+        self.spool.remove(path)
+        with self.lock:
+            self.replayed += outcomes[APPENDED]
+        logger.info(f"Replayed {outcomes[APPENDED]} spooled telemetry records from {os.path.basename(path)} "
+                    f"({outcomes[SPOOLED]} spooled again, {outcomes[DROPPED]} dropped)")
+
+    def _flush(self, batch: List) -> bool:
+        """Append each stream's records in as few blocks as possible; False if any were dropped."""
+        streams = {}
+        for stream, line, queued_at in batch:
+            streams.setdefault(stream, []).append((line, queued_at))
+        ok = True
+        for stream, entries in streams.items():
+            for chunk in self._chunks(entries):
+                ok = self._append(stream, chunk) != DROPPED and ok
+        return ok
+
+    @staticmethod
+    def _chunks(entries: List) -> List:
+        """Split (line, queued_at) pairs at the append block limit."""
+        chunks, chunk, size = [], [], 0
+        for line, queued_at in entries:
+            if chunk and size + len(line) > MAX_APPEND_BLOCK_BYTES:
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append((line, queued_at))
+            size += len(line)
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _append(self, stream: str, chunk: List) -> str:
+        """
+        Append a chunk, retrying; when it fails for good it is spooled if possible,
+        else dropped. Returns APPENDED, SPOOLED or DROPPED.
+        """
+        if time.monotonic() < self.retry_at and self._spool(stream, chunk):
+            return SPOOLED  # Storage failed recently; don't make every batch wait on it
+        data = b''.join(line for line, _ in chunk)
+        for attempt in range(1, self.max_attempts + 1):
+            started = time.monotonic()
+            try:
+                self.append(stream, data)
+                now = time.monotonic()
+                with self.lock:
+                    self.appends += 1
+                    self.written += len(chunk)
+                    self.bytes_written += len(data)
+                    self.append_times.append(now - started)
+                    self.lags.extend(now - queued_at for _, queued_at in chunk if queued_at is not None)
+                return APPENDED
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    if self.spool is not None:
+                        self.retry_at = time.monotonic() + self.spool_retry_seconds
+                    if self._spool(stream, chunk):
+                        logger.warning(f"Spooled {len(chunk)} '{stream}' telemetry records after {attempt} "
+                                       f"failed attempts: {str(e)}")
+                        return SPOOLED
+                    logger.error(f"Dropping {len(chunk)} '{stream}' telemetry records after {attempt} attempts: {str(e)}")
+                    with self.lock:
+                        self.dropped_failed += len(chunk)
+                    return DROPPED
+                with self.lock:
+                    self.retries += 1
+                logger.warning(f"Telemetry append to '{stream}' failed (attempt {attempt}), retrying: {str(e)}")
+                time.sleep(0.5 * 2 ** attempt)
+        return DROPPED
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Stop the thread and flush everything still queued."""
+        if not self.enabled or self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            batch = self._drain()
+            if not batch:
+                break
+            self._flush(batch)
+        if self.spool is not None:
+            self.spool.close()
+        logger.info(f"Telemetry writer closed; {self.queue.qsize()} records left unwritten")
+
+    def stats(self) -> Dict:
+        spool_stats = self.spool.stats() if self.spool is not None else None
+        with self.lock:
+            lags = sorted(self.lags)
+            append_times = sorted(self.append_times)
+            return {
+                'enabled': self.enabled,
+                'queue_depth': self.queue.qsize(),
+                'logged': self.logged,
+                'written': self.written,
+                'appends': self.appends,
+                'bytes_written': self.bytes_written,
+                'retries': self.retries,
+                'dropped_full': self.dropped_full,
+                'dropped_failed': self.dropped_failed,
+                'spooled': self.spooled,
+                'replayed': self.replayed,
+                'spool': spool_stats,
+                'lag_p50_ms': round(lags[len(lags) // 2] * 1000) if lags else None,
+                'lag_p95_ms': round(lags[max(0, int(len(lags) * 0.95) - 1)] * 1000) if lags else None,
+                'append_p50_ms': round(append_times[len(append_times) // 2] * 1000) if append_times else None
+            }
+
+
+class HourlyBlobNames:
+    """
+    Names telemetry append blobs so each worker writes one blob per stream per hour.
+
+    Records are logged under their hour's partition (`hourly_partition`) and
+    the writer appends a partition's batch to `<partition>/<log name>_<host>-<pid>.jsonl`.
+    Only that worker appends to the blob, and it counts its blocks: at the
+    append blob block limit, or when storage reports the limit was reached
+    (a blob left by an earlier process with the same pid), `roll` moves the
+    partition on to `_1`, `_2`, ...
+    """
+
+    def __init__(self, max_blocks: int = MAX_APPEND_BLOB_BLOCKS, max_partitions: int = 64):
+        self.host = socket.gethostname()
+        self.max_blocks = max_blocks
+        self.max_partitions = max_partitions
+        self.lock = threading.Lock()
+        self.blobs = {}  # partition -> [roll index, blocks appended]
+        self.rolls = 0
+
+    def _entry(self, partition: str) -> List:
+        if partition not in self.blobs:
+            if len(self.blobs) >= self.max_partitions:
+                del self.blobs[next(iter(self.blobs))]  # Oldest partition; its hour is over
+            self.blobs[partition] = [0, 0]
+        return self.blobs[partition]
+
+    def blob_name(self, partition: str, log_name: str) -> str:
+        with self.lock:
+            entry = self._entry(partition)
+            if entry[1] >= self.max_blocks:
+                entry[0], entry[1] = entry[0] + 1, 0
+                self.rolls += 1
+            suffix = f"_{entry[0]}" if entry[0] else ""
+        return f"{partition}/{log_name}_{self.host}-{os.getpid()}{suffix}.jsonl"
+
+    def appended(self, partition: str) -> None:
+        with self.lock:
+            self._entry(partition)[1] += 1
+
+    def roll(self, partition: str) -> None:
+        """The current blob is full; the next name for this partition is a new blob."""
+        with self.lock:
+            self._entry(partition)[1] = self.max_blocks
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'open_blobs': len(self.blobs),
+                'rolls': self.rolls
+            }
+
+
+class TelemetrySpool:
+    """
+    Append-only segment files holding telemetry records that couldn't be sent yet.
+
+    Each worker appends to its own open segment (`<pid>-<time>-<n>.open`),
+    holding an exclusive flock on it, and seals it (renames it to `.seg`) when
+    it reaches `segment_bytes` or when the writer is ready to drain it. Any
+    worker can drain a segment: it takes the flock, renames the file to
+    `.drain` and deletes it once its records are appended. An `.open` or
+    `.drain` file whose flock is free was left by a worker that exited, so it
+    is drained the same way and records survive restarts. Writes that would
+    take the spool past `max_bytes` are refused.
+
+    A line is `<stream><tab><JSON record>`; a torn last line from a crash is skipped.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 1024 * 1024, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file = None
+        self.file_size = 0
+        self.sequence = 0
+        self.claimed = {}  # path -> locked file being drained
+        os.makedirs(directory, exist_ok=True)
+
+    def _files(self, *suffixes: str) -> List[str]:
+        return [path for suffix in suffixes for path in glob.glob(os.path.join(self.directory, f"*{suffix}"))]
+
+    def size(self) -> int:
+        total = 0
+        for path in self._files('.open', '.seg', '.drain'):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass  # Drained meanwhile
+        return total
+
+    def write(self, entries: List) -> bool:
+        """Append (stream, line) entries to this worker's open segment; False if the spool is full."""
+        data = b''.join(stream.encode('utf-8') + b'\t' + line for stream, line in entries)
+        with self.lock:
+            if self.size() + len(data) > self.max_bytes:
+                return False
+            if self.file is None:
+                self.sequence += 1
+                path = os.path.join(self.directory, f"{os.getpid()}-{time.time_ns()}-{self.sequence}.open")
+                self.file = open(path, 'ab')
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+                self.file_size = 0
+            self.file.write(data)
+            self.file.flush()
+            self.file_size += len(data)
+            if self.file_size >= self.segment_bytes:
+                self._seal()
+        return True
+
+    def _seal(self) -> None:
+        os.replace(self.file.name, self.file.name[:-len('.open')] + '.seg')
+        self.file.close()
+        self.file = None
+
+    def seal(self) -> None:
+        """Seal this worker's open segment so it can be drained."""
+        with self.lock:
+            if self.file is not None:
+                self._seal()
+
+    def claim(self) -> Optional[str]:
+        """Lock and take the oldest drainable segment; None if there is nothing to drain."""
+        candidates = sorted(self._files('.seg', '.open', '.drain'),
+                            key=lambda path: os.path.basename(path).split('-')[1:2])
+        for path in candidates:
+            try:
+                segment = open(path, 'rb')
+            except OSError:
+                continue  # Renamed by its owner or another worker meanwhile
+            try:
+                fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                claimed = path.rsplit('.', 1)[0] + '.drain'
+                os.replace(path, claimed)
+            except OSError:
+                segment.close()  # Being written or drained by a live worker
+                continue
+            self.claimed[claimed] = segment
+            return claimed
+        return None
+
+    def read(self, path: str) -> List:
+        """(stream, line) entries of a claimed segment."""
+        entries = []
+        segment = self.claimed[path]
+        segment.seek(0)
+        for raw in segment:
+            stream, tab, line = raw.partition(b'\t')
+            if tab and line.endswith(b'\n'):
+                entries.append((stream.decode('utf-8'), line))
+            else:
+                logger.warning(f"Skipping a torn telemetry spool line in {path}")
+        return entries
+
+    def remove(self, path: str) -> None:
+        os.remove(path)
+        self.claimed.pop(path).close()
+
+    def close(self) -> None:
+        self.seal()
+
+    def stats(self) -> Dict:
+        return {
+            'directory': self.directory,
+            'bytes': self.size(),
+            'segments': len(self._files('.open', '.seg', '.drain')),
+            'max_bytes': self.max_bytes
+        }
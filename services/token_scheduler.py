@@ -0,0 +1,259 @@
+import logging
+import time
+from collections import deque
+from threading import Condition
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a completion cannot be admitted before its deadline or the queue is full."""
+
+
+class TokenBucket:
+    """Token-per-minute budget that refills continuously. A rate of 0 means unlimited."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.refill_per_second = tokens_per_minute / 60.0
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float) -> None:
+        if self.unlimited:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def can_cover(self, cost: int) -> bool:
+        # Requests larger than the whole budget are admitted once the bucket is full
+        return self.unlimited or self.tokens >= min(cost, self.capacity)
+
+    def consume(self, cost: int) -> None:
+        if not self.unlimited:
+            self.tokens -= cost
+
+    def refund(self, amount: int) -> None:
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def seconds_until(self, cost: int) -> float:
+        if self.unlimited or self.can_cover(cost):
+            return 0.0
+        return (min(cost, self.capacity) - self.tokens) / self.refill_per_second
+
+
+class Ticket:
+    """An admitted completion; release it with the actual token usage once known."""
+
+    def __init__(self, user_id: str, tokens: int):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.actual_tokens = None
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.released = False
+
+
+class TokenRateScheduler:
+    """
+    In-process admission control in front of Azure OpenAI completions.
+
+    Each request is charged its estimated tokens against a global and a
+    per-user token-per-minute bucket. Waiting requests are queued per user and
+    granted round-robin across users, so one rep's burst cannot starve the
+    others. A 429 with Retry-After pauses all grants until it has elapsed.
+    """
+
+    IDLE_USER_SECONDS = 300
+    WAIT_SAMPLES = 1000
+
+    def __init__(self, global_tpm: int, per_user_tpm: int, max_queue: int = 500):
+        self.global_bucket = TokenBucket(global_tpm)
+        self.per_user_tpm = per_user_tpm
+        self.user_buckets = {}
+        self.user_last_seen = {}
+        self.queues = {}  # user_id -> deque of waiting tickets
+        self.ring = deque()  # users with waiting tickets, in round-robin order
+        self.max_queue = max_queue
+        self.queued = 0
+        self.paused_until = 0.0
+        self.condition = Condition()
+
+        self.granted_total = 0
+        self.rejected_total = 0
+        self.rate_limited_total = 0
+        self.wait_samples = deque(maxlen=self.WAIT_SAMPLES)
+
+    def _user_bucket(self, user_id: str) -> TokenBucket:
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self.user_buckets[user_id] = TokenBucket(self.per_user_tpm)
+        self.user_last_seen[user_id] = time.monotonic()
+        return bucket
+
+    def _evict_idle_users(self, now: float) -> None:
+        for user_id, last_seen in list(self.user_last_seen.items()):
+            if now - last_seen > self.IDLE_USER_SECONDS and user_id not in self.queues:
+                self.user_buckets.pop(user_id, None)
+                self.user_last_seen.pop(user_id, None)
+
+    def _grant(self, ticket: Ticket, user_bucket: TokenBucket) -> None:
+        self.global_bucket.consume(ticket.tokens)
+        user_bucket.consume(ticket.tokens)
+        ticket.granted = True
+        self.granted_total += 1
+        self.wait_samples.append(time.monotonic() - ticket.enqueued_at)
+
+    def _dispatch(self) -> float:
+        """Grant queued tickets round-robin; returns seconds until the next grant could succeed."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        self.global_bucket.refill(now)
+        next_wait = 1.0
+        granted_any = False
+        skipped = 0
+        while self.ring and skipped < len(self.ring):
+            user_id = self.ring[0]
+            queue = self.queues[user_id]
+            ticket = queue[0]
+            user_bucket = self._user_bucket(user_id)
+            user_bucket.refill(now)
+
+            if not self.global_bucket.can_cover(ticket.tokens):
+                # Keep the head of the line; admitting smaller requests behind it would starve it
+                next_wait = self.global_bucket.seconds_until(ticket.tokens)
+                break
+
+            if not user_bucket.can_cover(ticket.tokens):
+                next_wait = min(next_wait, user_bucket.seconds_until(ticket.tokens))
+                self.ring.rotate(-1)
+                skipped += 1
+                continue
+
+            queue.popleft()
+            self.queued -= 1
+            self._grant(ticket, user_bucket)
+            granted_any = True
+            skipped = 0
+            if queue:
+                self.ring.rotate(-1)
+            else:
+                self.ring.popleft()
+                del self.queues[user_id]
+
+        if granted_any:
+            self.condition.notify_all()
+        return max(0.01, next_wait)
+
+    def acquire(self, user_id: str, tokens: int, timeout: float,
+                abort: Optional[Callable[[], bool]] = None) -> Ticket:
+        """
+        Block until the request is admitted.
+
+        Raises AdmissionRejected if the queue is full, the request cannot be
+        admitted within `timeout`, or `abort` reports that the caller gave up.
+        """
+        ticket = Ticket(user_id, tokens)
+        deadline = time.monotonic() + timeout
+
+        with self.condition:
+            if self.queued >= self.max_queue:
+                self.rejected_total += 1
+                raise AdmissionRejected("Completion queue is full")
+
+            if user_id not in self.queues:
+                self.queues[user_id] = deque()
+                self.ring.append(user_id)
+            self.queues[user_id].append(ticket)
+            self.queued += 1
+
+            while not ticket.granted:
+                next_wait = self._dispatch()
+                if ticket.granted:
+                    break
+                if abort is not None and abort():
+                    self._withdraw(ticket)
+                    raise AdmissionRejected("Request abandoned while queued")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._withdraw(ticket)
+                    self.rejected_total += 1
+                    raise AdmissionRejected(
+                        f"Token budget not available within {timeout:.0f}s ({self.queued} requests queued)"
+                    )
+                self.condition.wait(timeout=min(remaining, next_wait))
+
+            self._evict_idle_users(time.monotonic())
+        return ticket
+
+    def _withdraw(self, ticket: Ticket) -> None:
+        queue = self.queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self.queued -= 1
+            if not queue:
+                del self.queues[ticket.user_id]
+                self.ring.remove(ticket.user_id)
+
+    def release(self, ticket: Ticket) -> None:
+        """Settle the charge for a finished request against its actual usage."""
+        with self.condition:
+            if ticket.released or not ticket.granted:
+                return
+            ticket.released = True
+            if ticket.actual_tokens is not None and ticket.actual_tokens < ticket.tokens:
+                refund = ticket.tokens - ticket.actual_tokens
+                self.global_bucket.refund(refund)
+                bucket = self.user_buckets.get(ticket.user_id)
+                if bucket is not None:
+                    bucket.refund(refund)
+            self._dispatch()
+
+    def pause_for(self, seconds: float) -> None:
+        """Honor an upstream Retry-After: no new completions are admitted until it has elapsed."""
+        with self.condition:
+            self.rate_limited_total += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            logger.warning(f"Azure OpenAI rate limited; pausing admissions for {seconds:.1f}s")
+
+    def stats(self) -> Dict:
+        with self.condition:
+            waits = sorted(self.wait_samples)
+            return {
+                'queue_depth': self.queued,
+                'queued_users': len(self.queues),
+                'granted': self.granted_total,
+                'rejected': self.rejected_total,
+                'rate_limited': self.rate_limited_total,
+                'paused_for_seconds': round(max(0.0, self.paused_until - time.monotonic()), 2),
+                'global_tokens_available': None if self.global_bucket.unlimited else int(self.global_bucket.tokens),
+                'wait_seconds': {
+                    'samples': len(waits),
+                    'avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                    'p50': round(waits[len(waits) // 2], 3) if waits else 0.0,
+                    'p95': round(waits[int(len(waits) * 0.95) - 1 if len(waits) > 1 else 0], 3) if waits else 0.0,
+                    'max': round(waits[-1], 3) if waits else 0.0
+                }
+            }
+
+
+def retry_after_seconds(error) -> Optional[float]:
+    """Read Retry-After (or Azure's retry-after-ms) from an OpenAI SDK error response."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000.0
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
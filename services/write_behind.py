@@ -0,0 +1,198 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Commits writes on a background thread after the response has been sent.
+
+    Items are applied in batches, so a burst of turns shares one transaction
+    and one fsync. Each item carries a key (the chat session id); readers call
+    `wait_for(key)` before reading that key's rows so a worker always sees its
+    own pending writes. Other workers may read a session a few milliseconds
+    before its last turn lands.
+
+    With `partition`, a batch is split by partition(item) and each part is
+    applied and retried on its own, for items that go to different databases.
+
+    A batch that still fails after `max_attempts` is applied one item at a
+    time, so only the items that fail on their own are dropped; `on_drop` is
+    called with each of those (to release what the caller held for it).
+
+    When the queue is full `submit` returns False and the caller commits
+    synchronously. `close()` drains everything still queued; it is registered
+    to run at interpreter exit so a graceful worker shutdown doesn't lose
+    turns.
+    """
+
+    def __init__(self, apply_batch: Callable[[List], None], max_queue: int = 1000, batch_size: int = 50,
+                 max_attempts: int = 5, enabled: bool = True, partition: Optional[Callable[[object], object]] = None,
+                 on_drop: Optional[Callable[[object], None]] = None):
+        self.apply_batch = apply_batch
+        self.partition = partition
+        self.on_drop = on_drop
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.enabled = enabled
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.pending = {}  # key -> writes queued or in flight
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.closed = False
+
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.lags = deque(maxlen=500)
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        self.thread = threading.Thread(target=self._loop, name='write-behind', daemon=True)
+        self.thread.start()
+
+    def submit(self, key: str, item) -> bool:
+        """Queue a write; False if it wasn't accepted and the caller should write it itself."""
+        if not self.enabled or self.closed:
+            return False
+        with self.condition:
+            self.pending[key] = self.pending.get(key, 0) + 1
+        try:
+            self.queue.put_nowait((key, item, time.monotonic()))
+        except queue.Full:
+            self._settle([key])
+            with self.condition:
+                self.rejected += 1
+            logger.warning("Write-behind queue full, committing synchronously")
+            return False
+        with self.condition:
+            self.submitted += 1
+        return True
+
+    def wait_for(self, key: str, timeout: float = 10.0) -> bool:
+        """Block until nothing is pending for key; False on timeout."""
+        if not self.enabled:
+            return True
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending.get(key), timeout)
+
+    def _settle(self, keys: List[str]) -> None:
+        with self.condition:
+            for key in keys:
+                remaining = self.pending.get(key, 0) - 1
+                if remaining > 0:
+                    self.pending[key] = remaining
+                else:
+                    self.pending.pop(key, None)
+            self.condition.notify_all()
+
+    def _next_batch(self, block: bool) -> List:
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=0.5) if block else self.queue.get_nowait())
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _loop(self) -> None:
+        while not self.closed:
+            batch = self._next_batch(block=True)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List) -> None:
+        if self.partition is None:
+            self._write_part(batch)
+            return
+        parts = {}
+        for entry in batch:
+            parts.setdefault(self.partition(entry[1]), []).append(entry)
+        for part in parts.values():
+            self._write_part(part)
+
+    def _write_part(self, batch: List) -> None:
+        items = [item for _, item, _ in batch]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.apply_batch(items)
+                self._record_written(batch)
+                break
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    logger.error(f"Write-behind batch of {len(items)} failed after {attempt} attempts, "
+                                 f"writing items one at a time: {str(e)}")
+                    self._write_each(batch)
+                    break
+                with self.condition:
+                    self.retries += 1
+                logger.warning(f"Write-behind batch failed (attempt {attempt}), retrying: {str(e)}")
+                time.sleep(0.1 * 2 ** attempt)
+        self._settle([key for key, _, _ in batch])
+
+    def _write_each(self, batch: List) -> None:
+        """Apply a failed batch item by item, dropping only the items that fail alone."""
+        for entry in batch:
+            key, item, _ = entry
+            try:
+                self.apply_batch([item])
+                self._record_written([entry])
+                continue
+            except Exception as e:
+                logger.error(f"Dropping write-behind item for {key}: {str(e)}")
+            with self.condition:
+                self.dropped += 1
+            if self.on_drop:
+                try:
+                    self.on_drop(item)
+                except Exception as e:
+                    logger.error(f"Write-behind drop handler failed for {key}: {str(e)}")
+
+    def _record_written(self, batch: List) -> None:
+        now = time.monotonic()
+        with self.condition:
+            self.batches += 1
+            self.written += len(batch)
+            self.lags.extend(now - queued_at for _, _, queued_at in batch)
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Stop the thread and write out everything still queued."""
+        if not self.enabled or self.closed:
+            return
+        self.closed = True
+        if self.thread:
+            self.thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            batch = self._next_batch(block=False)
+            if not batch:
+                break
+            self._write(batch)
+        logger.info(f"Write-behind queue closed; {self.queue.qsize()} items left unwritten")
+
+    def stats(self) -> Dict:
+        with self.condition:
+            lags = sorted(self.lags)
+            count = len(lags)
+            return {
+                'enabled': self.enabled,
+                'queue_depth': self.queue.qsize(),
+                'submitted': self.submitted,
+                'written': self.written,
+                'batches': self.batches,
+                'retries': self.retries,
+                'dropped': self.dropped,
+                'rejected_full': self.rejected,
+                'lag_p50_ms': round(lags[count // 2] * 1000) if count else None,
+                'lag_p95_ms': round(lags[max(0, int(count * 0.95) - 1)] * 1000) if count else None
+            }
@@ -1,6 +1,37 @@
 let isSubmitting = false;
 let isCreatingChat = false;
 
+// The /message request currently in flight, so it can be cancelled on navigation
+let inflightMessage = null;
+
+function generateRequestId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, c => {
+        const r = Math.random() * 16 | 0;
+        return (c === 'x' ? r : (r & 0x3 | 0x8)).toString(16);
+    });
+}
+
+// Abort the in-flight message and tell the server to stop working on it
+function cancelInflightMessage() {
+    if (!inflightMessage) return;
+    const { requestId, controller } = inflightMessage;
+    inflightMessage = null;
+    controller.abort();
+
+    const payload = new FormData();
+    payload.append('request_id', requestId);
+    if (navigator.sendBeacon) {
+        navigator.sendBeacon('/cancel_message', payload);
+    } else {
+        fetch('/cancel_message', { method: 'POST', body: payload, keepalive: true });
+    }
+}
+
+window.addEventListener('pagehide', cancelInflightMessage);
+
 // Add this constant at the top of your file to define the desired order
 const METADATA_ORDER = [
     'issue_title',
@@ -60,12 +91,18 @@ async function sendMessage() {
 
     try {
         // Create FormData and append message
+        const requestId = generateRequestId();
+        const controller = new AbortController();
+        inflightMessage = { requestId, controller };
+
         const formData = new FormData();
         formData.append('question', message);
+        formData.append('request_id', requestId);
 
         const response = await fetch('/message', {
             method: 'POST',
-            body: formData
+            body: formData,
+            signal: controller.signal
         });
 
         if (!response.ok) {
@@ -130,13 +167,18 @@ async function sendMessage() {
         }
 
     } catch (error) {
-        console.error('Full error details:', error); // Enhanced error logging
-        
         // Remove loading animation if it exists
         const loadingElement = document.querySelector('.loading-dots')?.parentElement;
         if (loadingElement) {
             loadingElement.remove();
         }
+
+        // The rep cancelled the request (new chat, switched chat or left the page)
+        if (error.name === 'AbortError') {
+            return;
+        }
+
+        console.error('Full error details:', error); // Enhanced error logging
         
         // Create a more user-friendly error message
         let errorMessage = 'An error occurred while processing your request.';
@@ -144,6 +186,8 @@ async function sendMessage() {
             errorMessage = 'There was an issue loading the response data. Please try again.';
         } else if (!navigator.onLine) {
             errorMessage = 'Please check your internet connection and try again.';
+        } else if (error.message.includes('status: 409')) {
+            errorMessage = 'A reply for this chat is still in progress, possibly in another tab. Please wait for it, then send again.';
         } else if (error.message.includes('HTTP error')) {
             errorMessage = 'Server communication error. Please try again later.';
         }
@@ -153,6 +197,7 @@ async function sendMessage() {
         chatContainer.insertAdjacentHTML('beforeend', errorMessageHtml);
     } finally {
         // Reset submission lock and scroll to bottom
+        inflightMessage = null;
         isSubmitting = false;
         sendButton.disabled = false;
         chatContainer.scrollTop = chatContainer.scrollHeight;
@@ -536,6 +581,7 @@ async function createNewChat() {
 
     try {
         isCreatingChat = true;
+        cancelInflightMessage();
         // Disable the button visually
         const newChatButton = document.querySelector('.new-chat-button');
         if (newChatButton) {
@@ -724,6 +770,9 @@ async function switchChat(sessionId) {
             mobileTopNav.classList.remove('active');
         }
         
+        // Stop any answer still being generated for the previous chat
+        cancelInflightMessage();
+
         // First switch the chat session
         const response = await fetch('/switch_chat', {
             method: 'POST',
@@ -779,17 +828,76 @@ async function switchChat(sessionId) {
     }
 }
 
-// Add this function to update the conversation list
-function updateConversationList(conversations) {
+// Append a page of conversations to the sidebar, skipping any already shown
+function appendConversations(conversations) {
+    const conversationList = document.getElementById('conversationList');
+    const shown = new Set(Array.from(conversationList.querySelectorAll('.conversation-item'))
+        .map(item => item.dataset.sessionId));
+
+    conversations.forEach(conv => {
+        if (shown.has(conv.id)) return;
+
+        const item = document.createElement('li');
+        item.className = `conversation-item ${conv.active ? 'active' : ''}`.trim();
+        item.dataset.sessionId = conv.id;
+        item.setAttribute('onclick', `switchChat('${conv.id}')`);
+        item.title = formatTime(conv.time);
+
+        const title = document.createElement('span');
+        title.className = 'conversation-title';
+        title.textContent = conv.title || 'New Conversation';
+        item.appendChild(title);
+        conversationList.appendChild(item);
+    });
+}
+
+// Load the next page of conversations (the first page is rendered with the page)
+let isLoadingConversations = false;
+
+async function loadMoreConversations() {
     const conversationList = document.getElementById('conversationList');
-    conversationList.innerHTML = conversations.map(conv => `
-        <li class="conversation-item ${conv.active ? 'active' : ''}" 
-            onclick="switchChat('${conv.id}')">
-            <span class="conversation-title">${conv.title || 'New Conversation'}</span>
-            <span class="conversation-time">${formatTime(conv.time)}</span>
-        </li>
-    `).join('');
-} 
+    const cursor = conversationList && conversationList.dataset.nextCursor;
+    if (!cursor || isLoadingConversations) return;
+
+    isLoadingConversations = true;
+    try {
+        const response = await fetch(`/conversations?cursor=${encodeURIComponent(cursor)}`);
+        const data = await response.json();
+        if (!response.ok) {
+            console.error('Failed to load conversations:', data.error);
+            return;
+        }
+        appendConversations(data.conversations);
+        conversationList.dataset.nextCursor = data.next_cursor || '';
+    } catch (error) {
+        console.error('Error loading conversations:', error);
+    } finally {
+        isLoadingConversations = false;
+    }
+}
+
+function initConversationScroll() {
+    const scroller = document.querySelector('.left-nav-body');
+    if (!scroller) return;
+
+    const nearBottom = () => scroller.scrollTop + scroller.clientHeight >= scroller.scrollHeight - 100;
+    scroller.addEventListener('scroll', () => {
+        if (nearBottom()) loadMoreConversations();
+    });
+
+    // Keep loading while the list doesn't fill the sidebar, since it can't be scrolled yet
+    const fill = async () => {
+        const conversationList = document.getElementById('conversationList');
+        while (conversationList.dataset.nextCursor && scroller.scrollHeight <= scroller.clientHeight) {
+            const before = conversationList.dataset.nextCursor;
+            await loadMoreConversations();
+            if (conversationList.dataset.nextCursor === before) break;
+        }
+    };
+    fill();
+}
+
+document.addEventListener('DOMContentLoaded', initConversationScroll);
 
 // Feedback Modal
 const modal = document.getElementById("feedbackModal");
@@ -0,0 +1,121 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# Tests import the app's modules the way app.py does (services.<module>, config)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings app.py reads at import. Endpoints point at a closed local port so a
+# call that a test forgot to fake fails fast instead of reaching Azure.
+TEST_ENV = {
+    'HOME': tempfile.mkdtemp(prefix='salesagent-tests-'),
+    'IS_LOCAL_DEV': 'True',
+    'FLASK_SECRET_KEY': 'test-secret',
+    'DEBUG_USER_ID': 'test-user',
+    'DEBUG_USER_EMAIL': 'test-user@example.com',
+    'AZURE_OPENAI_ENDPOINT': 'http://127.0.0.1:9',
+    'AZURE_OPENAI_KEY': 'test-key',
+    'AZURE_OPENAI_DEPLOYMENT': 'test-deployment',
+    'AZURE_AI_SEARCH_ENDPOINT': 'http://127.0.0.1:9',
+    'AZURE_AI_SEARCH_KEY': 'test-key',
+    'AZURE_OPENAI_SEARCH_INDEX': 'products',
+    'AZURE_OPENAI_SEARCH_SALESREP_INDEX': 'salesreps',
+    'AZURE_STORAGE_ACCOUNT': 'testaccount',
+    'AZURE_STORAGE_CONTAINER_NAME': 'documents',
+    'AZURE_STORAGE_CONTAINER_TELEMETRY_NAME': 'telemetry',
+    'AZURE_STORAGE_CONTAINER_FEEDBACK_NAME': 'feedback',
+    'APPLICATIONINSIGHTS_CONNECTION_STRING':
+        'InstrumentationKey=00000000-0000-0000-0000-000000000000;IngestionEndpoint=http://127.0.0.1:9',
+    'TELEMETRY_SPOOL_ENABLED': 'False',
+    'DEGRADATION_ENABLED': 'False',
+    'AZURE_OPENAI_TPM_LIMIT': '120000',
+}
+
+REPLY_METADATA = {
+    "confidence_level": 8, "product_category": "Instapak", "query_focus_area": "Packaging comparison",
+    "key_takeaways": ["Instapak for irregular parts"], "requires_followup": True, "detected_language": "EN",
+    "actions": ""
+}
+REPLY_CITATIONS = [{"title": "Instapak overview", "content": "Foam-in-place packaging",
+                    "filepath": "instapak.pdf", "url": None, "chunk_id": "0"}]
+
+
+class FakeCredential:
+    """Stands in for DefaultAzureCredential: hands out a token without signing in."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_token(self, *scopes, **kwargs):
+        from azure.core.credentials import AccessToken
+        self.calls += 1
+        return AccessToken(f"token-{self.calls}", int(time.time()) + 3600)
+
+
+class FakeCompletions:
+    """A chat.completions endpoint that streams a fixed grounded answer and records each request."""
+
+    def __init__(self):
+        self.requests = []
+        self.text = json.dumps(REPLY_METADATA) + "\nInstapak suits irregular, heavy parts."
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        delta = SimpleNamespace(content=self.text, context={'citations': REPLY_CITATIONS})
+        return iter([
+            SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta, finish_reason='stop')]),
+            SimpleNamespace(usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20), choices=[])
+        ])
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """app.py imported once against a temporary HOME, with Azure sign-in and blob writes faked."""
+    os.environ.update(TEST_ENV)
+    os.makedirs(os.path.join(TEST_ENV['HOME'], 'site', 'wwwroot'), exist_ok=True)
+    from services.azure_clients import azure_clients
+    azure_clients.credential.factory = FakeCredential
+
+    import app
+    app.app.config['TESTING'] = True
+    app.telemetry.append = lambda stream, data: None
+    return app
+
+
+@pytest.fixture
+def completions(app_module, monkeypatch):
+    fake = FakeCompletions()
+    app_module.answer_cache.clear()  # Otherwise a question an earlier test asked never reaches the fake
+    for deployment in app_module.openai_pool.deployments:
+        monkeypatch.setattr(deployment, 'client', SimpleNamespace(chat=SimpleNamespace(completions=fake)))
+    return fake
+
+
+@pytest.fixture
+def sales_rep(app_module):
+    """Sign in a rep whose sales data is already cached, so no search call is made."""
+    def sign_in(user_id, order_number='4500000001'):
+        email = f"{user_id}@example.com"
+        app_module.sales_data_cache.set(email, {
+            'Email': email,
+            'total_orders': 1,
+            'blocked_orders': 0,
+            'execution_status': ['Open'],
+            'orders': [{'order_number': order_number, 'execution_status': 'Open', 'order_quantity': 10,
+                        'open_quantity': 10, 'value_usd': 1200.0}],
+        })
+        return {'X-MS-CLIENT-PRINCIPAL-ID': user_id, 'X-MS-CLIENT-PRINCIPAL-NAME': email}
+    return sign_in
+
+
+def send_message(client, headers, question, **form):
+    """Post one chat turn the way the page does; returns the JSON reply."""
+    response = client.post('/message', data={'question': question, **form},
+                           headers={**headers, 'Referer': 'http://localhost/'})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
@@ -0,0 +1,74 @@
+from conftest import send_message
+from services.answer_cache import AnswerCache, IndexVersionTracker
+
+QUESTION = "Instapak vs Autobag for electronics?"
+
+
+def test_keys_ignore_case_and_punctuation():
+    cache = AnswerCache()
+    assert cache.make_key(QUESTION, 'v', '1') == cache.make_key("  instapak VS autobag, for electronics ", 'v', '1')
+    assert cache.make_key(QUESTION, 'v', '1') != cache.make_key(QUESTION, 'v', '2')
+
+
+def test_rep_specific_questions_are_not_cacheable():
+    assert AnswerCache.is_cacheable(QUESTION)
+    assert not AnswerCache.is_cacheable("Which Instapak did my customer order?")
+    assert not AnswerCache.is_cacheable("Instapak for PO 4500123456")
+
+
+def test_entries_expire_and_least_recently_used_are_evicted(monkeypatch):
+    cache = AnswerCache(max_size=2, ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr('services.answer_cache.time.monotonic', lambda: now[0])
+    cache.set('a', {'response': 'A'})
+    cache.set('b', {'response': 'B'})
+    assert cache.get('a') == {'response': 'A'}
+    cache.set('c', {'response': 'C'})  # 'b' is least recently used
+    assert cache.get('b') is None and cache.stats()['evictions'] == 1
+    now[0] += 61
+    assert cache.get('a') is None
+
+
+def test_indexer_run_changes_the_version_and_clears_the_cache():
+    cache = AnswerCache()
+    cache.set('key', {'response': 'old'})
+    status = {'lastResult': {'status': 'success', 'endTime': '2024-05-01T10:00:00Z'}}
+    tracker = IndexVersionTracker('1', fetch_status=lambda: status, poll_interval=0,
+                                  on_change=lambda old, new: cache.clear())
+    assert tracker.current_version() == '1:2024-05-01T10:00:00Z'
+    assert cache.get('key') is None
+    status['lastResult']['endTime'] = '2024-05-02T10:00:00Z'
+    assert tracker.current_version() == '1:2024-05-02T10:00:00Z'
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_repeated_product_question_is_served_from_cache_without_rep_data(app_module, completions, sales_rep):
+    app_module.answer_cache.clear()
+    first = send_message(app_module.app.test_client(), sales_rep('rep-a', order_number='4500000111'), QUESTION)
+    assert first['metadata']['route'] == 'product'
+    assert first['metadata']['response_source'] == 'llm'
+    assert len(completions.requests) == 1
+    # The answer is shared, so it is generated from the base prompt without the rep's sales context
+    assert completions.requests[0]['messages'][0]['content'] == app_module.PROTECTIVE_SYSTEM_PROMPT.strip()
+
+    second = send_message(app_module.app.test_client(), sales_rep('rep-b', order_number='4500000222'),
+                          "instapak VS autobag, for electronics")
+    assert second['metadata']['response_source'] == 'answer_cache'
+    assert second['response'] == first['response']
+    assert second['citations'] == first['citations']
+    assert len(completions.requests) == 1
+
+
+def test_index_version_change_invalidates_cached_answers(app_module, completions, sales_rep, monkeypatch):
+    app_module.answer_cache.clear()
+    send_message(app_module.app.test_client(), sales_rep('rep-c'), QUESTION)
+    send_message(app_module.app.test_client(), sales_rep('rep-d'), QUESTION)
+    assert len(completions.requests) == 1
+
+    # The document indexer finished a new run
+    status = {'lastResult': {'status': 'success', 'endTime': '2024-06-01T00:00:00Z'}}
+    monkeypatch.setattr(app_module.answer_cache_index, 'fetch_status', lambda: status)
+    monkeypatch.setattr(app_module.answer_cache_index, 'poll_interval', 0)
+    reply = send_message(app_module.app.test_client(), sales_rep('rep-e'), QUESTION)
+    assert reply['metadata']['response_source'] == 'llm'
+    assert len(completions.requests) == 2
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+from azure.core.credentials import AccessToken
+
+from services.azure_clients import CachedCredential
+
+SCOPE = 'https://storage.azure.com/.default'
+KEY = ((SCOPE,), None, False)
+
+
+class ScriptedCredential:
+    """Hands out tokens with a fixed lifetime; raises once `fail` is set."""
+
+    def __init__(self, lifetime=3600):
+        self.lifetime = lifetime
+        self.calls = 0
+        self.fail = False
+
+    def get_token(self, *scopes, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("credential chain unavailable")
+        return AccessToken(f"token-{self.calls}", int(time.time() + self.lifetime))
+
+
+@pytest.fixture
+def make_credential():
+    created = []
+
+    def make(lifetime=3600, refresh_margin_seconds=300):
+        inner = ScriptedCredential(lifetime)
+        cached = CachedCredential(factory=lambda: inner, refresh_margin_seconds=refresh_margin_seconds)
+        created.append(cached)
+        return cached, inner
+
+    yield make
+    for cached in created:
+        cached.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def test_token_is_cached_and_a_refresh_is_armed_before_expiry(make_credential):
+    cached, inner = make_credential()
+
+    first = cached.get_token(SCOPE)
+    assert cached.get_token(SCOPE) is first
+    assert inner.calls == 1
+    assert cached.stats()['cache_hits'] == 1
+    assert cached.timers[KEY].interval == pytest.approx(3300, abs=2)
+
+
+def test_token_is_renewed_in_the_background_without_a_caller(make_credential):
+    # A 2s token is renewed halfway through its life, since its lifetime is under the margin
+    cached, inner = make_credential(lifetime=2)
+    first = cached.get_token(SCOPE)
+
+    assert wait_for(lambda: cached.stats()['background_refreshes'] >= 1)
+    assert inner.calls >= 2
+    assert cached.tokens[KEY].token != first.token
+
+
+def test_failed_refresh_keeps_the_old_token_and_retries(make_credential):
+    cached, inner = make_credential()
+    first = cached.get_token(SCOPE)
+    inner.fail = True
+
+    cached._scheduled_refresh(KEY, {})
+
+    assert cached.stats()['refresh_failures'] == 1
+    assert cached.timers[KEY].interval == CachedCredential.RETRY_SECONDS
+    assert cached.get_token(SCOPE) is first
+
+
+def test_close_cancels_pending_refreshes(make_credential):
+    cached, inner = make_credential(lifetime=2)
+    cached.get_token(SCOPE)
+    cached.close()
+
+    time.sleep(1.5)
+    assert inner.calls == 1
+    assert cached.timers == {}
@@ -0,0 +1,85 @@
+import pytest
+
+from services import degradation
+from services.degradation import DegradationController
+from services.query_router import Route
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(degradation.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def controller(clock):
+    return DegradationController(p95_thresholds=[10, 20, 30, 40], error_rate_thresholds=[0.2, 0.4, 0.6, 0.8],
+                                 window_seconds=60, min_samples=5, recovery_seconds=30)
+
+
+def record(controller, count, latency, ok=True):
+    for _ in range(count):
+        controller.record(latency, ok)
+
+
+def test_stays_normal_below_thresholds_or_with_too_few_samples(controller):
+    record(controller, 4, 100)  # Slow, but under min_samples
+    assert controller.level() == 0
+    controller.samples.clear()
+    record(controller, 20, 5)
+    assert controller.level() == 0
+
+
+def test_jumps_straight_to_the_level_the_window_calls_for(controller):
+    record(controller, 20, 35)
+    assert controller.level() == DegradationController.REDUCED_OUTPUT
+
+    record(controller, 100, 1, ok=False)  # Over 80% of the window failed
+    assert controller.level() == DegradationController.CACHED_ONLY
+
+
+def test_recovers_one_level_at_a_time_after_calm(controller, clock):
+    record(controller, 20, 25)
+    assert controller.level() == DegradationController.NO_RETRIEVAL
+
+    clock.now += 61  # The slow samples leave the window
+    record(controller, 20, 1)
+    assert controller.level() == DegradationController.NO_RETRIEVAL  # Calm, not yet for long enough
+    clock.now += 30
+    assert controller.level() == DegradationController.REDUCED_CONTEXT
+    clock.now += 1
+    assert controller.level() == DegradationController.REDUCED_CONTEXT  # Calm period starts over
+    clock.now += 30
+    assert controller.level() == 0
+    assert controller.stats()['transitions'] == 3
+
+
+def test_apply_trims_the_route_by_level(controller):
+    route = Route('mixed', include_orders=True, use_retrieval=True, max_tokens=1600, top_n=5)
+    assert controller.apply(route, DegradationController.REDUCED_CONTEXT, 400) is route
+
+    no_retrieval = controller.apply(route, DegradationController.NO_RETRIEVAL, 400)
+    assert not no_retrieval.use_retrieval and no_retrieval.max_tokens == 1600
+
+    reduced = controller.apply(route, DegradationController.REDUCED_OUTPUT, 400)
+    assert not reduced.use_retrieval and reduced.max_tokens == 400 and reduced.include_orders
+
+
+def test_disabled_controller_never_degrades(clock):
+    controller = DegradationController([1, 2, 3, 4], [0.1, 0.2, 0.3, 0.4], enabled=False)
+    record(controller, 50, 100, ok=False)
+    assert controller.level() == 0
+
+
+def test_needs_a_threshold_per_level():
+    with pytest.raises(ValueError):
+        DegradationController([10, 20], [0.2, 0.4])
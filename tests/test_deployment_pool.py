@@ -0,0 +1,117 @@
+import httpx
+import pytest
+from openai import APIConnectionError, APIStatusError, BadRequestError, RateLimitError
+
+from services.deployment_pool import Deployment, DeploymentPool, DeploymentUnavailable
+
+REQUEST = httpx.Request('POST', 'https://example.openai.azure.com/openai/deployments/gpt/chat/completions')
+
+
+def status_error(error_class, status, headers=None):
+    response = httpx.Response(status, headers=headers or {}, request=REQUEST)
+    return error_class(f"HTTP {status}", response=response, body=None)
+
+
+def make_pool(*names, **kwargs):
+    deployments = [Deployment(name, f"https://{name}.example.com", 'key', '2024-06-01', 'gpt-4o', client=object())
+                   for name in names]
+    return DeploymentPool(deployments, **kwargs)
+
+
+def deployment(pool, name):
+    return next(d for d in pool.deployments if d.name == name)
+
+
+def failing_on(*names, error=None):
+    calls = []
+
+    def call(d):
+        calls.append(d.name)
+        if d.name in names:
+            raise error or status_error(RateLimitError, 429)
+        return f"answer from {d.name}"
+    return call, calls
+
+
+def test_throttled_deployment_fails_over_and_cools_down_for_retry_after():
+    pool = make_pool('east', 'west')
+    deployment(pool, 'west').ewma_latency = 1.0  # east is preferred
+    call, calls = failing_on('east', error=status_error(RateLimitError, 429, {'retry-after': '20'}))
+
+    assert pool.run(call) == "answer from west"
+    assert calls == ['east', 'west']
+    east = pool.stats()['deployments'][0]
+    assert not east['healthy'] and 19 <= east['cooldown_seconds'] <= 20
+    assert pool.stats()['failovers'] == 1
+
+    # Cooling down: the next call goes straight to west
+    call, calls = failing_on()
+    assert pool.run(call) == "answer from west"
+    assert calls == ['west']
+
+
+@pytest.mark.parametrize('error', [
+    status_error(APIStatusError, 503),
+    APIConnectionError(request=REQUEST),
+])
+def test_server_and_connection_errors_fail_over(error):
+    pool = make_pool('east', 'west')
+    deployment(pool, 'west').ewma_latency = 1.0
+    call, calls = failing_on('east', error=error)
+    assert pool.run(call) == "answer from west"
+
+
+def test_client_errors_are_not_failed_over():
+    pool = make_pool('east', 'west')
+    deployment(pool, 'west').ewma_latency = 1.0
+    call, calls = failing_on('east', error=status_error(BadRequestError, 400))
+
+    with pytest.raises(BadRequestError):
+        pool.run(call)
+    assert calls == ['east']
+    assert all(d['healthy'] and d['inflight'] == 0 for d in pool.stats()['deployments'])
+
+
+def test_cooldown_backs_off_exponentially_without_retry_after():
+    pool = make_pool('east', cooldown_seconds=10, max_cooldown_seconds=25)
+    east = deployment(pool, 'east')
+    call, _ = failing_on('east', error=status_error(APIStatusError, 500))
+
+    cooldowns = []
+    for _ in range(3):
+        east.cooldown_until = 0.0  # Let the next call through
+        with pytest.raises(APIStatusError):
+            pool.run(call)
+        cooldowns.append(pool.stats()['deployments'][0]['cooldown_seconds'])
+    assert cooldowns == [10.0, 20.0, 25.0]
+
+
+def test_all_deployments_cooling_down_raises_unavailable():
+    pool = make_pool('east', 'west')
+    call, _ = failing_on('east', 'west')
+    with pytest.raises(RateLimitError):
+        pool.run(call)  # Both fail: the last error is raised
+
+    with pytest.raises(DeploymentUnavailable) as raised:
+        pool.run(call)
+    assert raised.value.retry_after > 0
+
+
+def test_success_resets_failures_and_prefers_the_faster_deployment():
+    pool = make_pool('east', 'west')
+    deployment(pool, 'east').ewma_latency = 2.0
+    deployment(pool, 'west').ewma_latency = 0.5
+    deployment(pool, 'west').consecutive_failures = 3
+
+    call, calls = failing_on()
+    pool.run(call)
+    assert calls == ['west']
+    assert deployment(pool, 'west').consecutive_failures == 0
+
+
+def test_total_tpm_needs_every_quota():
+    pool = make_pool('east', 'west')
+    deployment(pool, 'east').tpm = 60000
+    assert pool.total_tpm == 0
+    deployment(pool, 'west').tpm = 30000
+    assert pool.total_tpm == 90000
@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import send_message
+from services.fast_path import FastPathEngine
+
+ORDERS = [
+    {'order_number': '0031130481/1/1', 'execution_status': 'Open', 'order_quantity': 12, 'value_usd': 1500,
+     'customer_info': {'sold_to': 'Acme Corp', 'purchase_order': '4500012345'}, 'delivery_number': '80012345',
+     'credit_status': {'overall_status': 'Not Blocked'},
+     'sales_team': {'customer_service_representative': 'Dana Reyes'}},
+    {'order_number': '31130481/2/1', 'execution_status': 'Shipped', 'order_quantity': 3, 'value_usd': 250.5,
+     'customer_info': {'sold_to': 'Acme Corp', 'purchase_order': '4500012345'}},
+    # 7000001 is both an order and a PO number, so a lookup on it is ambiguous
+    {'order_number': '7000001', 'execution_status': 'Open', 'customer_info': {'purchase_order': 'X1'}},
+    {'order_number': '7000002', 'execution_status': 'Open', 'customer_info': {'purchase_order': '7000001'}},
+]
+
+
+@pytest.fixture
+def engine():
+    return FastPathEngine(enabled=True, max_rows=10)
+
+
+def test_status_lookup_is_answered_without_the_llm(engine):
+    answer = engine.answer("What's the status of order 31130481?", {'orders': ORDERS})
+
+    assert answer is not None
+    assert answer['detected_language'] == "EN"
+    assert answer['product_category'] == "Order Information"
+    assert answer['citations'] == []
+    assert "order 31130481 for Acme Corp" in answer['response']
+    assert answer['response'].count("<tr>") == 3  # header plus both order lines
+    assert answer['key_takeaways'] == ["Order 31130481: Open, Shipped", "Customer: Acme Corp"]
+    assert engine.stats()['answered'] == 1
+
+
+def test_po_and_delivery_numbers_resolve(engine):
+    assert "purchase order 4500012345" in engine.answer("where is PO 4500012345", {'orders': ORDERS})['response']
+    assert "delivery 80012345" in engine.answer("tracking for 80012345", {'orders': ORDERS})['response']
+
+
+@pytest.mark.parametrize('question, reason', [
+    ("Why is order 31130481 late?", 'not_a_lookup'),
+    ("Status of order 31130481, and draft an email to the customer", 'not_a_lookup'),
+    ("What's the status of my orders?", 'no_identifier'),
+    ("Status of order 99999999", 'unresolved_or_ambiguous'),
+    ("Status of 7000001", 'unresolved_or_ambiguous'),
+])
+def test_anything_but_a_plain_lookup_falls_through(engine, question, reason):
+    assert engine.answer(question, {'orders': ORDERS}) is None
+    assert engine.stats()['fallthrough_reasons'] == {reason: 1}
+
+
+def test_falls_through_without_orders_or_when_too_many_lines(engine):
+    assert engine.answer("Status of order 31130481", {'orders': []}) is None
+    assert FastPathEngine(max_rows=1).answer("Status of order 31130481", {'orders': ORDERS}) is None
+    assert FastPathEngine(enabled=False).answer("Status of order 31130481", {'orders': ORDERS}) is None
+
+
+def test_message_endpoint_serves_lookups_from_the_fast_path(app_module, completions, sales_rep):
+    headers = sales_rep('rep-fast', order_number='4500000077')
+    with app_module.app.test_client() as client:
+        reply = send_message(client, headers, "What's the status of order 4500000077?")
+
+    assert reply['metadata']['response_source'] == 'fast_path'
+    assert reply['metadata']['detected_language'] == "EN"
+    assert "4500000077" in reply['response']
+    assert completions.requests == []
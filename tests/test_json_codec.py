@@ -0,0 +1,73 @@
+import json
+
+import pytest
+import sqlalchemy as sa
+
+from services import json_codec as json_codec_module
+from services.json_codec import ZLIB_VERSION, CompressedJSON, JSONCodec
+
+LARGE = {'orders': [{'order_number': str(4500000000 + i), 'status': 'Open', 'customer': 'Acme Corp'}
+                    for i in range(100)]}
+SMALL = {'role': 'user', 'content': 'Hello'}
+
+
+def test_small_values_stay_plain_json():
+    codec = JSONCodec(min_bytes=1024)
+    stored = codec.encode(SMALL)
+    assert stored == json.dumps(SMALL, separators=(',', ':')).encode('utf-8')
+    assert not JSONCodec.is_compressed(stored)
+    assert codec.decode(stored) == SMALL
+
+
+def test_large_values_are_compressed_with_a_version_byte():
+    codec = JSONCodec(min_bytes=1024)
+    stored = codec.encode(LARGE)
+    assert stored[0] == ZLIB_VERSION
+    assert JSONCodec.is_compressed(stored)
+    assert len(stored) < len(json.dumps(LARGE)) / 4
+    assert codec.decode(stored) == LARGE
+    assert codec.stats()['values_compressed'] == 1
+
+
+def test_incompressible_values_are_stored_plain():
+    codec = JSONCodec(min_bytes=16)
+    value = 'abcdefghijklmnopqrstuvwxyz'  # Nothing repeats, so zlib's header makes it longer
+    stored = codec.encode(value)
+    assert not JSONCodec.is_compressed(stored)
+    assert codec.decode(stored) == value
+
+
+def test_decodes_every_stored_layout():
+    codec = JSONCodec(codec='none')
+    assert codec.decode(json.dumps(SMALL)) == SMALL  # str from rows written by the JSON type
+    assert codec.decode(memoryview(json.dumps(SMALL).encode('utf-8'))) == SMALL
+    assert codec.decode(JSONCodec(min_bytes=0).encode(LARGE)) == LARGE  # Written before compression was off
+    assert codec.decode(None) is None and codec.decode(b'') is None
+    assert codec.encode(None) is None
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        JSONCodec(codec='brotli')
+
+
+def test_zstd_falls_back_to_zlib_when_not_installed(monkeypatch):
+    monkeypatch.setattr(json_codec_module, 'zstandard', None)
+    assert JSONCodec(codec='zstd').codec == 'zlib'
+
+
+def test_column_reads_plain_json_rows_and_writes_compressed(monkeypatch):
+    monkeypatch.setattr(json_codec_module, 'json_codec', JSONCodec(min_bytes=256))
+    engine = sa.create_engine('sqlite://')
+    metadata = sa.MetaData()
+    table = sa.Table('chat', metadata, sa.Column('id', sa.Integer, primary_key=True), sa.Column('data', CompressedJSON))
+    metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        conn.execute(sa.text("INSERT INTO chat (id, data) VALUES (1, :data)"), {'data': json.dumps(SMALL)})
+        conn.execute(table.insert(), {'id': 2, 'data': LARGE})
+        raw = conn.execute(sa.text("SELECT data FROM chat WHERE id = 2")).scalar()
+        rows = dict(conn.execute(sa.select(table.c.id, table.c.data)).fetchall())
+
+    assert JSONCodec.is_compressed(raw)
+    assert rows == {1: SMALL, 2: LARGE}
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from services.db_migrations import Migration, MigrationRunner
+
+# chat_session as it was before chat_message existed: whole conversations in JSON columns
+LEGACY_SCHEMA = (
+    "CREATE TABLE chat_session (id VARCHAR(36) PRIMARY KEY, messages JSON, chat_history JSON, citations JSON, "
+    "product_category VARCHAR(50), confidence_level INTEGER, focus_area VARCHAR(100), "
+    "detected_language VARCHAR(50), created_at VARCHAR(50), last_activity VARCHAR(50), user_id VARCHAR(50), "
+    "sales_metadata JSON)"
+)
+IMAGE_CONTENT = [
+    {"type": "text", "text": "Which Instapak fits this part?"},
+    {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,/9j/4AAQ"}}
+]
+CHAT_HISTORY = [
+    {"role": "user", "content": "Hello"},
+    {"role": "assistant", "content": "Hi, how can I help?", "citations": [],
+     "metadata": {"key_takeaways": [], "actions": None}},
+    {"role": "user", "content": "Which Instapak fits this part?"},
+    {"role": "assistant", "content": "Instapak Quick RT.", "citations": [{"title": "Quick RT"}]},
+    # A turn that failed: shown in the chat, never sent to the model
+    {"role": "user", "content": "And for glassware?"},
+    {"role": "assistant", "content": "Sorry, I encountered an error processing your request.", "citations": []},
+]
+MESSAGES = [
+    {"role": "system", "content": "You are a packaging expert."},
+    {"role": "user", "content": "Hello"},
+    {"role": "assistant", "content": "Hi, how can I help?"},
+    {"role": "user", "content": IMAGE_CONTENT},
+    {"role": "assistant", "content": "Instapak Quick RT."},
+]
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(LEGACY_SCHEMA))
+        conn.execute(text(
+            "INSERT INTO chat_session (id, messages, chat_history, citations, created_at, last_activity, user_id, "
+            "sales_metadata) VALUES (:id, :messages, :chat_history, :citations, :created_at, :last_activity, "
+            ":user_id, :sales_metadata)"
+        ), [
+            {'id': 'session-a', 'messages': json.dumps(MESSAGES), 'chat_history': json.dumps(CHAT_HISTORY),
+             'citations': '[]', 'created_at': '2024-05-01T09:00:00', 'last_activity': '2024-05-01T09:30:00',
+             'user_id': 'rep-a', 'sales_metadata': json.dumps({'Email': 'rep-a@example.com', 'orders': []})},
+            {'id': 'session-b', 'messages': None, 'chat_history': json.dumps(CHAT_HISTORY[:2]), 'citations': None,
+             'created_at': '2024-05-02T09:00:00', 'last_activity': '2024-05-02T09:05:00', 'user_id': 'rep-b',
+             'sales_metadata': json.dumps({'Email': 'rep-a@example.com', 'orders': []})},
+        ])
+    yield engine
+    engine.dispose()
+
+
+def chat_messages(app_module, engine, session_id):
+    with engine.connect() as conn:
+        return conn.execute(
+            app_module.ChatMessage.__table__.select()
+            .where(app_module.ChatMessage.__table__.c.session_id == session_id)
+            .order_by(app_module.ChatMessage.__table__.c.id)
+        ).fetchall()
+
+
+def test_legacy_conversations_keep_image_attachments_and_failed_turns(app_module, legacy_engine):
+    MigrationRunner(legacy_engine).run(app_module.MIGRATIONS)
+
+    rows = chat_messages(app_module, legacy_engine, 'session-a')
+    assert [row.content for row in rows] == [entry['content'] for entry in CHAT_HISTORY]
+    assert rows[2].payload == IMAGE_CONTENT
+    assert [row.payload for row in rows if row.id != rows[2].id] == [None] * 5
+    assert rows[3].citations == [{"title": "Quick RT"}]
+    assert rows[1].message_metadata == {"key_takeaways": [], "actions": None}
+    assert [row.in_context for row in rows] == [True, True, True, True, False, False]
+
+    # A session saved without a messages array keeps every entry in context
+    assert [row.in_context for row in chat_messages(app_module, legacy_engine, 'session-b')] == [True, True]
+
+    with legacy_engine.connect() as conn:
+        session = conn.execute(text(
+            "SELECT messages, chat_history, citations, message_count, sales_snapshot_id, sales_metadata, "
+            "created_at FROM chat_session WHERE id = 'session-a'"
+        )).one()
+        snapshots = conn.execute(text("SELECT COUNT(*) FROM sales_snapshot")).scalar()
+    assert (session.messages, session.chat_history, session.citations) == (None, None, None)
+    assert session.message_count == 6
+    assert session.sales_snapshot_id and session.sales_metadata is None
+    assert snapshots == 1  # Both sessions held the same sales metadata
+    assert session.created_at == '2024-05-01 09:00:00'
+
+
+def test_migrations_apply_once(app_module, legacy_engine):
+    MigrationRunner(legacy_engine).run(app_module.MIGRATIONS)
+    MigrationRunner(legacy_engine).run(app_module.MIGRATIONS)
+
+    assert len(chat_messages(app_module, legacy_engine, 'session-a')) == 6
+    with legacy_engine.connect() as conn:
+        versions = conn.execute(text("SELECT version FROM schema_migration ORDER BY version")).scalars().all()
+    assert versions == [migration.version for migration in app_module.MIGRATIONS]
+
+
+def test_failed_migration_rolls_back_its_claim(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'failing.db'}")
+    calls = []
+
+    def create_then_fail(conn):
+        conn.execute(text("CREATE TABLE widget (id INTEGER)"))
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("disk full")
+
+    migration = Migration('0001_widget', 'Widget table', create_then_fail)
+    with pytest.raises(RuntimeError):
+        MigrationRunner(engine).run([migration])
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM schema_migration")).scalar() == 0
+
+    MigrationRunner(engine).run([migration])  # Retried on the next start
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT version FROM schema_migration")).scalar() == '0001_widget'
+    engine.dispose()
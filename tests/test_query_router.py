@@ -0,0 +1,55 @@
+import pytest
+
+from services.query_router import QueryRouter, Route
+
+
+@pytest.fixture
+def router():
+    return QueryRouter({
+        QueryRouter.ORDER: Route(QueryRouter.ORDER, include_orders=True, use_retrieval=False, max_tokens=800),
+        QueryRouter.PRODUCT: Route(QueryRouter.PRODUCT, include_orders=False, use_retrieval=True, max_tokens=1200,
+                                   top_n=3),
+        QueryRouter.MIXED: Route(QueryRouter.MIXED, include_orders=True, use_retrieval=True, max_tokens=1600,
+                                 top_n=5),
+        QueryRouter.FOOD: Route(QueryRouter.FOOD, include_orders=True, use_retrieval=False, max_tokens=1600)
+    })
+
+
+@pytest.mark.parametrize('question', [
+    "Instapak vs Autobag for electronics?",
+    "What Instapak foam should I use for heavy machined parts?",
+    "Which Autobag machine fits a small e-commerce warehouse?",
+    "Is Cryovac shrink film recyclable?",
+    "What void fill works best in mailers?",
+    "Compare bubble cushioning with foam-in-place for glassware",
+])
+def test_product_questions_go_to_the_product_route(router, question):
+    route = router.route(question)
+    assert route.name == QueryRouter.PRODUCT
+    assert route.use_retrieval and not route.include_orders
+
+
+@pytest.mark.parametrize('question', [
+    "What is the status of order 4500123456?",
+    "Which of my orders are blocked?",
+    "When will the delivery for PO 7788123 ship?",
+])
+def test_order_questions_skip_retrieval(router, question):
+    route = router.route(question)
+    assert route.name == QueryRouter.ORDER
+    assert not route.use_retrieval
+
+
+@pytest.mark.parametrize('question', [
+    "Which customers ordered Instapak foam last month?",
+    "Can you help me with something?",
+])
+def test_unclear_or_combined_questions_are_mixed(router, question):
+    assert router.route(question).name == QueryRouter.MIXED
+
+
+def test_images_food_and_disabled_router(router):
+    assert router.route("Instapak vs Autobag?", has_image=True).name == QueryRouter.MIXED
+    assert router.route("Instapak vs Autobag?", is_food_route=True).name == QueryRouter.FOOD
+    router.enabled = False
+    assert router.route("Instapak vs Autobag?").name == QueryRouter.MIXED
@@ -0,0 +1,94 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from services.completion import stream_chat_completion
+from services.request_control import CancelToken, Deadline, InflightRegistry, RequestCancelled
+
+REQUEST_ID = '6f1c2b1e-0d5a-4c55-9d0e-1f2a3b4c5d6e'
+
+
+@pytest.fixture
+def marker_dir(tmp_path):
+    return str(tmp_path / 'cancel')
+
+
+def test_cancel_on_the_worker_that_owns_the_request(marker_dir):
+    registry = InflightRegistry(marker_dir)
+    token = registry.register('alice', REQUEST_ID)
+    assert registry.cancel('alice', REQUEST_ID)
+    assert token.abandoned and token.reason == 'client'
+
+
+def test_cancel_reaches_a_request_on_another_worker(marker_dir):
+    owner, other = InflightRegistry(marker_dir), InflightRegistry(marker_dir)
+    token = owner.register('alice', REQUEST_ID)
+    assert other.cancel('alice', REQUEST_ID)
+    assert token.abandoned
+    owner.unregister(token)
+    assert os.listdir(marker_dir) == []
+
+
+def test_unknown_or_foreign_request_ids_cancel_nothing_and_leave_no_marker(marker_dir):
+    owner, other = InflightRegistry(marker_dir), InflightRegistry(marker_dir)
+    token = owner.register('alice', REQUEST_ID)
+    assert not other.cancel('alice', 'a1b2c3d4-0000-0000-0000-000000000000')
+    assert not other.cancel('mallory', REQUEST_ID)
+    assert not other.cancel('alice', '../../etc/passwd')
+    assert not token.abandoned
+    assert [name for name in os.listdir(marker_dir) if not name.endswith('.inflight')] == []
+    assert other.stats()['unmatched_cancels'] == 2
+
+
+def test_finished_request_cannot_be_cancelled(marker_dir):
+    registry = InflightRegistry(marker_dir)
+    registry.unregister(registry.register('alice', REQUEST_ID))
+    assert not InflightRegistry(marker_dir).cancel('alice', REQUEST_ID)
+
+
+def test_deadline_cancels_without_counting_as_abandoned():
+    token = CancelToken('', deadline=Deadline(0))
+    assert token.cancelled and token.reason == 'deadline'
+    assert not token.abandoned
+    with pytest.raises(RequestCancelled):
+        token.raise_if_cancelled('completion')
+
+
+def test_stream_is_closed_when_the_request_is_cancelled_mid_answer():
+    token = CancelToken('key')
+    closed = []
+
+    class Stream:
+        def __iter__(self):
+            delta = SimpleNamespace(content='part', context=None)
+            for _ in range(3):
+                yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta, finish_reason=None)])
+                token.cancel('client')
+
+        def close(self):
+            closed.append(True)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: Stream())))
+    with pytest.raises(RequestCancelled) as raised:
+        stream_chat_completion(client, cancel_token=token, messages=[])
+    assert raised.value.stage == 'completion'
+    assert closed == [True]
+
+
+def test_cancel_message_endpoint(app_module, monkeypatch):
+    client = app_module.app.test_client()
+    headers = {'X-MS-CLIENT-PRINCIPAL-ID': 'cancel-user'}
+    token = app_module.inflight_requests.register('cancel-user', REQUEST_ID)
+    try:
+        assert client.post('/cancel_message', json={'request_id': REQUEST_ID}, headers=headers).get_json() == {
+            'success': True}
+        assert token.abandoned
+        response = client.post('/cancel_message', json={'request_id': REQUEST_ID},
+                               headers={'X-MS-CLIENT-PRINCIPAL-ID': 'someone-else'})
+        assert response.status_code == 404 and response.get_json()['success'] is False
+    finally:
+        app_module.inflight_requests.unregister(token)
+
+    monkeypatch.setattr(app_module.Config, 'IS_LOCAL_DEV', False)
+    assert client.post('/cancel_message', json={'request_id': REQUEST_ID}).status_code == 401
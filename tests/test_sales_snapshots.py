@@ -0,0 +1,82 @@
+import datetime
+
+import pytest
+
+
+@pytest.fixture
+def snapshots(app_module):
+    """App context with empty snapshot caches; snapshots and sessions made by a test are removed after it."""
+    with app_module.app.app_context():
+        existing = {snapshot_id for (snapshot_id,) in app_module.db.session.query(app_module.SalesSnapshot.id)}
+        app_module.sales_snapshot_touched.clear()
+        app_module.sales_snapshot_cache.clear()
+        yield app_module
+        app_module.db.session.rollback()
+        app_module.ChatSession.query.filter(app_module.ChatSession.id.like('snapshot-test-%')).delete()
+        app_module.SalesSnapshot.query.filter(app_module.SalesSnapshot.id.notin_(existing)).delete()
+        app_module.db.session.commit()
+        app_module.sales_snapshot_touched.clear()
+        app_module.sales_snapshot_cache.clear()
+
+
+def age_snapshot(app, snapshot_id, days=2):
+    app.db.session.query(app.SalesSnapshot).filter_by(id=snapshot_id).update(
+        {'last_used_at': datetime.datetime.utcnow() - datetime.timedelta(days=days)}
+    )
+    app.db.session.commit()
+
+
+def metadata(email='rep-a@example.com'):
+    return {'Email': email, 'total_orders': 2, 'orders': []}
+
+
+def test_same_metadata_is_stored_once(snapshots):
+    before = snapshots.SalesSnapshot.query.count()
+    first = snapshots.store_sales_snapshot(metadata())
+    second = snapshots.store_sales_snapshot(metadata())
+
+    assert first == second
+    assert snapshots.SalesSnapshot.query.count() == before + 1
+    assert snapshots.load_sales_snapshot(first) == metadata()
+
+
+def test_reusing_a_snapshot_keeps_the_janitor_away(snapshots):
+    snapshot_id = snapshots.store_sales_snapshot(metadata())
+    age_snapshot(snapshots, snapshot_id)
+    snapshots.sales_snapshot_touched.clear()  # This worker last touched it over an hour ago
+
+    # A new turn reuses the snapshot; its session commits later (write-behind)
+    assert snapshots.store_sales_snapshot(metadata()) == snapshot_id
+    assert snapshots.cleanup_orphaned_sales_snapshots() == 0
+
+    snapshots.db.session.add(snapshots.ChatSession(id='snapshot-test-1', user_id='rep-a',
+                                                   sales_snapshot_id=snapshot_id))
+    snapshots.db.session.commit()
+    assert snapshots.db.session.get(snapshots.SalesSnapshot, snapshot_id) is not None
+
+
+def test_snapshot_deleted_by_the_janitor_is_stored_again(snapshots):
+    snapshot_id = snapshots.store_sales_snapshot(metadata())
+    age_snapshot(snapshots, snapshot_id)
+    assert snapshots.cleanup_orphaned_sales_snapshots() == 1
+
+    # The worker still has it cached from earlier, but that was over an hour ago
+    snapshots.sales_snapshot_touched.clear()
+    assert snapshots.store_sales_snapshot(metadata()) == snapshot_id
+    snapshots.db.session.expire_all()
+    assert snapshots.db.session.get(snapshots.SalesSnapshot, snapshot_id).data == metadata()
+
+
+def test_janitor_keeps_referenced_and_recent_snapshots(snapshots):
+    referenced = snapshots.store_sales_snapshot(metadata('rep-a@example.com'))
+    recent = snapshots.store_sales_snapshot(metadata('rep-b@example.com'))
+    orphan = snapshots.store_sales_snapshot(metadata('rep-c@example.com'))
+    snapshots.db.session.add(snapshots.ChatSession(id='snapshot-test-2', user_id='rep-a',
+                                                   sales_snapshot_id=referenced))
+    snapshots.db.session.commit()
+    age_snapshot(snapshots, referenced)
+    age_snapshot(snapshots, orphan)
+
+    assert snapshots.cleanup_orphaned_sales_snapshots() == 1
+    remaining = {snapshot_id for (snapshot_id,) in snapshots.db.session.query(snapshots.SalesSnapshot.id)}
+    assert {referenced, recent} <= remaining and orphan not in remaining
@@ -0,0 +1,69 @@
+import datetime
+
+import pytest
+from sqlalchemy import select
+
+from conftest import send_message
+
+
+@pytest.fixture
+def archived_chat(app_module, completions, sales_rep):
+    """A two-turn chat of rep-archive-owner, idle past SESSION_ARCHIVE_AFTER_DAYS and moved to the archive."""
+    headers = sales_rep('rep-archive-owner')
+    with app_module.app.test_client() as client:
+        send_message(client, headers, "Which Instapak foam suits heavy parts?")
+        send_message(client, headers, "And for glassware?")
+        with client.session_transaction() as cookie:
+            session_id = cookie['session_id']
+
+    with app_module.app.app_context():
+        idle_since = datetime.datetime.utcnow() - datetime.timedelta(days=app_module.Config.SESSION_ARCHIVE_AFTER_DAYS + 1)
+        app_module.ChatSession.query.filter_by(id=session_id).update({'last_activity': idle_since})
+        app_module.db.session.commit()
+        assert app_module.archive_inactive_sessions() >= 1
+    return session_id, headers
+
+
+def archived_ids(app_module):
+    archived_sessions = app_module.ArchivedSession.__table__
+    with app_module.db.engines['archive'].connect() as conn:
+        return set(conn.execute(select(archived_sessions.c.id)).scalars())
+
+
+def test_idle_sessions_move_to_the_archive(app_module, archived_chat):
+    session_id, _ = archived_chat
+    with app_module.app.app_context():
+        assert app_module.db.session.get(app_module.ChatSession, session_id) is None
+        assert app_module.ChatMessage.query.filter_by(session_id=session_id).count() == 0
+        assert session_id in archived_ids(app_module)
+
+
+def test_owner_opening_an_archived_chat_restores_it(app_module, archived_chat):
+    session_id, headers = archived_chat
+    with app_module.app.test_client() as client:
+        response = client.get(f'/get_chat_history/{session_id}', headers=headers)
+        assert response.status_code == 200
+        messages = response.get_json()['messages']
+        assert [message['role'] for message in messages] == ['user', 'assistant', 'user', 'assistant']
+        assert messages[2]['content'] == "And for glassware?"
+
+        assert client.post('/switch_chat', json={'session_id': session_id}, headers=headers).status_code == 200
+
+    with app_module.app.app_context():
+        chat_session = app_module.db.session.get(app_module.ChatSession, session_id)
+        assert chat_session.message_count == 4
+        assert app_module.session_sales_metadata(chat_session)['Email'] == 'rep-archive-owner@example.com'
+        assert session_id not in archived_ids(app_module)
+
+
+def test_other_users_cannot_restore_or_open_an_archived_chat(app_module, archived_chat, sales_rep):
+    session_id, _ = archived_chat
+    intruder = sales_rep('rep-archive-intruder')
+    with app_module.app.test_client() as client:
+        assert client.post('/switch_chat', json={'session_id': session_id}, headers=intruder).status_code == 404
+        assert client.get(f'/get_chat_history/{session_id}', headers=intruder).status_code == 404
+
+    with app_module.app.app_context():
+        assert not app_module.restore_archived_session(session_id, 'rep-archive-intruder')
+        assert app_module.db.session.get(app_module.ChatSession, session_id) is None
+        assert session_id in archived_ids(app_module)  # Still archived for its owner
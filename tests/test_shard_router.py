@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from services.shard_router import ShardRouter, jump_hash
+
+USERS = [f"user-{i}" for i in range(2000)]
+
+
+def test_single_shard_is_the_original_database(tmp_path):
+    router = ShardRouter(str(tmp_path), shard_count=1)
+    assert {router.shard_for(user) for user in USERS} == {0}
+    assert router.path(0) == str(tmp_path / 'chat_sessions.db')
+    assert router.binds() == {}
+
+
+def test_users_spread_over_shards_and_stay_put(tmp_path):
+    router = ShardRouter(str(tmp_path), shard_count=4)
+    shards = [router.shard_for(user) for user in USERS]
+    assert shards == [router.shard_for(user) for user in USERS]
+    counts = [shards.count(shard) for shard in range(4)]
+    assert min(counts) > len(USERS) / 4 * 0.8
+    assert router.shard_for(None) == 0 and router.shard_for('') == 0
+
+
+def test_adding_a_shard_moves_only_its_share_of_users(tmp_path):
+    before = ShardRouter(str(tmp_path), shard_count=4)
+    after = ShardRouter(str(tmp_path), shard_count=5)
+    moved = [user for user in USERS if before.shard_for(user) != after.shard_for(user)]
+    assert all(after.shard_for(user) == 4 for user in moved)  # Only onto the new shard
+    assert len(moved) < len(USERS) / 5 * 1.25
+
+
+def test_jump_hash_stays_in_range():
+    assert all(0 <= jump_hash(key, 7) < 7 for key in range(1000))
+    assert jump_hash(12345, 1) == 0
+
+
+def test_paths_and_binds(tmp_path):
+    router = ShardRouter(str(tmp_path), shard_count=3)
+    assert router.bind_key(0) is None
+    assert router.binds() == {
+        'shard1': f"sqlite:///{tmp_path / 'chat_sessions_shard1.db'}",
+        'shard2': f"sqlite:///{tmp_path / 'chat_sessions_shard2.db'}",
+    }
+    with pytest.raises(ValueError):
+        ShardRouter(str(tmp_path), shard_count=0)
+
+
+def test_selected_shard_is_scoped_to_the_request(tmp_path):
+    router = ShardRouter(str(tmp_path), shard_count=4)
+    user = next(user for user in USERS if router.shard_for(user) == 3)
+    seen_elsewhere = []
+
+    token = router.select(user)
+    thread = threading.Thread(target=lambda: seen_elsewhere.append(router.current()))
+    thread.start()
+    thread.join()
+    assert router.current() == 3
+    router.reset(token)
+
+    assert router.current() == 0
+    assert seen_elsewhere == [0]  # Another request's thread doesn't see it
+    assert router.stats()['requests_routed'] == [0, 0, 0, 1]
+
+
+def test_for_each_shard_runs_a_task_in_every_shard(tmp_path):
+    router = ShardRouter(str(tmp_path), shard_count=3)
+    visited = []
+
+    def task():
+        visited.append(router.current())
+        return 2
+
+    assert router.for_each_shard(task)() == 6
+    assert visited == [0, 1, 2]
+    assert router.current() == 0
@@ -0,0 +1,130 @@
+import datetime
+import json
+import os
+
+import pytest
+
+from services.telemetry import HourlyBlobNames, TelemetrySpool, TelemetryWriter, hourly_partition
+
+
+class Storage:
+    """An append(stream, data) that records appended records, or fails while `down` is set."""
+
+    def __init__(self, down=False):
+        self.down = down
+        self.appends = []
+
+    def __call__(self, stream, data):
+        if self.down:
+            raise ConnectionError("storage account unreachable")
+        self.appends.append((stream, [json.loads(line) for line in data.splitlines()]))
+
+    def records(self, stream):
+        return [record for appended, records in self.appends if appended == stream for record in records]
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return TelemetrySpool(str(tmp_path / 'spool'))
+
+
+def test_disabled_writer_appends_synchronously():
+    storage = Storage()
+    writer = TelemetryWriter(storage, enabled=False)
+    assert writer.log('chats', {'n': 1})
+    assert storage.appends == [('chats', [{'n': 1}])]
+
+
+def test_records_are_batched_per_stream():
+    storage = Storage()
+    writer = TelemetryWriter(storage, flush_interval_seconds=0.2)
+    for n in range(3):
+        writer.log('chats', {'n': n})
+    writer.log('feedback', {'n': 'f'})
+    writer.start()
+    writer.close()
+
+    assert sorted(storage.appends) == [('chats', [{'n': 0}, {'n': 1}, {'n': 2}]), ('feedback', [{'n': 'f'}])]
+    assert writer.stats()['appends'] == 2 and writer.stats()['written'] == 4
+
+
+def test_failed_appends_are_dropped_without_a_spool():
+    writer = TelemetryWriter(Storage(down=True), enabled=False, max_attempts=1)
+    assert not writer.log('chats', {'n': 1})
+    assert writer.stats()['dropped_failed'] == 1
+
+
+def test_spooled_records_are_replayed_once_storage_is_back(spool):
+    storage = Storage(down=True)
+    writer = TelemetryWriter(storage, enabled=False, max_attempts=1, spool=spool, spool_retry_seconds=60)
+    for n in range(3):
+        assert writer.log('chats', {'n': n})
+    assert writer.stats()['spooled'] == 3
+    assert spool.stats()['segments'] == 1
+
+    storage.down = False
+    writer.retry_at = 0.0  # spool_retry_seconds have passed
+    writer._replay_segment()
+    assert storage.records('chats') == [{'n': 0}, {'n': 1}, {'n': 2}]
+    assert writer.stats()['replayed'] == 3
+    assert spool.stats()['segments'] == 0
+
+
+def test_replay_that_fails_again_is_not_counted_as_replayed(spool):
+    storage = Storage(down=True)
+    writer = TelemetryWriter(storage, enabled=False, max_attempts=1, spool=spool)
+    writer.log('chats', {'n': 1})
+    writer.retry_at = 0.0  # Due for another try, but storage is still down
+
+    writer._replay_segment()
+    assert writer.stats()['replayed'] == 0
+    assert writer.stats()['spooled'] == 2  # Spooled again rather than lost
+    storage.down = False
+    writer.retry_at = 0.0
+    writer._replay_segment()
+    assert storage.records('chats') == [{'n': 1}]
+
+
+def test_full_spool_drops_records(tmp_path):
+    spool = TelemetrySpool(str(tmp_path / 'spool'), max_bytes=10)
+    writer = TelemetryWriter(Storage(down=True), enabled=False, max_attempts=1, spool=spool)
+    assert not writer.log('chats', {'message': 'more than ten bytes'})
+    assert writer.stats()['dropped_failed'] == 1
+
+
+def test_segments_left_by_an_exited_worker_are_drained(tmp_path):
+    directory = tmp_path / 'spool'
+    directory.mkdir()
+    # An unlocked .open segment from a crashed process, with a torn last line
+    (directory / '999-1-1.open').write_bytes(b'chats\t{"n": 1}\nchats\t{"n": 2}\nchats\t{"n"')
+
+    spool = TelemetrySpool(str(directory))
+    path = spool.claim()
+    assert path.endswith('.drain')
+    assert [json.loads(line) for _, line in spool.read(path)] == [{'n': 1}, {'n': 2}]
+    spool.remove(path)
+    assert os.listdir(directory) == []
+
+
+def test_locked_segment_is_not_claimed_by_another_worker(spool):
+    spool.write([('chats', b'{"n": 1}\n')])  # This worker's open segment, flocked
+    other = TelemetrySpool(spool.directory)
+    assert other.claim() is None
+    spool.seal()
+    assert other.claim() is not None
+
+
+def test_blob_names_roll_at_the_block_limit():
+    names = HourlyBlobNames(max_blocks=2)
+    partition = hourly_partition('chats', datetime.datetime(2024, 5, 1, 13, 45))
+    assert partition == 'chats/2024/05/01/13'
+
+    first = names.blob_name(partition, 'chat_log')
+    names.appended(partition)
+    names.appended(partition)
+    second = names.blob_name(partition, 'chat_log')
+    assert first.endswith(f"-{os.getpid()}.jsonl") and second.endswith(f"-{os.getpid()}_1.jsonl")
+
+    names.roll(partition)  # Storage reported the blob full
+    assert names.blob_name(partition, 'chat_log').endswith('_2.jsonl')
+    assert names.stats()['rolls'] == 2
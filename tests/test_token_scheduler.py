@@ -0,0 +1,90 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import config
+from services.token_scheduler import AdmissionRejected, TokenRateScheduler, retry_after_seconds
+
+
+def test_requests_within_budget_are_admitted_and_settled_on_actual_usage():
+    scheduler = TokenRateScheduler(global_tpm=6000, per_user_tpm=0)
+    ticket = scheduler.acquire('alice', 5000, timeout=1)
+    assert scheduler.stats()['global_tokens_available'] == 1000
+    ticket.actual_tokens = 1000
+    scheduler.release(ticket)
+    assert scheduler.stats()['global_tokens_available'] == 5000
+
+
+def test_request_over_the_remaining_budget_waits_then_is_rejected():
+    scheduler = TokenRateScheduler(global_tpm=600, per_user_tpm=0)  # Refills 10 tokens/s
+    scheduler.acquire('alice', 600, timeout=1)
+    with pytest.raises(AdmissionRejected):
+        scheduler.acquire('alice', 600, timeout=0.2)
+    assert scheduler.stats()['rejected'] == 1
+
+
+def test_per_user_budget_does_not_hold_back_other_users():
+    scheduler = TokenRateScheduler(global_tpm=0, per_user_tpm=600)
+    scheduler.acquire('alice', 600, timeout=1)
+    with pytest.raises(AdmissionRejected):
+        scheduler.acquire('alice', 600, timeout=0.1)
+    scheduler.acquire('bob', 600, timeout=0.1)
+
+
+def test_waiting_users_are_served_round_robin():
+    scheduler = TokenRateScheduler(global_tpm=60000, per_user_tpm=0)
+    scheduler.pause_for(1.0)
+    order = []
+    grant = scheduler._grant
+
+    def record_grant(ticket, user_bucket):
+        # Threads wake in any order after a grant, so record the order the scheduler granted in
+        order.append(ticket.user_id)
+        grant(ticket, user_bucket)
+
+    scheduler._grant = record_grant
+
+    def ask(user_id):
+        scheduler.acquire(user_id, 10, timeout=5)
+
+    threads = []
+    for queued, user_id in enumerate(['alice', 'alice', 'alice', 'bob'], start=1):
+        threads.append(threading.Thread(target=ask, args=(user_id,)))
+        threads[-1].start()
+        while scheduler.stats()['queue_depth'] < queued:  # Queue in this order, all before the pause ends
+            time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+    assert order == ['alice', 'bob', 'alice', 'alice']  # Not behind all of alice's queued requests
+
+
+def test_retry_after_pauses_admissions():
+    scheduler = TokenRateScheduler(global_tpm=0, per_user_tpm=0)
+    scheduler.pause_for(0.3)
+    started = time.monotonic()
+    scheduler.acquire('alice', 10, timeout=2)
+    assert time.monotonic() - started >= 0.25
+    assert scheduler.stats()['rate_limited'] == 1
+
+
+def test_queue_limit_rejects_immediately():
+    scheduler = TokenRateScheduler(global_tpm=0, per_user_tpm=0, max_queue=0)
+    with pytest.raises(AdmissionRejected):
+        scheduler.acquire('alice', 10, timeout=1)
+
+
+def test_retry_after_headers():
+    def error(headers):
+        return SimpleNamespace(response=SimpleNamespace(headers=headers))
+    assert retry_after_seconds(error({'retry-after-ms': '1500'})) == 1.5
+    assert retry_after_seconds(error({'retry-after': '3'})) == 3.0
+    assert retry_after_seconds(error({})) is None
+
+
+def test_tpm_budget_is_split_across_the_workers_gunicorn_starts(app_module, monkeypatch):
+    monkeypatch.delenv('GUNICORN_WORKERS', raising=False)
+    assert config.gunicorn_workers() == config.DEFAULT_GUNICORN_WORKERS
+    # AZURE_OPENAI_TPM_LIMIT=120000 in the test settings, two workers by default
+    assert app_module.completion_scheduler.global_bucket.capacity == 120000 // config.DEFAULT_GUNICORN_WORKERS
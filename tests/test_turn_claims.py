@@ -0,0 +1,85 @@
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import text
+
+from conftest import send_message
+
+
+@pytest.fixture
+def app_context(app_module):
+    with app_module.app.app_context():
+        yield app_module
+
+
+def current_session_id(client):
+    with client.session_transaction() as cookie:
+        return cookie['session_id']
+
+
+def test_one_claim_per_session(app_context):
+    session_id = str(uuid4())
+    token = app_context.claim_turn(session_id)
+    assert token is not None
+    assert app_context.claim_turn(session_id) is None  # Another tab or worker
+
+    app_context.release_turn(session_id, 'not-the-holder')
+    assert app_context.claim_turn(session_id) is None
+
+    app_context.release_turn(session_id, token)
+    assert app_context.claim_turn(session_id) is not None
+
+
+def test_expired_claim_is_taken_over(app_context, monkeypatch):
+    session_id = str(uuid4())
+    assert app_context.claim_turn(session_id) is not None
+    monkeypatch.setattr(app_context.Config, 'TURN_CLAIM_TIMEOUT_SECONDS', -1)  # The holder's worker crashed
+    assert app_context.claim_turn(session_id) is not None
+
+
+def test_concurrent_message_for_the_same_chat_is_rejected(app_module, completions, sales_rep):
+    headers = sales_rep('rep-claims-1')
+    with app_module.app.test_client() as client:
+        send_message(client, headers, "Which Instapak foam suits heavy parts?")
+        session_id = current_session_id(client)
+        with app_module.app.app_context():
+            token = app_module.claim_turn(session_id)  # A turn in progress in another tab
+
+        response = client.post('/message', data={'question': "And for glassware?"},
+                               headers={**headers, 'Referer': 'http://localhost/'})
+        assert response.status_code == 409
+        assert response.get_json()['conflict'] is True
+        assert len(completions.requests) == 1  # Rejected before any work
+
+        with app_module.app.app_context():
+            app_module.release_turn(session_id, token)
+        send_message(client, headers, "And for glassware?")
+        assert len(completions.requests) == 2
+
+
+def test_turn_that_lost_the_version_race_is_not_committed(app_module, completions, sales_rep):
+    headers = sales_rep('rep-claims-2')
+    with app_module.app.test_client() as client:
+        send_message(client, headers, "Which Instapak foam suits heavy parts?")
+        session_id = current_session_id(client)
+
+        create = completions.create
+
+        def commit_another_turn_meanwhile(**kwargs):
+            # A turn that got past an expired claim commits while this one waits on the model
+            with app_module.app.app_context(), app_module.shard_engine().begin() as conn:
+                conn.execute(text("UPDATE chat_session SET version = version + 1 WHERE id = :id"), {'id': session_id})
+            return create(**kwargs)
+
+        completions.create = commit_another_turn_meanwhile
+        response = client.post('/message', data={'question': "And for glassware?"},
+                               headers={**headers, 'Referer': 'http://localhost/'})
+        assert response.status_code == 409
+
+        completions.create = create
+        with app_module.app.app_context():
+            chat_session = app_module.db.session.get(app_module.ChatSession, session_id)
+            assert chat_session.message_count == 2  # Only the first turn
+            assert chat_session.version == 2
+            assert len(app_module.load_chat_messages(session_id)) == 2
+            assert app_module.claim_turn(session_id) is not None  # The losing turn released its claim
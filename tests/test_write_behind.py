@@ -0,0 +1,97 @@
+import threading
+
+from services.write_behind import WriteBehindQueue
+
+
+class Recorder:
+    """An apply_batch that records batches and fails any batch holding a poisoned item."""
+
+    def __init__(self, poisoned=()):
+        self.batches = []
+        self.poisoned = set(poisoned)
+
+    def __call__(self, items):
+        if self.poisoned & set(items):
+            raise RuntimeError("constraint failed")
+        self.batches.append(list(items))
+
+
+def test_queued_writes_are_applied_in_one_batch():
+    apply = Recorder()
+    writer = WriteBehindQueue(apply, batch_size=50)
+    for n in range(3):
+        assert writer.submit(f"session-{n}", f"turn-{n}")
+    assert not writer.wait_for('session-1', timeout=0.01)  # Still pending
+
+    writer.close()
+    assert apply.batches == [['turn-0', 'turn-1', 'turn-2']]
+    assert writer.wait_for('session-1', timeout=0.01)
+    assert writer.stats()['written'] == 3 and writer.stats()['batches'] == 1
+
+
+def test_reader_waits_for_its_own_pending_write():
+    release = threading.Event()
+    applied = []
+
+    def slow_apply(items):
+        release.wait(5)
+        applied.extend(items)
+
+    writer = WriteBehindQueue(slow_apply)
+    writer.start()
+    writer.submit('session-a', 'turn-1')
+    assert not writer.wait_for('session-a', timeout=0.1)
+    release.set()
+    assert writer.wait_for('session-a', timeout=5)
+    assert applied == ['turn-1']
+    writer.close()
+
+
+def test_failing_batch_drops_only_the_failing_item():
+    apply = Recorder(poisoned={'bad'})
+    dropped = []
+    writer = WriteBehindQueue(apply, max_attempts=2, on_drop=dropped.append)
+    for key, item in [('a', 'good-1'), ('b', 'bad'), ('c', 'good-2')]:
+        writer.submit(key, item)
+
+    writer.close()
+    assert apply.batches == [['good-1'], ['good-2']]
+    assert dropped == ['bad']
+    stats = writer.stats()
+    assert (stats['written'], stats['dropped'], stats['retries']) == (2, 1, 1)
+    assert all(writer.wait_for(key, timeout=0.01) for key in 'abc')
+
+
+def test_drop_handler_errors_are_contained():
+    def broken_handler(item):
+        raise RuntimeError("release failed")
+
+    writer = WriteBehindQueue(Recorder(poisoned={'bad'}), max_attempts=1, on_drop=broken_handler)
+    writer.submit('a', 'bad')
+    writer.close()
+    assert writer.stats()['dropped'] == 1
+
+
+def test_partitions_are_applied_separately():
+    apply = Recorder()
+    writer = WriteBehindQueue(apply, partition=lambda item: item.split(':')[0])
+    for key, item in [('a', 'shard0:t1'), ('b', 'shard1:t2'), ('c', 'shard0:t3')]:
+        writer.submit(key, item)
+
+    writer.close()
+    assert sorted(apply.batches) == [['shard0:t1', 'shard0:t3'], ['shard1:t2']]
+
+
+def test_full_queue_hands_the_write_back():
+    writer = WriteBehindQueue(Recorder(), max_queue=1)
+    assert writer.submit('a', 'turn-1')
+    assert not writer.submit('b', 'turn-2')  # Caller commits it synchronously
+    assert writer.wait_for('b', timeout=0.01)
+    assert writer.stats()['rejected_full'] == 1
+
+
+def test_disabled_or_closed_queue_rejects_writes():
+    assert not WriteBehindQueue(Recorder(), enabled=False).submit('a', 'turn-1')
+    writer = WriteBehindQueue(Recorder())
+    writer.close()
+    assert not writer.submit('a', 'turn-1')